@@ -0,0 +1,62 @@
+"""Общее для скриптов benchmarks/: синтетическая сцена и замер лучшего времени.
+
+Импортируется после того, как скрипт выставил QT_QPA_PLATFORM и добавил корень
+репозитория в sys.path. Шум в картинках генерируется numpy одним буфером.
+"""
+import time
+import random
+
+import numpy as np
+from PySide6.QtGui import QImage, QPen, QColor
+
+import main
+
+
+def noise_image(size: int, rng: np.random.Generator) -> QImage:
+    """Картинка size×size: заливка одним цветом и 2·size случайных пикселей,
+    чтобы PNG не сжимался в ничто."""
+    buf = np.full(size * size, 0xFF000000 | int(rng.integers(0, 1 << 24)), dtype=np.uint32)
+    buf[rng.integers(0, size * size, size * 2)] = rng.integers(0, 1 << 32, size * 2, dtype=np.uint32)
+    # QImage не владеет буфером — копия отвязывает её от массива
+    return QImage(buf.data, size, size, QImage.Format_RGB32).copy()
+
+
+def synthetic_scene(n_items: int, n_images: int, size: int, seed: int = 1) -> main.Scene:
+    """Сцена из n_items элементов: PNG из n_images разных картинок, лучи и компоненты."""
+    rnd = random.Random(seed)
+    rng = np.random.default_rng(seed)
+    images = [main.PIXMAP_CACHE.from_bytes(main.image_to_png_bytes(noise_image(size, rng)))
+              for _ in range(n_images)]
+
+    scene = main.Scene()
+    scene.setSceneRect(main.canvas_rect(4000, 3000))
+    layers = main.LAYER_NAMES[1:]
+    for i in range(n_items):
+        x, y = rnd.uniform(-1500, 2500), rnd.uniform(-1100, 1900)
+        kind = rnd.random()
+        if kind < 0.8:
+            obj = main.ScalablePixmapItem(images[i % n_images])
+            obj.setPos(x, y)
+            if rnd.random() < 0.5:
+                obj.setRotation(rnd.choice((90, 180, 270, 45)))
+            obj.setScale(rnd.choice((1.0, 1.0, 0.5, 0.25)))
+        elif kind < 0.9:
+            obj = main.LaserLine(x, y, x + rnd.uniform(-400, 400), y + rnd.uniform(-400, 400))
+            pen = QPen(QColor(255, 0, 0, 255), 2.5)
+            pen.setCosmetic(True)
+            obj.setPen(pen)
+        else:
+            obj = main.DraggableComponent("Компонент")
+            obj.setPos(x, y)
+        scene.addItem(obj)
+        main.set_item_layer(obj, rnd.choice(layers))
+    return scene
+
+
+def best_of(repeat: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
@@ -0,0 +1,247 @@
+"""Замеры горячих путей редактора на синтетических сценах (offscreen).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_editor.py
+    python benchmarks/bench_editor.py --sizes 100,1000 --repeat 5 --json bench.json
+    python benchmarks/bench_editor.py --json new.json --compare old.json
+
+Для каждого размера сцены (100 / 1000 / 10000 элементов по умолчанию) строится
+проект из PNG, компонентов и лучей (как example.json, только крупнее) и библиотека
+components/ из сгенерированных картинок. Затем в настоящем MainWindow меряются:
+открытие и сохранение проекта, экспорт PNG, построение дерева компонентов, поиск,
+переключение видимости слоя, копирование/вставка, полная перерисовка вида и кадры
+перетаскивания/прокрутки (с полным качеством и в быстром режиме взаимодействия).
+
+Диалоги выбора файла подменяются: методы окна получают пути сразу. Настройки и
+автосохранение пишутся во временную папку, лучи от источников выключены.
+Результаты (лучшее время из --repeat, в секундах) пишутся в JSON; с --compare
+печатается отношение к прошлому прогону, замедления больше --threshold помечаются.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+_SANDBOX = tempfile.mkdtemp(prefix="optics_bench_")
+atexit.register(shutil.rmtree, _SANDBOX, True)  # настройки, журнал и кэш иконок прогона
+os.environ["XDG_CONFIG_HOME"] = os.path.join(_SANDBOX, "config")  # QSettings
+os.environ["XDG_DATA_HOME"] = os.path.join(_SANDBOX, "data")      # автосохранение
+os.environ["XDG_CACHE_HOME"] = os.path.join(_SANDBOX, "cache")    # кэш иконок
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PySide6
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage, QColor, QTransform
+
+import main
+from _common import synthetic_scene, best_of
+
+LIBRARY_FOLDERS = ["Зеркала", "Линзы", "Источники", "Детекторы", "Фильтры",
+                   "Призмы", "Волокно", "Модуляторы", "Поляризаторы", "Разное"]
+SEARCH_QUERIES = ["линза", "zerkalo", "Theta", "детектр", "ф"]
+
+
+class _Dialogs:
+    """Вместо QFileDialog: отдаёт заранее заданные пути."""
+    open_path = ""
+    save_path = ""
+
+    @classmethod
+    def getOpenFileName(cls, *args, **kwargs):
+        return cls.open_path, ""
+
+    @classmethod
+    def getSaveFileName(cls, *args, **kwargs):
+        return cls.save_path, ""
+
+
+def make_library(root: str, n_files: int, seed: int = 2):
+    """Папка компонентов из n_files маленьких PNG, разложенных по LIBRARY_FOLDERS."""
+    rnd = random.Random(seed)
+    for i in range(n_files):
+        folder = os.path.join(root, LIBRARY_FOLDERS[i % len(LIBRARY_FOLDERS)])
+        os.makedirs(folder, exist_ok=True)
+        img = QImage(48, 32, QImage.Format_ARGB32)
+        img.fill(QColor(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), 255))
+        name = f"{rnd.choice(('линза', 'зеркало', 'детектор', 'фильтр', 'призма'))} {i}.png"
+        img.save(os.path.join(folder, name))
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def bench_size(window: main.MainWindow, n_items: int, repeat: int, tmp: str) -> dict:
+    project = os.path.join(tmp, f"project_{n_items}.json")
+    scene = synthetic_scene(n_items, max(1, min(50, n_items // 20)), 128)
+    main.save_project_scene(scene, project)
+    scene.clear()
+    main.PIXMAP_CACHE.clear()
+
+    library = os.path.join(tmp, f"library_{n_items}")
+    make_library(library, min(n_items, 2000))
+
+    results = {}
+
+    def load():
+        main.PIXMAP_CACHE.clear()
+        _Dialogs.open_path = project
+        window.load_project_json()
+    results["load_project_json"] = best_of(repeat, load)
+    assert sum(1 for _ in window.iter_scene_items()) == n_items
+
+    _Dialogs.save_path = os.path.join(tmp, "saved.json")
+    results["save_project_json"] = best_of(repeat, window.save_project_json)
+
+    _Dialogs.save_path = os.path.join(tmp, "export.png")
+    results["export_canvas_png"] = best_of(repeat, window.export_canvas_png)
+
+    window.components_dir = library
+    results["populate_components_tree"] = best_of(repeat, window.populate_components_tree)
+    results["apply_component_filter"] = best_of(
+        repeat, lambda: [window.apply_component_filter(q) for q in SEARCH_QUERIES]) / len(SEARCH_QUERIES)
+    window.apply_component_filter("")
+
+    layer_item = window.layers_list.item(2)
+
+    def toggle_layer():
+        layer_item.setCheckState(Qt.Unchecked)  # itemChanged -> apply_layer_visibility
+        layer_item.setCheckState(Qt.Checked)
+    results["apply_layer_visibility"] = best_of(repeat, toggle_layer) / 2
+
+    sel = list(window.iter_scene_items())[:max(1, n_items // 10)]
+
+    def copy_paste():
+        window.scene.clearSelection()
+        for it in sel:
+            it.setSelected(True)
+        t = time.perf_counter()
+        window.copy_selection()
+        window.paste_clipboard()
+        elapsed = time.perf_counter() - t
+        window.undo()  # сцена возвращается к исходному размеру
+        return elapsed
+    results["copy_paste_10pct"] = min(copy_paste() for _ in range(repeat))
+    window.scene.clearSelection()
+
+    window.view.fitInView(window.scene.sceneRect(), Qt.KeepAspectRatio)
+    results["viewport_repaint"] = best_of(repeat, lambda: window.view.viewport().grab())
+
+    results.update(bench_interaction(window.view, repeat))
+
+    window.scene.clear()
+    main.PIXMAP_CACHE.clear()
+    return results
+
+
+def bench_interaction(view: main.GraphicsView, repeat: int, frames: int = 10) -> dict:
+    """Кадр перетаскивания (50 картинок на 3 px) и прокрутки (20 px) в масштабе 1:1:
+    с полным качеством (как без режима взаимодействия) и в быстром режиме."""
+    view.setTransform(QTransform())
+    view.centerOn(view.scene().sceneRect().center())
+    QApplication.processEvents()
+    moving = [it for it in view.items(view.viewport().rect())
+              if isinstance(it, main.ScalablePixmapItem)][:50]
+    bar = view.horizontalScrollBar()
+
+    def drag(begin):
+        for _ in range(frames):
+            begin()  # так делает mouseMoveEvent на каждое движение мыши
+            for it in moving:
+                it.moveBy(3, 0)
+            QApplication.processEvents()  # обработка «грязных» областей и перерисовка
+        for it in moving:
+            it.moveBy(-3 * frames, 0)
+
+    def pan(begin):
+        for i in range(frames):
+            begin()
+            bar.setValue(bar.value() + (20 if i < frames // 2 else -20))
+            QApplication.processEvents()
+
+    results = {}
+    fast_begin = view.begin_interaction
+    view.begin_interaction = lambda *args, **kwargs: None  # полное качество на каждом кадре
+    results["drag_frame"] = best_of(repeat, lambda: drag(lambda: None)) / frames
+    results["pan_frame"] = best_of(repeat, lambda: pan(lambda: None)) / frames
+    del view.begin_interaction
+    results["drag_frame_fast"] = best_of(repeat, lambda: drag(fast_begin)) / frames
+    results["pan_frame_fast"] = best_of(repeat, lambda: pan(fast_begin)) / frames
+    view.end_interaction()
+    return results
+
+
+def compare(results: dict, old: dict, threshold: float):
+    print(f"\nсравнение с {old.get('revision') or 'прошлым прогоном'} (новое / старое):")
+    for size, metrics in results.items():
+        for name, value in metrics.items():
+            before = old.get("results", {}).get(size, {}).get(name)
+            if not before:
+                continue
+            ratio = value / before
+            mark = "  <-- медленнее" if ratio > 1 + threshold else ""
+            print(f"  {size:>6} {name:<26}{ratio:>7.2f}x{mark}")
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000", help="размеры сцен через запятую")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов (берётся лучшее время)")
+    parser.add_argument("--json", help="куда записать результаты")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="замедление, начиная с которого строка помечается (доля)")
+    args = parser.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    app = QApplication.instance() or QApplication([])
+    main.QFileDialog = _Dialogs
+    window = main.MainWindow()
+    window.set_beams_enabled(False)
+    window.resize(1300, 880)
+    window.show()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            results[str(n)] = bench_size(window, n, args.repeat, tmp)
+            print(f"{n} элементов:")
+            for name, value in results[str(n)].items():
+                print(f"  {name:<26}{value * 1000:>10.1f} мс")
+
+    report = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pyside": PySide6.__version__,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f), args.threshold)
+
+    window.close()
+    del window, app
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
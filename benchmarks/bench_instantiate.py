@@ -0,0 +1,85 @@
+"""Массовое создание элементов: instantiate_items против поштучной вставки.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_instantiate.py
+    python benchmarks/bench_instantiate.py --sizes 1000,5000,10000,20000 --repeat 3
+
+Словари элементов берутся из synthetic_scene (как при открытии проекта). Для каждого
+размера меряется время на элемент: если загрузка линейна, мкс/элемент не растут
+с размером. «поштучно» — прежний путь: addItem, затем каждый сеттер уже на сцене.
+"""
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QPointF
+
+import main
+from _common import synthetic_scene
+
+
+def item_dicts(n_items: int) -> tuple:
+    """(словари элементов, таблица картинок) — как после разбора проекта."""
+    scene = synthetic_scene(n_items, max(1, min(50, n_items // 20)), 64)
+    assets = {}
+    dicts = [main.serialize_item(it, assets) for it in main.iter_project_items(scene)]
+    images = {it.image.key: it.image for it in scene.items() if isinstance(it, main.ScalablePixmapItem)}
+    scene.clear()
+    return dicts, images
+
+
+def one_by_one(scene: main.Scene, dicts: list, delta: QPointF, images: dict):
+    """Прежний путь: элемент сначала попадает на сцену, потом получает свойства."""
+    for d in dicts:
+        obj = main.build_item(dict(d, pos=[0, 0], rotation=0.0, opacity=1.0, scale=1.0,
+                                   transform=[1, 0, 0, 0, 1, 0, 0, 0, 1], layer=None), delta, images)
+        scene.addItem(obj)
+        if "pos" in d:
+            obj.setPos(d["pos"][0], d["pos"][1])
+            obj.setRotation(d.get("rotation", 0.0))
+            obj.setOpacity(d.get("opacity", 1.0))
+            obj.setTransform(main.transform_from_list(d["transform"]))
+            if "scale" in d:
+                obj.setScale(d["scale"])
+        main.set_item_layer(obj, d["layer"])
+
+
+def measure(fn, dicts: list, images: dict, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        scene = main.Scene()
+        scene.setSceneRect(main.canvas_rect(4000, 3000))
+        t = time.perf_counter()
+        fn(scene, dicts, QPointF(0, 0), images)
+        scene.itemsBoundingRect()  # запрос к сцене: индекс должен быть готов
+        scene.items(scene.sceneRect().adjusted(0, 0, -3000, -2000))
+        best = min(best, time.perf_counter() - t)
+        scene.clear()
+    return best
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,2500,5000,10000,20000", help="размеры через запятую")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов (берётся лучшее время)")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication([])
+    print(f"{'элементов':>10}{'пачкой, мс':>14}{'мкс/эл.':>10}{'поштучно, мс':>15}{'мкс/эл.':>10}")
+    for n in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        dicts, images = item_dicts(n)
+        bulk = measure(main.instantiate_items, dicts, images, args.repeat)
+        single = measure(one_by_one, dicts, images, args.repeat)
+        print(f"{n:>10}{bulk * 1000:>14.1f}{bulk / n * 1e6:>10.1f}{single * 1000:>15.1f}{single / n * 1e6:>10.1f}")
+        main.PIXMAP_CACHE.clear()
+    del app
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,73 @@
+"""Сравнение форматов проекта: JSON и .optz (время сохранения/открытия и размер).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_project_formats.py
+    python benchmarks/bench_project_formats.py --items 5000 --images 40 --size 256
+    python benchmarks/bench_project_formats.py --project example.json
+
+Работает без окна (offscreen). Перед каждым открытием кэш картинок очищается,
+так что в замер входит и декодирование PNG.
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6.QtWidgets import QApplication
+
+import main
+from _common import synthetic_scene, best_of
+
+
+def bench(scene: main.Scene, repeat: int, components_dir: str) -> list:
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for ext in (".json", main.PROJECT_OPTZ_EXT):
+            path = os.path.join(tmp, "project" + ext)
+            save = best_of(repeat, lambda: main.save_project_scene(scene, path))
+
+            def load():
+                main.PIXMAP_CACHE.clear()
+                loaded = main.load_project_scene(path, components_dir)
+                loaded.clear()
+            load_time = best_of(repeat, load)
+            rows.append((ext, os.path.getsize(path), save, load_time))
+    return rows
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=2000, help="элементов в синтетической сцене")
+    parser.add_argument("--images", type=int, default=50, help="разных картинок в сцене")
+    parser.add_argument("--size", type=int, default=256, help="сторона картинки, px")
+    parser.add_argument("--project", help="взять готовый проект вместо синтетической сцены")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов (берётся лучшее время)")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication([])
+    components_dir = os.path.join(os.path.dirname(os.path.abspath(main.__file__)), main.COMPONENTS_DIR_NAME)
+    if args.project:
+        scene = main.load_project_scene(args.project, components_dir)
+        title = args.project
+    else:
+        scene = synthetic_scene(args.items, args.images, args.size)
+        title = f"{args.items} элементов, {args.images} картинок {args.size}×{args.size}"
+    n = sum(1 for _ in main.iter_project_items(scene))
+
+    rows = bench(scene, args.repeat, components_dir)
+    print(f"{title} ({n} элементов в сцене), лучшее из {args.repeat}")
+    print(f"{'формат':<8}{'размер, КБ':>12}{'сохранение, с':>16}{'открытие, с':>14}")
+    for ext, size, save, load in rows:
+        print(f"{ext:<8}{size / 1024:>12.0f}{save:>16.3f}{load:>14.3f}")
+
+    scene.clear()
+    main.PIXMAP_CACHE.clear()
+    del app
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,17 +1,28 @@
 from __future__ import annotations
-import sys, os, json, base64, glob
+import sys, os, re, abc, json, shutil, base64, glob, hashlib, struct, zlib, zipfile, mmap, uuid, argparse, atexit, multiprocessing, threading, queue, time, functools, contextlib
 from typing import Optional
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PySide6.QtWidgets import (
-    QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
+    QApplication, QStyle, QStyleOptionGraphicsItem, QGraphicsItem, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QGraphicsView, QGraphicsScene, QGraphicsRectItem,
-    QGraphicsLineItem, QFileDialog, QLabel, QGraphicsPixmapItem,
-    QListWidget, QListWidgetItem, QComboBox, QSpinBox, QCheckBox, QMessageBox, QTreeWidget, QTreeWidgetItem, QLineEdit
+    QGraphicsLineItem, QGraphicsPathItem, QFileDialog, QLabel, QGraphicsPixmapItem,
+    QListWidget, QListWidgetItem, QComboBox, QSpinBox, QCheckBox, QMessageBox, QTreeWidget, QTreeWidgetItem, QLineEdit,
+    QProgressDialog, QMenu, QInputDialog
 )
-from PySide6.QtCore import Qt, QPointF, QRectF, QBuffer, QByteArray, QIODevice, QSize, QEvent
-from PySide6.QtGui import QPen, QPainterPath, QBrush, QColor, QPixmap, QPainter, QTransform, QImage, QIcon, QCursor, QKeySequence, QShortcut
+from PySide6.QtCore import (
+    Qt, QPointF, QRectF, QSizeF, QLineF, QBuffer, QByteArray, QIODevice, QSize, QEvent,
+    QObject, QRunnable, QThreadPool, QStandardPaths, Signal, QFileSystemWatcher, QTimer, QSettings, QMimeData, QMarginsF, QLockFile
+)
+from PySide6.QtGui import QPen, QPainterPath, QBrush, QColor, QPixmap, QPainter, QTransform, QImage, QIcon, QCursor, QKeySequence, QShortcut, QImageReader, QPixmapCache, QPdfWriter, QPageSize
 import math
+try:
+    import numpy as np
+except ImportError:  # без numpy редактор работает, только лучи от источников не считаются
+    np = None
 
 GRID_SIZE = 40
+GRID_MIN_PIXEL_STEP = 6  # если шаг сетки на экране меньше (в px) — линии не рисуем
 SCENE_WIDTH = 1000
 SCENE_HEIGHT = 800
 
@@ -19,15 +30,102 @@ SCENE_HEIGHT = 800
 COMPONENTS_DIR_NAME = "components"
 
 # ---- СЛОИ ----
+# слои по умолчанию; список слоёв сцены пользователь может менять (Scene.layer_names)
 LAYER_NAMES = ["Сетка", "Слой 0", "Слой 1", "Слой 2", "Слой 3", "Слой 4"]
 LAYER_Z = {name: (-100 if name == "Сетка" else i * 10) for i, name in enumerate(LAYER_NAMES)}
 
+# ---- ФОРМАТ ПРОЕКТА ----
+# v1: у каждого png-элемента свой png_b64
+# v2: картинки лежат один раз в таблице "assets" (ключ — sha1 содержимого),
+#     элементы ссылаются на них через "asset"
+PROJECT_FORMAT_VERSION = 2
+# компактный контейнер: zip с двоичной таблицей элементов и PNG без base64
+PROJECT_OPTZ_EXT = ".optz"
+OPTZ_TABLE_NAME = "project.bin"
+OPTZ_TABLE_MAGIC = b"OPTI"
+OPTZ_TABLE_VERSION = 2  # v2: в конце таблицы — список слоёв
+PROJECT_OPTZ_FILTER = "Компактный проект (*.optz)"
+PROJECT_SAVE_FILTERS = "JSON Files (*.json);;" + PROJECT_OPTZ_FILTER
+PROJECT_OPEN_FILTERS = "Проекты (*.json *.optz);;JSON Files (*.json);;" + PROJECT_OPTZ_FILTER
+
+# ---- КЭШ КАРТИНОК ----
+# сколько байт декодированных картинок держим в общем кэше (LRU)
+PIXMAP_CACHE_BUDGET = 256 * 1024 * 1024
+# уровни детализации: при отдалении спрайт рисуется из уменьшенной копии (mip),
+# а если на экране он меньше LOD_PLACEHOLDER_PX — просто прямоугольником среднего цвета
+LOD_PLACEHOLDER_PX = 4
+
+# ---- ЭКСПОРТ ----
+EXPORT_STRIP_BYTES = 32 * 1024 * 1024  # память под одну полосу рендера при экспорте PNG
+EXPORT_FORMATS = {"PNG Files (*.png)": ".png", "SVG (*.svg)": ".svg", "PDF (*.pdf)": ".pdf"}
+
+# ---- ВЗАИМОДЕЙСТВИЕ ----
+INTERACTION_IDLE_MS = 150        # через столько после последнего перетаскивания/зума возвращается полное качество
+INTERACTION_CACHE_BYTES = 64 * 1024 * 1024  # QPixmapCache под кэши видимых элементов на время взаимодействия
+
+# ---- ИКОНКИ БИБЛИОТЕКИ ----
+THUMB_SIZE = 40
+THUMBS_PER_JOB = 16  # сколько файлов обрабатывает одна фоновая задача
+WATCH_DEBOUNCE_MS = 250  # пачка событий файловой системы обрабатывается одним проходом
+SEARCH_DEBOUNCE_MS = 120  # поиск запускается, когда пользователь перестал печатать
+
+# ---- ОПТИМИЗАЦИЯ БИБЛИОТЕКИ ----
+# облегчённые копии PNG лежат в components/.optimized/ (та же структура папок) с manifest.json
+ASSET_BUILD_DIR_NAME = ".optimized"
+ASSET_MANIFEST_NAME = "manifest.json"
+ASSET_BUILD_VERSION = 2  # меняется вместе с алгоритмом: старые копии пересобираются
+ASSET_MAX_PX = 512       # большая сторона копии; на холсте она растягивается до исходного размера
+ASSET_TRIM_ALPHA = 8     # пиксели прозрачнее этого считаются пустым полем при обрезке
+# текстовый блок PNG копии: "x y w h W H" — куда внутри исходного W×H рисуется копия
+ASSET_FRAME_TEXT = "optics-frame"
+
+# ---- СОХРАНЕНИЕ/ЗАГРУЗКА ----
+SAVE_BATCH_ITEMS = 200   # сколько элементов сериализуется между обработками событий
+LOAD_BATCH_ITEMS = 200   # сколько элементов создаётся на сцене за один проход
+LOAD_QUEUE_EVENTS = 256  # сколько разобранных записей может ждать GUI-поток
+BULK_INDEX_ITEMS = 500   # пачка от стольких элементов вставляется без BSP-индекса сцены
+ITEMS_MIME_TYPE = "application/x-optics-items"  # элементы в системном буфере обмена (JSON)
+
+# ---- АВТОСОХРАНЕНИЕ ----
+AUTOSAVE_INTERVAL_MS = 2000      # как часто изменения сцены уходят в журнал
+AUTOSAVE_COMPACT_RECORDS = 5000  # после стольких записей журнал сворачивается в снимок
+AUTOSAVE_LOCK_NAME = "session.lock"  # держит живой процесс; свободен — сессия упала
+
+# ---- ИСТОРИЯ ----
+UNDO_MEMORY_BUDGET = 8 * 1024 * 1024  # сколько байт может занимать история; старые шаги вытесняются
+UNDO_ITEM_BYTES = 512  # оценка памяти под ссылку на удалённый/добавленный элемент
+
+# ---- ЛУЧИ ----
+BEAM_MAX_BOUNCES = 64   # сколько раз луч может отразиться/преломиться/разделиться
+BEAM_MIN_POWER = 0.02   # более слабые ветви (после делителей и фильтров) не трассируются
+BEAM_UPDATE_MS = 15     # изменения сцены пересчитываются пачкой, не чаще раза в кадр
+BEAM_Z = 1000           # лучи рисуются поверх всех слоёв
+PORT_SNAP_PX = 12       # на каком расстоянии (px экрана) конец луча прилипает к порту компонента
+# порты компонента — точки в долях boundingRect: центр, середины краёв (left/right лежат на оси)
+ITEM_PORTS = {"center": (0.5, 0.5), "left": (0.0, 0.5), "right": (1.0, 0.5),
+              "top": (0.5, 0.0), "bottom": (0.5, 1.0)}
+
+# ---- ПРОФИЛИРОВАНИЕ ----
+PROFILE_ENV = "OPTICS_PROFILE"   # OPTICS_PROFILE=1 — замеры включены с запуска
+PROFILE_MAX_EVENTS = 200_000     # столько последних интервалов хранится для трассы
+PROFILE_OVERLAY_MS = 500         # период обновления оверлея со статистикой
+PROFILE_OVERLAY_ROWS = 12
+
+ITEM_UID_ROLE = Qt.UserRole + 1  # постоянный id элемента (для журнала автосохранения)
+
 def get_item_layer(item):
     return item.data(Qt.UserRole)
 
 def set_item_layer(item, layer_name: str):
+    old = item.data(Qt.UserRole)
     item.setData(Qt.UserRole, layer_name)
-    item.setZValue(LAYER_Z.get(layer_name, 0))
+    sc = item.scene()
+    if hasattr(sc, "item_layer_changed"):
+        sc.item_layer_changed(item, old)  # индекс слоёв сцены: z и видимость
+    else:
+        item.setZValue(LAYER_Z.get(layer_name, 0))
+    if hasattr(sc, "note_changed"):
+        sc.note_changed((item,))
 
 
 class DraggableComponent(QGraphicsRectItem):
@@ -70,9 +168,326 @@ class DraggableComponent(QGraphicsRectItem):
         self.moveBy(delta.x(), delta.y())
 
 
+def png_digest(raw: bytes) -> str:
+    return hashlib.sha1(raw).hexdigest()
+
+
+def image_to_png_bytes(image: QImage) -> bytes:
+    ba = QByteArray()
+    buf = QBuffer(ba)
+    buf.open(QIODevice.WriteOnly)
+    image.save(buf, "PNG")
+    buf.close()
+    return bytes(ba)
+
+
+def pixmap_to_png_bytes(pixmap: QPixmap) -> bytes:
+    return image_to_png_bytes(pixmap.toImage())
+
+
+def image_frame(img: QImage) -> Optional[tuple]:
+    """(x, y, w, h, W, H) из текстового блока облегчённой копии (см. optimize_asset) или None."""
+    try:
+        frame = tuple(int(v) for v in img.text(ASSET_FRAME_TEXT).split())
+    except ValueError:
+        return None
+    return frame if len(frame) == 6 and min(frame[2:]) > 0 else None
+
+
+class SharedImage:
+    """Декодированная картинка, общая для всех элементов сцены с одинаковым содержимым.
+
+    У облегчённой копии из components/.optimized логический размер (size) — как у
+    исходного PNG, а сам pixmap, обрезанный и уменьшенный, рисуется в прямоугольник
+    frame внутри него. У обычной картинки frame нет, а size — размер pixmap.
+    """
+    def __init__(self, key: str, pixmap: QPixmap, raw: Optional[bytes] = None, path: Optional[str] = None,
+                 frame: Optional[tuple] = None):
+        self.key = key        # sha1 байтов PNG
+        self.pixmap = pixmap
+        self.raw = raw        # исходные байты (чтобы не перекодировать при сохранении)
+        self.path = path      # файл на диске, если картинка пришла из файла
+        if frame is None:
+            self.frame, self.size, self.density = None, QSizeF(pixmap.size()), 1.0
+        else:
+            self.frame = QRectF(*frame[:4])
+            self.size = QSizeF(frame[4], frame[5])
+            self.density = frame[2] / max(1, pixmap.width())  # логических px на px картинки
+        self._mips = [pixmap]  # пирамида: уровень k в 2**k раз меньше, строится по мере надобности
+        self._average = None   # средний цвет — заглушка для совсем мелкого масштаба
+
+    @classmethod
+    def from_qimage(cls, key: str, img: QImage, raw: Optional[bytes] = None,
+                    path: Optional[str] = None) -> "SharedImage":
+        return cls(key, QPixmap.fromImage(img), raw, path, image_frame(img))
+
+    @classmethod
+    def from_png_bytes(cls, raw: bytes, path: Optional[str] = None) -> Optional["SharedImage"]:
+        img = QImage.fromData(QByteArray(raw))
+        if img.isNull():
+            return None
+        return cls.from_qimage(png_digest(raw), img, raw, path)
+
+    @classmethod
+    def from_file(cls, path: str) -> Optional["SharedImage"]:
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except OSError:
+            return None
+        return cls.from_png_bytes(raw, os.path.abspath(path))
+
+    @classmethod
+    def from_pixmap(cls, pixmap: QPixmap) -> "SharedImage":
+        raw = pixmap_to_png_bytes(pixmap)
+        return cls(png_digest(raw), pixmap, raw)
+
+    def png_bytes(self) -> bytes:
+        if self.raw is None:
+            self.raw = pixmap_to_png_bytes(self.pixmap)
+        return self.raw
+
+    def mip(self, level: int) -> QPixmap:
+        """Уровень пирамиды (0 — оригинал). Каждый уровень — вдвое меньше предыдущего,
+        сжимается из него же; меньше 1 px уровней нет."""
+        while len(self._mips) <= level:
+            prev = self._mips[-1]
+            if prev.width() <= 1 and prev.height() <= 1:
+                return prev
+            self._mips.append(prev.scaled(max(1, prev.width() // 2), max(1, prev.height() // 2),
+                                          Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+        return self._mips[level]
+
+    def average_color(self) -> QColor:
+        if self._average is None:
+            small = self.mip(0).scaled(1, 1, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            self._average = small.toImage().pixelColor(0, 0)
+        return self._average
+
+
+class PixmapCache:
+    """Общий на процесс кэш SharedImage с бюджетом памяти и вытеснением LRU.
+
+    Файлы ищутся по (путь, mtime, размер), встроенные данные — по sha1 содержимого;
+    одинаковое содержимое из разных источников попадает в одну запись.
+    Работает только из GUI-потока (внутри QPixmap).
+    """
+    def __init__(self, budget_bytes: int = PIXMAP_CACHE_BUDGET):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()  # sha1 -> SharedImage, от старых к свежим
+        self._files = {}               # (path, mtime_ns, size) -> sha1
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _cost(image: SharedImage) -> int:
+        pm = image.pixmap
+        # пирамида уровней детализации добавляет не больше трети к оригиналу
+        return pm.width() * pm.height() * max(pm.depth(), 8) // 6 + len(image.raw or b"")
+
+    def _touch(self, key: str) -> Optional[SharedImage]:
+        image = self._entries.get(key)
+        if image is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return image
+
+    def _insert(self, image: SharedImage) -> SharedImage:
+        self.misses += 1
+        self._entries[image.key] = image
+        self._bytes += self._cost(image)
+        # самую свежую запись не выкидываем, даже если она одна больше бюджета
+        while self._bytes > self.budget_bytes and len(self._entries) > 1:
+            key, old = self._entries.popitem(last=False)
+            self._bytes -= self._cost(old)
+            self._files = {fk: k for fk, k in self._files.items() if k != key}
+            self.evictions += 1
+        return image
+
+    def from_file(self, path: str) -> Optional[SharedImage]:
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        fkey = (path, st.st_mtime_ns, st.st_size)
+        key = self._files.get(fkey)
+        if key is not None:
+            image = self._touch(key)
+            if image is not None:
+                return image
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except OSError:
+            return None
+        key = png_digest(raw)
+        image = self._touch(key)
+        if image is None:
+            image = SharedImage.from_png_bytes(raw, path)
+            if image is None:
+                return None
+            self._insert(image)
+        if image.path is None:
+            image.path = path
+        self._files[fkey] = key
+        return image
+
+    def from_bytes(self, raw: bytes) -> Optional[SharedImage]:
+        key = png_digest(raw)
+        image = self._touch(key)
+        if image is not None:
+            return image
+        image = SharedImage.from_png_bytes(raw)
+        return self._insert(image) if image is not None else None
+
+    def keys(self) -> frozenset:
+        """Снимок ключей — чтобы фоновые потоки не декодировали то, что уже есть."""
+        return frozenset(self._entries)
+
+    def from_image(self, key: str, img: Optional[QImage], raw: bytes,
+                   path: Optional[str] = None) -> Optional[SharedImage]:
+        """Картинка, декодированная в другом потоке: здесь остаётся только QPixmap.fromImage.
+        img может быть None, если по снимку keys() запись уже была в кэше."""
+        image = self._touch(key)
+        if image is None:
+            if img is None:  # успели вытеснить после снимка — декодируем сами
+                img = QImage.fromData(QByteArray(raw))
+            if img.isNull():
+                return None
+            image = self._insert(SharedImage.from_qimage(key, img, raw, path))
+        if path is not None:
+            if image.path is None:
+                image.path = path
+            try:
+                st = os.stat(path)
+                self._files[(path, st.st_mtime_ns, st.st_size)] = key
+            except OSError:
+                pass
+        return image
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "budget_bytes": self.budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        self._entries.clear()
+        self._files.clear()
+        self._bytes = 0
+
+
+PIXMAP_CACHE = PixmapCache()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name: str):
+        self.profiler, self.name = profiler, name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class Profiler:
+    """Лёгкие замеры горячих путей: with PROFILER.span("имя"): ...
+    Выключен по умолчанию; выключенный span — общий пустой контекст, без обращения к часам.
+    Хранит последние PROFILE_MAX_EVENTS интервалов (для трассы Chrome/Perfetto)
+    и сводку по именам за всё время: число, сумма, максимум, последний."""
+    _OFF = contextlib.nullcontext()
+
+    def __init__(self, max_events: int = PROFILE_MAX_EVENTS):
+        self.enabled = False
+        self._events = deque(maxlen=max_events)  # (имя, начало нс, длительность нс, id потока)
+        self._stats = {}                         # имя -> [число, сумма нс, максимум нс, последний нс]
+        self._threads = {}                       # id потока -> имя (для трассы)
+        self._lock = threading.Lock()            # пишут и GUI, и фоновые потоки
+
+    def span(self, name: str):
+        return _Span(self, name) if self.enabled else self._OFF
+
+    def record(self, name: str, start_ns: int, end_ns: int):
+        dur = end_ns - start_ns
+        tid = threading.get_ident()
+        with self._lock:
+            self._events.append((name, start_ns, dur, tid))
+            st = self._stats.get(name)
+            if st is None:
+                st = self._stats[name] = [0, 0, 0, 0]
+            st[0] += 1
+            st[1] += dur
+            st[2] = max(st[2], dur)
+            st[3] = dur
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+
+    def stats(self) -> list:
+        """Сводка, самые дорогие по сумме — первыми; времена в мс."""
+        with self._lock:
+            rows = [(name, *st) for name, st in self._stats.items()]
+        rows.sort(key=lambda r: r[2], reverse=True)
+        return [{"name": name, "count": n, "total_ms": total / 1e6, "avg_ms": total / n / 1e6,
+                 "max_ms": mx / 1e6, "last_ms": last / 1e6} for name, n, total, mx, last in rows]
+
+    def reset(self):
+        with self._lock:
+            self._events.clear()
+            self._stats.clear()
+
+    def export_chrome_trace(self, path: str) -> int:
+        """Пишет Trace Event JSON (chrome://tracing, ui.perfetto.dev). Возвращает число интервалов."""
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        pid = os.getpid()
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for tid, name in threads.items()]
+        trace += [{"name": name, "cat": name.split("/", 1)[0], "ph": "X", "pid": pid, "tid": tid,
+                   "ts": start / 1000, "dur": dur / 1000} for name, start, dur, tid in events]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return len(events)
+
+
+def profiled(name: str):
+    """Декоратор: весь вызов функции — один интервал name."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with PROFILER.span(name):
+                return fn(*args, **kwargs)
+        return run
+    return wrap
+
+
+PROFILER = Profiler()
+PROFILER.enabled = os.environ.get(PROFILE_ENV, "") not in ("", "0")
+
+
 class ScalablePixmapItem(QGraphicsPixmapItem):
-    def __init__(self, pixmap):
-        super().__init__(pixmap)
+    def __new__(cls, image: SharedImage):
+        # облегчённой копии нужны исходные границы (FramedPixmapItem); у обычной картинки
+        # boundingRect остаётся родным, без вызова Python на каждый запрос индекса и отрисовки
+        if cls is ScalablePixmapItem and image.frame is not None:
+            cls = FramedPixmapItem
+        return super().__new__(cls)
+
+    def __init__(self, image: SharedImage):
+        super().__init__(image.pixmap)
+        self.image = image
         self.setFlags(
             QGraphicsPixmapItem.ItemIsMovable |
             QGraphicsPixmapItem.ItemIsSelectable |
@@ -85,11 +500,49 @@ class ScalablePixmapItem(QGraphicsPixmapItem):
             self.boundingRect().height() / 2
         )
 
+    @classmethod
+    def from_file(cls, path: str) -> Optional["ScalablePixmapItem"]:
+        image = PIXMAP_CACHE.from_file(path)
+        return cls(image) if image is not None else None
+
+    @classmethod
+    def from_png_bytes(cls, raw: bytes) -> Optional["ScalablePixmapItem"]:
+        image = PIXMAP_CACHE.from_bytes(raw)
+        return cls(image) if image is not None else None
+
     def shape(self):
         # Возвращаем форму всего прямоугольника
         path = QPainterPath()
         path.addRect(self.boundingRect())
         return path
+
+    def paint(self, painter, option, widget=None):
+        image = self.image
+        # widget — viewport вида; без него (экспорт, render) рисуем полное разрешение
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        # пока пользователь тянет/листает/зумит — без сглаживания (см. GraphicsView.begin_interaction)
+        fast = widget is not None and getattr(self.scene(), "fast_render", False)
+        # у облегчённой копии пиксель картинки крупнее логического — в density раз
+        full = widget is None or (lod * image.density >= 0.5 and not fast)
+        if full and image.frame is None:
+            super().paint(painter, option, widget)
+            return
+        rect = self.boundingRect()
+        if not full and max(rect.width(), rect.height()) * lod < LOD_PLACEHOLDER_PX:
+            painter.fillRect(rect, image.average_color())
+        else:
+            # самый мелкий уровень, который ещё не меньше изображения на экране
+            level = 0 if full else max(0, int(math.floor(math.log2(1 / (lod * image.density)))))
+            mip = image.mip(level)
+            painter.save()  # подсказка сглаживания не должна достаться следующим элементам
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, not fast)
+            painter.drawPixmap(image.frame or rect, mip, QRectF(mip.rect()))
+            painter.restore()
+        if option.state & QStyle.State_Selected:
+            painter.setPen(QPen(option.palette.windowText(), 0, Qt.DashLine))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawRect(rect)
+
     def rotate_by(self, angle):
         self.setRotation(self.rotation() + angle)
     
@@ -116,6 +569,19 @@ class ScalablePixmapItem(QGraphicsPixmapItem):
         self.setOpacity(min(1.0, max(0.1, self.opacity() + delta)))
 
 
+class FramedPixmapItem(ScalablePixmapItem):
+    """Элемент с облегчённой копией из components/.optimized (SharedImage.frame).
+    Границы — как у исходного PNG: порты, поверхности OPTICS_LIBRARY и масштаб
+    элемента от оптимизации не зависят, копия лишь рисуется в свой frame внутри них."""
+    def __init__(self, image: SharedImage):
+        # как у QGraphicsPixmapItem с флагом ItemIsSelectable: полпикселя на обводку
+        self._bounds = QRectF(QPointF(0, 0), image.size).adjusted(-0.5, -0.5, 0.5, 0.5)
+        super().__init__(image)
+
+    def boundingRect(self):
+        return self._bounds
+
+
 class LaserLine(QGraphicsLineItem):
     def __init__(self, x1, y1, x2, y2, color=Qt.red, width=2.5):
         super().__init__(x1, y1, x2, y2)
@@ -126,6 +592,273 @@ class LaserLine(QGraphicsLineItem):
         pen = QPen(color, width)
         pen.setCosmetic(True)
         self.setPen(pen)
+        self.ports = [None, None]  # (компонент, порт), к которым прилип начало/конец
+
+    def endpoints(self) -> tuple:
+        ln = self.line()
+        return self.mapToScene(ln.p1()), self.mapToScene(ln.p2())
+
+    def set_endpoint(self, end: int, p: QPointF):
+        ln = self.line()
+        if end == 0:
+            ln.setP1(self.mapFromScene(p))
+        else:
+            ln.setP2(self.mapFromScene(p))
+        self.setLine(ln)
+
+
+class StreamingPngWriter:
+    """PNG (RGB, 8 бит), который пишется полосами: строки сразу сжимаются и уходят в файл,
+    так что целиком картинка в памяти не лежит."""
+    IDAT_CHUNK = 1 << 20
+
+    def __init__(self, path: str, width: int, height: int, level: int = 6):
+        self.width, self.height = width, height
+        self.rows_written = 0
+        self._f = open(path, "wb")
+        self._f.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        self._z = zlib.compressobj(level)
+        self._buf = bytearray()
+
+    def _chunk(self, kind: bytes, data: bytes):
+        self._f.write(struct.pack(">I", len(data)) + kind + data)
+        self._f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xFFFFFFFF))
+
+    def _flush_idat(self, force=False):
+        while len(self._buf) >= self.IDAT_CHUNK or (force and self._buf):
+            part = bytes(self._buf[:self.IDAT_CHUNK])
+            del self._buf[:self.IDAT_CHUNK]
+            self._chunk(b"IDAT", part)
+
+    def write_rows(self, img: QImage):
+        """Дописывает все строки полосы (QImage шириной width)."""
+        img = img.convertToFormat(QImage.Format_RGB888)
+        bpl, row = img.bytesPerLine(), self.width * 3
+        data = img.constBits().tobytes()
+        # у каждой строки PNG байт фильтра; 0 — без фильтра
+        rows = b"".join(b"\x00" + data[y * bpl:y * bpl + row] for y in range(img.height()))
+        self._buf += self._z.compress(rows)
+        self.rows_written += img.height()
+        self._flush_idat()
+
+    def close(self):
+        self._buf += self._z.flush()
+        self._flush_idat(force=True)
+        self._chunk(b"IEND", b"")
+        self._f.close()
+
+    def abort(self):
+        path = self._f.name
+        self._f.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def render_scene_png(scene: QGraphicsScene, source: QRectF, path: str, scale: float = 1.0,
+                     progress=None) -> bool:
+    """Рендерит прямоугольник сцены в PNG горизонтальными полосами.
+    Пиковая память — одна полоса (EXPORT_STRIP_BYTES), а не вся картинка.
+    progress(готово_строк, всего_строк) может вернуть False — тогда экспорт отменяется
+    и недописанный файл удаляется. Возвращает True, если файл записан."""
+    width = max(1, int(round(source.width() * scale)))
+    height = max(1, int(round(source.height() * scale)))
+    strip_h = max(1, min(height, EXPORT_STRIP_BYTES // (width * 4)))
+    writer = StreamingPngWriter(path, width, height)
+    strip = QImage(width, strip_h, QImage.Format_ARGB32_Premultiplied)
+    try:
+        for y0 in range(0, height, strip_h):
+            h = min(strip_h, height - y0)
+            if h != strip.height():
+                strip = QImage(width, h, QImage.Format_ARGB32_Premultiplied)
+            strip.fill(Qt.white)
+            p = QPainter(strip)
+            p.setRenderHint(QPainter.Antialiasing, True)
+            p.setRenderHint(QPainter.SmoothPixmapTransform, True)
+            tile = QRectF(source.left(), source.top() + y0 / scale, source.width(), h / scale)
+            with PROFILER.span("export/render"):
+                scene.render(p, QRectF(0, 0, width, h), tile, Qt.IgnoreAspectRatio)
+            p.end()
+            with PROFILER.span("export/encode"):
+                writer.write_rows(strip)
+            if progress is not None and progress(y0 + h, height) is False:
+                writer.abort()
+                return False
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return True
+
+
+# ---- ВЕКТОРНЫЙ ЭКСПОРТ ----
+
+def _svg_num(v: float) -> str:
+    return ("%.3f" % v).rstrip("0").rstrip(".")
+
+def _svg_matrix(t: QTransform) -> str:
+    return "matrix(%s)" % " ".join(_svg_num(v) for v in (t.m11(), t.m12(), t.m21(), t.m22(), t.dx(), t.dy()))
+
+def _svg_color(attr: str, color: QColor) -> str:
+    s = f'{attr}="{color.name()}"'
+    if color.alpha() < 255:
+        s += f' {attr}-opacity="{_svg_num(color.alphaF())}"'
+    return s
+
+def _svg_pen(pen: QPen) -> str:
+    if pen.style() == Qt.NoPen:
+        return 'stroke="none"'
+    s = _svg_color("stroke", pen.color())
+    s += f' stroke-width="{_svg_num(pen.widthF() or 1.0)}"'
+    s += ' stroke-linecap="%s"' % {Qt.FlatCap: "butt", Qt.RoundCap: "round"}.get(pen.capStyle(), "square")
+    if pen.isCosmetic() or pen.widthF() == 0:
+        s += ' vector-effect="non-scaling-stroke"'  # толщина в px экрана, как на холсте
+    return s
+
+def _svg_brush(brush: QBrush) -> str:
+    return 'fill="none"' if brush.style() == Qt.NoBrush else _svg_color("fill", brush.color())
+
+def svg_path_data(path: QPainterPath) -> str:
+    """Атрибут d для QPainterPath (отрезки и кривые Безье)."""
+    parts, i, n = [], 0, path.elementCount()
+    while i < n:
+        e = path.elementAt(i)
+        if e.type == QPainterPath.MoveToElement:
+            parts.append(f"M{_svg_num(e.x)} {_svg_num(e.y)}")
+        elif e.type == QPainterPath.LineToElement:
+            parts.append(f"L{_svg_num(e.x)} {_svg_num(e.y)}")
+        else:  # CurveToElement + две точки CurveToDataElement
+            c2, end = path.elementAt(i + 1), path.elementAt(i + 2)
+            parts.append("C" + " ".join(_svg_num(v) for v in (e.x, e.y, c2.x, c2.y, end.x, end.y)))
+            i += 2
+        i += 1
+    return "".join(parts)
+
+def svg_item_element(item, image_ids: dict) -> Optional[str]:
+    """Элемент SVG для одного объекта сцены (в его собственных координатах + transform).
+    Картинки не встраиваются: image_ids (sha1 -> id) собирает их для <defs>, а здесь — <use>."""
+    attrs = f'transform="{_svg_matrix(item.sceneTransform())}"'
+    if item.effectiveOpacity() < 1.0:
+        attrs += f' opacity="{_svg_num(item.effectiveOpacity())}"'
+    if isinstance(item, ScalablePixmapItem):
+        ref = image_ids.setdefault(item.image.key, f"img{len(image_ids)}")
+        off = item.offset()
+        if off.x() or off.y():
+            attrs += f' x="{_svg_num(off.x())}" y="{_svg_num(off.y())}"'
+        return f'<use href="#{ref}" xlink:href="#{ref}" {attrs}/>'
+    if isinstance(item, QGraphicsLineItem):
+        ln = item.line()
+        return (f'<line x1="{_svg_num(ln.x1())}" y1="{_svg_num(ln.y1())}" x2="{_svg_num(ln.x2())}" '
+                f'y2="{_svg_num(ln.y2())}" {_svg_pen(item.pen())} {attrs}/>')
+    if isinstance(item, QGraphicsRectItem):
+        r = item.rect()
+        return (f'<rect x="{_svg_num(r.x())}" y="{_svg_num(r.y())}" width="{_svg_num(r.width())}" '
+                f'height="{_svg_num(r.height())}" {_svg_brush(item.brush())} {_svg_pen(item.pen())} {attrs}/>')
+    if isinstance(item, QGraphicsPathItem):
+        return f'<path d="{svg_path_data(item.path())}" {_svg_brush(item.brush())} {_svg_pen(item.pen())} {attrs}/>'
+    return None
+
+def render_scene_svg(scene: QGraphicsScene, source: QRectF, path: str):
+    """Пишет прямоугольник сцены в SVG: элементы — векторами, каждая картинка —
+    один раз в <defs> (PNG как есть, без перекодирования) и ссылки <use> на неё.
+    Размер файла зависит от числа разных картинок, а не от числа размещений."""
+    image_ids, images, body = {}, {}, []
+    for item in scene.items(source, Qt.IntersectsItemBoundingRect, Qt.AscendingOrder):
+        if not item.isVisible():
+            continue
+        el = svg_item_element(item, image_ids)
+        if el is not None:
+            body.append(el)
+            if isinstance(item, ScalablePixmapItem):
+                images.setdefault(item.image.key, item.image)
+    x, y, w, h = (_svg_num(v) for v in (source.x(), source.y(), source.width(), source.height()))
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                f'width="{w}" height="{h}" viewBox="{x} {y} {w} {h}">\n<defs>\n')
+        for key, image in images.items():
+            # облегчённая копия ложится в свой frame внутри исходных границ
+            r = image.frame or QRectF(image.pixmap.rect())
+            data = base64.b64encode(image.png_bytes()).decode("ascii")
+            f.write(f'<image id="{image_ids[key]}" x="{_svg_num(r.x())}" y="{_svg_num(r.y())}" '
+                    f'width="{_svg_num(r.width())}" height="{_svg_num(r.height())}" '
+                    f'preserveAspectRatio="none" href="data:image/png;base64,{data}"/>\n')
+        grid = getattr(scene, "grid_visible", False)
+        if grid:
+            # сетка — один узор, а не тысячи линий
+            f.write(f'<pattern id="grid" width="{GRID_SIZE}" height="{GRID_SIZE}" patternUnits="userSpaceOnUse">'
+                    f'<path d="M{GRID_SIZE} 0H0V{GRID_SIZE}" fill="none" {_svg_pen(scene._grid_pen)}/></pattern>\n')
+        f.write(f'</defs>\n<rect x="{x}" y="{y}" width="{w}" height="{h}" fill="#ffffff"/>\n')
+        if grid:
+            f.write(f'<rect x="{x}" y="{y}" width="{w}" height="{h}" fill="url(#grid)"/>\n')
+        for el in body:
+            f.write(el + "\n")
+        f.write("</svg>\n")
+    os.replace(tmp, path)
+
+def render_scene_pdf(scene: QGraphicsScene, source: QRectF, path: str):
+    """Одностраничный PDF размером с прямоугольник сцены (1 px сцены = 1 pt).
+    Линии и лучи остаются векторами; движок PDF кладёт общую картинку (один QPixmap
+    у всех размещений SharedImage) в файл один раз."""
+    writer = QPdfWriter(path)
+    writer.setResolution(72)
+    writer.setPageSize(QPageSize(source.size(), QPageSize.Point, "", QPageSize.ExactMatch))
+    writer.setPageMargins(QMarginsF(0, 0, 0, 0))
+    p = QPainter(writer)
+    try:
+        p.setRenderHint(QPainter.Antialiasing, True)
+        p.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        scene.render(p, QRectF(0, 0, source.width(), source.height()), source, Qt.IgnoreAspectRatio)
+    finally:
+        p.end()
+
+def render_scene_file(scene: QGraphicsScene, source: QRectF, path: str, scale: float = 1.0,
+                      progress=None) -> bool:
+    """Экспорт по расширению path: .svg, .pdf или PNG (всё остальное)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".svg":
+        render_scene_svg(scene, source, path)
+    elif ext == ".pdf":
+        render_scene_pdf(scene, source, path)
+    else:
+        return render_scene_png(scene, source, path, scale, progress)
+    return True
+
+
+class ScaledBackground:
+    """Картинка фона, растянутая под размер виджета.
+    Исходник декодируется один раз, растянутая копия пересчитывается только при смене размера."""
+    def __init__(self, source: QPixmap):
+        self.source = source
+        self._scaled = None
+
+    def for_size(self, size: QSize) -> QPixmap:
+        if self._scaled is None or self._scaled.size() != size:
+            self._scaled = self.source.scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        return self._scaled
+
+
+class BackgroundWidget(QWidget):
+    """Корневой контейнер окна с фоновой картинкой (вместо QSS border-image,
+    который читал бы и масштабировал файл отдельно)."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._bg = None
+
+    def set_background(self, pixmap: Optional[QPixmap]):
+        self._bg = ScaledBackground(pixmap) if pixmap is not None and not pixmap.isNull() else None
+        self.update()
+
+    def paintEvent(self, event):
+        if self._bg is None:
+            return
+        p = QPainter(self)
+        r = event.rect()
+        p.drawPixmap(r, self._bg.for_size(self.size()), r)
+        p.end()
 
 
 class GraphicsView(QGraphicsView):
@@ -136,48 +869,135 @@ class GraphicsView(QGraphicsView):
         super().__init__(scene)
         self.main_window = main_window
         self.setRenderHint(QPainter.Antialiasing)
+        # Smart: Qt сам выбирает между перерисовкой нескольких кусков и их общего прямоугольника
+        self.setViewportUpdateMode(QGraphicsView.SmartViewportUpdate)
         self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
         self.setResizeAnchor(QGraphicsView.AnchorViewCenter)
         self.setMouseTracking(True)
         self.drawing_line = False
-        self._bg_pix = None  # фон, если задан
+        self._bg = None  # ScaledBackground, если фон задан
+        self._hover_port = None  # порт под курсором (точка сцены)
         self.line_start = QPointF()
+        # режим взаимодействия: быстрая отрисовка, пока идёт перетаскивание/прокрутка/зум
+        self._interacting = False
+        self._cached_items = None  # элементы с DeviceCoordinateCache; None — ещё не включали
+        self._idle_timer = QTimer(self)
+        self._idle_timer.setSingleShot(True)
+        self._idle_timer.setInterval(INTERACTION_IDLE_MS)
+        self._idle_timer.timeout.connect(self.end_interaction)
+        # полосы прокрутки: только действия пользователя (перетаскивание, клики, клавиши),
+        # а не setValue из centerOn/ensureVisible
+        for bar in (self.horizontalScrollBar(), self.verticalScrollBar()):
+            bar.sliderPressed.connect(self.begin_interaction)
+            bar.actionTriggered.connect(lambda _action: self.begin_interaction())
     def _item_center_scene(self, it):
         try:
             return it.mapToScene(it.transformOriginPoint())
         except Exception:
             return it.sceneBoundingRect().center()
-    def set_background(self, path: str):
-        pm = QPixmap(path)
-        self._bg_pix = pm if not pm.isNull() else None
+
+    # история правок живёт у сцены (scene.history), вид только сообщает о шагах
+    def _track(self, items):
+        if self.scene().history is not None:
+            self.scene().history.track(items)
+
+    def _commit(self, text: str, merge_id: Optional[str] = None):
+        if self.scene().history is not None:
+            self.scene().history.commit(text, merge_id)
+
+    def _push(self, cmd):
+        if self.scene().history is not None:
+            self.scene().history.push(cmd)
+
+    def set_background(self, pixmap: Optional[QPixmap]):
+        self._bg = ScaledBackground(pixmap) if pixmap is not None and not pixmap.isNull() else None
         self.viewport().update()
 
-    def drawBackground(self, painter, rect):
-        # 1) фон на весь виджет (включая области вне сцены)
-        if self._bg_pix:
-            painter.save()
-            painter.resetTransform()  # рисуем в координатах виджета
-            painter.drawPixmap(self.viewport().rect(), self._bg_pix, self._bg_pix.rect())
-            painter.restore()
+    @profiled("paint")
+    def paintEvent(self, event):
+        super().paintEvent(event)
+
+    # --- качество отрисовки ---
+
+    def begin_interaction(self, cache_items: bool = True):
+        """Быстрая отрисовка до паузы в INTERACTION_IDLE_MS: без сглаживания, картинки
+        без сглаживающего масштабирования. С cache_items видимые элементы получают
+        DeviceCoordinateCache — при сдвиге вида или самих элементов они просто копируются
+        (при зуме кэш бесполезен: он перестраивается на каждом шаге)."""
+        self._idle_timer.start()
+        if not self._interacting:
+            self._interacting = True
+            self.setRenderHint(QPainter.Antialiasing, False)
+            self.scene().fast_render = True
+        if cache_items and self._cached_items is None:
+            # кэши живут в QPixmapCache: если они в него не влезают, кадры только
+            # дорожают (кэш вытесняется и перерисовывается), поэтому берём по бюджету
+            QPixmapCache.setCacheLimit(max(QPixmapCache.cacheLimit(), INTERACTION_CACHE_BYTES // 1024))
+            budget = INTERACTION_CACHE_BYTES // 2
+            self._cached_items = []
+            for it in self.items(self.viewport().rect()):
+                if not isinstance(it, (ScalablePixmapItem, DraggableComponent)):
+                    continue
+                r = self.mapFromScene(it.sceneBoundingRect()).boundingRect()
+                budget -= 4 * r.width() * r.height()
+                if budget < 0:
+                    break
+                it.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+                self._cached_items.append(it)
+            if not self._cached_items and budget > 0:
+                self._cached_items = None  # на экране пока пусто — попробуем на следующем шаге
+
+    def end_interaction(self):
+        """Полное качество: сглаживание обратно, кэши элементов сбрасываются."""
+        self._idle_timer.stop()
+        if not self._interacting:
+            return
+        self._interacting = False
+        self.setRenderHint(QPainter.Antialiasing, True)
+        self.scene().fast_render = False
+        for it in self._cached_items or ():
+            try:
+                it.setCacheMode(QGraphicsItem.NoCache)
+            except RuntimeError:  # элемент уже удалён вместе со сценой
+                pass
+        self._cached_items = None
+        self.viewport().update()
 
-        # 2) белая подложка ТОЛЬКО под область сцены (чтобы сетка была на белом)
+    def scrollContentsBy(self, dx, dy):
+        # автопрокрутка, пока тянут элемент или рамку у края; программная прокрутка
+        # (centerOn, смена размера холста) качество не трогает
+        if QApplication.mouseButtons() & Qt.LeftButton:
+            self.begin_interaction()
+        super().scrollContentsBy(dx, dy)
+
+    @contextlib.contextmanager
+    def suspended_updates(self):
+        """Вид не перерисовывается (например, пока между пачками загрузки крутится
+        цикл событий); в конце — одна полная перерисовка."""
+        vp = self.viewport()
+        vp.setUpdatesEnabled(False)
+        try:
+            yield
+        finally:
+            vp.setUpdatesEnabled(True)
+            vp.update()
+
+    @profiled("paint/background")
+    def drawBackground(self, painter, rect):
+        # 1) фон на весь виджет (включая области вне сцены): копия уже растянута
+        # под viewport, поэтому переносим 1:1 только перерисовываемый кусок
+        if self._bg is not None:
+            vp = self.viewport().rect()
+            target = self.mapFromScene(rect).boundingRect().adjusted(-1, -1, 1, 1).intersected(vp)
+            if not target.isEmpty():
+                painter.save()
+                painter.resetTransform()  # рисуем в координатах виджета
+                painter.drawPixmap(target, self._bg.for_size(vp.size()), target)
+                painter.restore()
+
+        # 2) белая подложка и сетка — у сцены (их же видит экспорт)
         # после restore у painter снова стандартный трансформ: scene <-> view
-        scene_rect = self.scene().sceneRect()
-        painter.fillRect(scene_rect, Qt.white)
-
-        # 2.5) сетка (если включена)
-        mw = self.main_window
-        if getattr(mw, "grid_visible", True):
-            pen = QPen(QColor(230, 230, 230))
-            step = GRID_SIZE
-            left = math.floor(scene_rect.left() / step) * step
-            right = math.ceil(scene_rect.right() / step) * step
-            top = math.floor(scene_rect.top() / step) * step
-            bottom = math.ceil(scene_rect.bottom() / step) * step
-            for x in range(int(left), int(right) + 1, step):
-                painter.setPen(pen); painter.drawLine(x, scene_rect.top(), x, scene_rect.bottom())
-            for y in range(int(top), int(bottom) + 1, step):
-                painter.setPen(pen); painter.drawLine(scene_rect.left(), y, scene_rect.right(), y)
+        self.scene().drawBackground(painter, rect)
 
     def wheelEvent(self, event):
         # Реализуем зум как у Ctrl+±:
@@ -200,26 +1020,31 @@ class GraphicsView(QGraphicsView):
             # Если выделены PNG — масштабируем их
             if selected_items:
                 scaled_any = False
+                self._track(selected_items)
                 for item in selected_items:
                     if isinstance(item, ScalablePixmapItem):
                         item.setScale(item.scale() * factor)
                         scaled_any = True
+                self._commit("Масштаб", merge_id="scale")
                 if scaled_any:
+                    self.scene().note_changed(selected_items)
                     event.accept()
                     return
 
             # Иначе — масштабируем вид
+            self.begin_interaction(cache_items=False)
             self.scale(factor, factor)
             event.accept()
             return
 
         # Без Ctrl — стандартное поведение (скролл/прокрутка)
+        self.begin_interaction()
         super().wheelEvent(event)
 
     def mousePressEvent(self, event):
         if event.button() == Qt.RightButton:
             self.drawing_line = True
-            self.line_start = self.mapToScene(event.position().toPoint())
+            self.line_start = self._snap_to_port(event.position())
 
         # старт группового перетаскивания (левая кнопка)
         if event.button() == Qt.LeftButton:
@@ -239,8 +1064,56 @@ class GraphicsView(QGraphicsView):
                 if hasattr(self.scene(), "group_snap"):
                     self.scene().group_snap = False
         super().mousePressEvent(event)
+        if event.button() == Qt.LeftButton:
+            # выделение уже обновлено кликом: запоминаем, откуда поедут элементы
+            self._track(self.scene().selectedItems())
 
     
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton:
+            self.begin_interaction()  # перетаскивание элементов или рамка выделения
+        super().mouseMoveEvent(event)
+        if event.buttons() & Qt.LeftButton:
+            moved = self.scene().selectedItems()
+            # прилипшие лучи и лучи от источников идут за элементами, не дожидаясь отпускания
+            self.main_window.ports.items_moved(moved)
+            if self.main_window.beam_tracer is not None:
+                self.main_window.beam_tracer.items_moved(moved)
+        else:
+            hit = self._port_at(event.position())
+            self._set_hover_port(hit[2] if hit is not None else None)
+
+    # --- порты компонентов ---
+
+    def _port_at(self, pos):
+        """Ближайший порт в радиусе PORT_SNAP_PX экрана от точки вида: (элемент, порт, точка) или None."""
+        radius = PORT_SNAP_PX / max(abs(self.transform().m11()), 1e-6)
+        return self.main_window.ports.nearest(self.mapToScene(pos.toPoint()), radius)
+
+    def _snap_to_port(self, pos) -> QPointF:
+        hit = self._port_at(pos)
+        self._set_hover_port(None)
+        return hit[2] if hit is not None else self.mapToScene(pos.toPoint())
+
+    def _set_hover_port(self, p: Optional[QPointF]):
+        if p == self._hover_port:
+            return
+        for q in (self._hover_port, p):
+            if q is not None:
+                self.viewport().update(self.mapFromScene(q).boundingRect().adjusted(-8, -8, 8, 8))
+        self._hover_port = p
+
+    def drawForeground(self, painter, rect):
+        # подсветка порта, к которому прилипнет конец луча (не часть сцены — в экспорт не попадает)
+        if self._hover_port is not None:
+            painter.save()
+            painter.resetTransform()
+            c = self.mapFromScene(self._hover_port)
+            painter.setPen(QPen(QColor(0, 120, 215), 2))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawEllipse(QPointF(c), 5, 5)
+            painter.restore()
+
     def _maybe_delete_items_dragged_left(self):
         """Удаляем только выделённые элементы, если они полностью ушли за левую грань viewport."""
         sel = [it for it in self.scene().selectedItems()
@@ -258,17 +1131,24 @@ class GraphicsView(QGraphicsView):
         for it in to_remove:
             self.scene().removeItem(it)
             del it
+        if to_remove:
+            self._push(RemoveCommand("Удаление", to_remove))
 
 
     def mouseReleaseEvent(self, event):
         if self.drawing_line and event.button() == Qt.RightButton:
-            end_point = self.mapToScene(event.position().toPoint())
+            end_point = self._snap_to_port(event.position())
             line = LaserLine(self.line_start.x(), self.line_start.y(),
                              end_point.x(), end_point.y())
             self.main_window.assign_to_active_layer(line)
             self.scene().addItem(line)
+            self._push(AddCommand("Луч", [line]))
             self.drawing_line = False
 
+        history = self.scene().history
+        if event.button() == Qt.LeftButton and history is not None:
+            # сдвиг, групповой снэп и удаление за левой гранью — один шаг истории
+            history.begin_macro("Перемещение")
         if event.button() == Qt.LeftButton and self._group_center_before is not None:
             sel = [it for it in self.scene().selectedItems()
                    if isinstance(it, (DraggableComponent, ScalablePixmapItem))]
@@ -296,6 +1176,12 @@ class GraphicsView(QGraphicsView):
                 self.scene().group_snap = False
             self._maybe_delete_items_dragged_left()
         super().mouseReleaseEvent(event)
+        if event.button() == Qt.LeftButton:
+            # перетаскивание (и снэп в mouseReleaseEvent элементов) закончено
+            self.scene().note_changed(self.scene().selectedItems())
+            if history is not None:
+                history.commit("Перемещение")
+                history.end_macro()
 
     def keyPressEvent(self, event):
         # Быстрые подсказки
@@ -319,19 +1205,27 @@ class GraphicsView(QGraphicsView):
         if event.modifiers() & Qt.ControlModifier:
             if event.key() in (Qt.Key_Plus, Qt.Key_Equal):
                 if not selected_items:
+                    self.begin_interaction(cache_items=False)
                     self.scale(scale_step, scale_step)
                 else:
+                    self._track(selected_items)
                     for item in selected_items:
                         if isinstance(item, ScalablePixmapItem):
                             item.setScale(item.scale() * scale_step)
+                    self._commit("Масштаб", merge_id="scale")
+                    self.scene().note_changed(selected_items)
                 return
             elif event.key() == Qt.Key_Minus:
                 if not selected_items:
+                    self.begin_interaction(cache_items=False)
                     self.scale(1 / scale_step, 1 / scale_step)
                 else:
+                    self._track(selected_items)
                     for item in selected_items:
                         if isinstance(item, ScalablePixmapItem):
                             item.setScale(item.scale() / scale_step)
+                    self._commit("Масштаб", merge_id="scale")
+                    self.scene().note_changed(selected_items)
                 return
             elif event.key() == Qt.Key_0:
                 self.setTransform(QTransform())
@@ -347,12 +1241,19 @@ class GraphicsView(QGraphicsView):
 
         # Удаление
         if event.key() == Qt.Key_Delete:
-            for item in selected_items:
-                if isinstance(item, (DraggableComponent, ScalablePixmapItem, LaserLine)):
-                    self.scene().removeItem(item)
+            removed = [item for item in selected_items
+                       if isinstance(item, (DraggableComponent, ScalablePixmapItem, LaserLine))]
+            for item in removed:
+                self.scene().removeItem(item)
+            if removed:
+                self._push(RemoveCommand("Удаление", removed))
             return
 
         # Трансформации
+        transform_keys = {Qt.Key_R: "Поворот", Qt.Key_V: "Отражение",
+                          Qt.Key_BracketLeft: "Прозрачность", Qt.Key_BracketRight: "Прозрачность"}
+        if event.key() in transform_keys:
+            self._track(selected_items)
         for item in selected_items:
             if event.key() == Qt.Key_R:
                 direction = -1 if event.modifiers() & Qt.ShiftModifier else 1
@@ -365,6 +1266,9 @@ class GraphicsView(QGraphicsView):
                 item.change_opacity(-0.1)
             elif event.key() == Qt.Key_BracketRight and hasattr(item, 'change_opacity'):
                 item.change_opacity(+0.1)
+        if event.key() in transform_keys:
+            self._commit(transform_keys[event.key()])
+            self.scene().note_changed(selected_items)
 
         super().keyPressEvent(event)
 
@@ -420,10 +1324,11 @@ class HelpOverlay(QWidget):
             "Ctrl + / Ctrl - — масштаб PNG (если PNG выделен)<br>"
             "Ctrl+C / Ctrl+V — копировать / вставить<br>"
             "Ctrl+D — дублировать рядом<br>"
+            "Ctrl+Z / Ctrl+Shift+Z — отменить / повторить<br>"
             "Delete — удалить; PageUp/PageDown — слой выше/ниже<br>"
             "Перетащить за левую границу — удалить<br><br>"
             "<b>Файл</b><br>"
-            "Ctrl+S — сохранить проект; Ctrl+O — открыть; Ctrl+E — экспорт PNG"
+            "Ctrl+S — сохранить проект; Ctrl+O — открыть; Ctrl+E — экспорт PNG/SVG/PDF"
         )
 
     def eventFilter(self, obj, ev):
@@ -457,12 +1362,2662 @@ class HelpOverlay(QWidget):
             self.show()
 
 
+class ProfilerOverlay(QWidget):
+    """Сводка PROFILER поверх viewport (левый верхний угол, напротив подсказок).
+    Прозрачна для мыши, обновляется раз в PROFILE_OVERLAY_MS, пока видима."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents, True)
+        self.setAttribute(Qt.WA_NoSystemBackground, True)
+        self.setWindowFlags(Qt.FramelessWindowHint)
+        self.setStyleSheet("""
+            QLabel { color: #222; font-family: monospace; }
+            QWidget#panel {
+                background: rgba(255,255,255,200);
+                border: 1px solid rgba(0,0,0,60);
+                border-radius: 10px;
+            }
+        """)
+        self.panel = QWidget(self)
+        self.panel.setObjectName("panel")
+        v = QVBoxLayout(self.panel); v.setContentsMargins(12,10,12,10)
+        self.body = QLabel(); self.body.setTextFormat(Qt.PlainText)
+        v.addWidget(self.body)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(PROFILE_OVERLAY_MS)
+        self._timer.timeout.connect(self.refresh)
+        self.hide()
+
+    def showEvent(self, ev):
+        self.refresh()
+        self._timer.start()
+        super().showEvent(ev)
+
+    def hideEvent(self, ev):
+        self._timer.stop()
+        super().hideEvent(ev)
+
+    def refresh(self):
+        rows = PROFILER.stats()[:PROFILE_OVERLAY_ROWS]
+        lines = [f"{'интервал':<18}{'раз':>7}{'всего мс':>10}{'ср.':>8}{'макс':>8}{'посл.':>8}"]
+        lines += [f"{r['name'][:18]:<18}{r['count']:>7}{r['total_ms']:>10.0f}{r['avg_ms']:>8.2f}"
+                  f"{r['max_ms']:>8.1f}{r['last_ms']:>8.2f}" for r in rows]
+        if not rows:
+            lines.append("пока нет замеров")
+        self.body.setText("\n".join(lines))
+        self.panel.adjustSize()
+        self.resize(self.panel.size())
+        self.move(12, 12)
+
+
+def thumbnail_cache_dir() -> str:
+    base = QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation)
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "optics_app", "thumbs")
+
+
+def thumbnail_cache_path(cache_dir: str, path: str, st: os.stat_result) -> str:
+    """Файл кэша для иконки: ключ — путь, размер и mtime исходника."""
+    key = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{THUMB_SIZE}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+
+def load_thumbnail(path: str, cache_dir: str) -> Optional[QImage]:
+    """Иконка THUMB_SIZE×THUMB_SIZE из дискового кэша или (при промахе) из самого PNG.
+    Только QImage — можно звать из рабочих потоков."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    cached = thumbnail_cache_path(cache_dir, path, st)
+    img = QImage(cached)
+    if not img.isNull():
+        return img
+
+    reader = QImageReader(path)
+    size = reader.size()
+    if size.isValid():
+        reader.setScaledSize(size.scaled(THUMB_SIZE, THUMB_SIZE, Qt.KeepAspectRatio))
+    img = reader.read()
+    if img.isNull():
+        return None
+    if img.width() > THUMB_SIZE or img.height() > THUMB_SIZE:
+        img = img.scaled(THUMB_SIZE, THUMB_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+    # пишем через временный файл, чтобы параллельный запуск не прочитал половину
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{cached}.{os.getpid()}.tmp"
+        if img.save(tmp, "PNG"):
+            os.replace(tmp, cached)
+    except OSError:
+        pass
+    return img
+
+
+class ThumbnailSignals(QObject):
+    # поколение, путь к PNG, готовая иконка
+    ready = Signal(int, str, QImage)
+
+
+class ThumbnailJob(QRunnable):
+    """Фоновая подготовка иконок для пачки файлов библиотеки."""
+    def __init__(self, generation: int, paths: list, cache_dir: str, signals: ThumbnailSignals):
+        super().__init__()
+        self.generation = generation
+        self.paths = paths
+        self.cache_dir = cache_dir
+        self.signals = signals
+
+    def run(self):
+        for path in self.paths:
+            img = load_thumbnail(path, self.cache_dir)
+            if img is not None:
+                self.signals.ready.emit(self.generation, path, img)
+
+
+# ---- ПОИСК ПО БИБЛИОТЕКЕ ----
+_GREEK_NAMES = {
+    "α": "alpha", "β": "beta", "γ": "gamma", "δ": "delta", "ε": "epsilon", "ζ": "zeta",
+    "η": "eta", "θ": "theta", "ι": "iota", "κ": "kappa", "λ": "lambda", "μ": "mu",
+    "ν": "nu", "ξ": "xi", "ο": "omicron", "π": "pi", "ρ": "rho", "σ": "sigma", "ς": "sigma",
+    "τ": "tau", "υ": "upsilon", "φ": "phi", "χ": "chi", "ψ": "psi", "ω": "omega",
+}
+_CYR_TO_LAT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p",
+    "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch",
+    "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+
+
+def search_variants(text: str) -> tuple:
+    """Формы строки для поиска: без регистра и в латинице (кириллица и греческие буквы)."""
+    base = text.casefold().replace("ё", "е")
+    latin = "".join(_GREEK_NAMES.get(ch, _CYR_TO_LAT.get(ch, ch)) for ch in base)
+    return (base,) if latin == base else (base, latin)
+
+
+def _trigrams(s: str) -> set:
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def _is_subsequence(q: str, s: str) -> bool:
+    it = iter(s)
+    return all(ch in it for ch in q)
+
+
+FUZZY_MIN_SIMILARITY = 0.4  # доля триграмм запроса, при которой имя считается опечаткой
+
+
+class _SearchForm:
+    """Одна форма имени с заранее посчитанными началами слов и триграммами."""
+    __slots__ = ("text", "words", "grams")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.words = " " + " ".join(text.replace("_", " ").replace(".", " ").split())
+        self.grams = _trigrams(text)
+
+    def score(self, q: str, qgrams: set) -> float:
+        """Чем больше — тем лучше совпадение; 0 — не совпало."""
+        name = self.text
+        if q == name:
+            score = 100
+        elif name.startswith(q):
+            score = 90
+        elif (" " + q) in self.words:
+            score = 80
+        elif q in name:
+            score = 70
+        else:
+            sim = len(qgrams & self.grams) / len(qgrams) if qgrams else 0.0
+            if sim >= FUZZY_MIN_SIMILARITY:
+                score = 20 + 40 * sim  # опечатка: заметная часть триграмм совпала
+            elif len(q) >= 2 and _is_subsequence(q, name):
+                score = 15
+            else:
+                return 0.0
+        # при равенстве выше короткие имена
+        return score - min(abs(len(name) - len(q)), 20) * 0.1
+
+
+def _short_grams(form: _SearchForm) -> set:
+    """Все подстроки длиной 1–2: по ним короткий запрос находится без перебора."""
+    s = form.text
+    return {s[i:i + n] for n in (1, 2) for i in range(len(s) - n + 1)}
+
+
+def _word_prefixes(form: _SearchForm) -> set:
+    return {w[:n] for w in form.words.split() for n in (1, 2) if len(w) >= n}
+
+
+class ComponentSearchIndex:
+    """Индекс имён компонентов: n-граммы (1–3) и префиксы слов по всем формам имени + ранжирование."""
+    def __init__(self):
+        self._forms = {}     # ключ (путь) -> формы имени
+        self._grams = {}     # n-грамма -> множество ключей
+        self._prefixes = {}  # начало слова (1–2 символа) -> множество ключей
+
+    @staticmethod
+    def _postings(forms) -> tuple:
+        grams, prefixes = set(), set()
+        for f in forms:
+            grams |= f.grams | _short_grams(f)
+            prefixes |= _word_prefixes(f)
+        return grams, prefixes
+
+    def add(self, key: str, name: str):
+        self.remove(key)
+        forms = tuple(_SearchForm(v) for v in search_variants(name))
+        self._forms[key] = forms
+        grams, prefixes = self._postings(forms)
+        for g in grams:
+            self._grams.setdefault(g, set()).add(key)
+        for p in prefixes:
+            self._prefixes.setdefault(p, set()).add(key)
+
+    def remove(self, key: str):
+        forms = self._forms.pop(key, None)
+        if forms is None:
+            return
+        grams, prefixes = self._postings(forms)
+        for table, tokens in ((self._grams, grams), (self._prefixes, prefixes)):
+            for t in tokens:
+                keys = table.get(t)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del table[t]
+
+    def clear(self):
+        self._forms.clear()
+        self._grams.clear()
+        self._prefixes.clear()
+
+    def __len__(self):
+        return len(self._forms)
+
+    def search(self, query: str) -> list:
+        """[(score, key)] по убыванию релевантности."""
+        qvars = [(q, _trigrams(q)) for q in search_variants(query.strip())]
+        if not qvars[0][0]:
+            return []
+        if all(not qg for _, qg in qvars):
+            # короткий запрос (1–2 символа): совпадение — это готовая n-грамма,
+            # ранг грубый: начало слова выше, чем середина
+            cands, starts = set(), set()
+            for q, _ in qvars:
+                cands |= self._grams.get(q, set())
+                starts |= self._prefixes.get(q, set())
+            ranked = sorted((-80 if k in starts else -70, k) for k in cands)
+            return [(-neg, k) for neg, k in ranked]
+        else:
+            # кандидаты — имена, где нашлась заметная доля триграмм хотя бы одной формы запроса
+            cands = set()
+            for q, qg in qvars:
+                counts = {}
+                for g in qg:
+                    for k in self._grams.get(g, ()):
+                        counts[k] = counts.get(k, 0) + 1
+                need = max(1, int(FUZZY_MIN_SIMILARITY * len(qg)))
+                cands.update(k for k, c in counts.items() if c >= need)
+        ranked = []
+        for key in cands:
+            score = max(f.score(q, qg) for q, qg in qvars for f in self._forms[key])
+            if score > 0:
+                ranked.append((-score, key))
+        ranked.sort()
+        return [(-neg, k) for neg, k in ranked]
+
+
+def placeholder_icon() -> QIcon:
+    pm = QPixmap(THUMB_SIZE, THUMB_SIZE)
+    pm.fill(Qt.transparent)
+    p = QPainter(pm)
+    p.setRenderHint(QPainter.Antialiasing)
+    p.setPen(Qt.NoPen)
+    p.setBrush(QColor(0, 0, 0, 25))
+    p.drawRoundedRect(QRectF(4, 4, THUMB_SIZE - 8, THUMB_SIZE - 8), 6, 6)
+    p.end()
+    return QIcon(pm)
+
+
 # ДО импорта MainWindow
 class Scene(QGraphicsScene):
+    layers_changed = Signal()  # список слоёв изменился (добавлен, переименован, удалён, загружен)
+
     def __init__(self):
         super().__init__()
         self.group_snap = False  # идет ли групповое перетаскивание
+        self.grid_visible = True
+        self.fast_render = False  # вид в режиме взаимодействия: картинки без сглаживания
+        self._grid_pen = QPen(QColor(230, 230, 230))
+        self.observers = []  # AutosaveRecorder, BeamTracer: узнают о добавлении/изменении/удалении элементов
+        self.history = None   # UndoStack окна; у сцен без окна истории нет
+        # индекс слоёв: скрыть слой или выделить его элементы можно, не обходя всю сцену
+        self.layer_names = list(LAYER_NAMES)  # порядок задаёт z; "Сетка" всегда первая
+        self._layer_items = {}  # имя слоя -> set элементов на нём
+        self._hidden_layers = set()
+        self._index_suspended = 0
+        self._index_method = self.itemIndexMethod()
+        self._layer_batch = 0          # внутри пачки новые слои копятся, layers_changed — один раз
+        self._layers_pending = False
+
+    def addItem(self, item):
+        super().addItem(item)
+        self._index_item(item)
+        for obs in self.observers:
+            obs.item_added(item)
+
+    def add_items(self, items: list):
+        """Добавляет пачку готовых элементов (свойства и слой уже выставлены).
+        Большая пачка вставляется без BSP-индекса, он строится заново один раз.
+        О новых слоях из пачки layers_changed сообщает один раз, в конце."""
+        if len(items) >= BULK_INDEX_ITEMS:
+            with self.suspended_index():
+                for it in items:
+                    self.addItem(it)
+        else:
+            with self.batched_layers():
+                for it in items:
+                    self.addItem(it)
+
+    @contextlib.contextmanager
+    def batched_layers(self):
+        """Пока открыт, слои, впервые встреченные у элементов, не перестраивают панель
+        слоёв по одному: layers_changed выпускается один раз на выходе из самого внешнего."""
+        self._layer_batch += 1
+        try:
+            yield
+        finally:
+            self._layer_batch -= 1
+            if self._layer_batch == 0 and self._layers_pending:
+                self._layers_pending = False
+                self.layers_changed.emit()
+
+    @contextlib.contextmanager
+    def suspended_index(self):
+        """Пока открыт, сцена не ведёт BSP-индекс (NoIndex); на выходе он строится один раз.
+        Вложенные вызовы не перестраивают индекс — только самый внешний."""
+        if self._index_suspended == 0:
+            self._index_method = self.itemIndexMethod()
+            self.setItemIndexMethod(QGraphicsScene.NoIndex)
+        self._index_suspended += 1
+        try:
+            with self.batched_layers():
+                yield
+        finally:
+            self._index_suspended -= 1
+            if self._index_suspended == 0:
+                self.setItemIndexMethod(self._index_method)
+
+    def removeItem(self, item):
+        for obs in self.observers:
+            obs.item_removed(item)
+        self._layer_items.get(get_item_layer(item), set()).discard(item)
+        super().removeItem(item)
+
+    def clear(self):
+        for obs in self.observers:
+            obs.cleared()
+        if self.history is not None:
+            self.history.clear()
+        self._layer_items = {}
+        super().clear()
+
+    # --- СЛОИ ---
+
+    def user_layer_names(self) -> list:
+        return [n for n in self.layer_names if n != "Сетка"]
+
+    def layer_z(self, name: str) -> float:
+        if name == "Сетка":
+            return -100
+        try:
+            return self.layer_names.index(name) * 10
+        except ValueError:
+            return 0
+
+    def _index_item(self, item):
+        lname = get_item_layer(item)
+        if lname is None:
+            return
+        if lname not in self.layer_names:  # слой из старого проекта или журнала
+            self.layer_names.append(lname)
+            if self._layer_batch:
+                self._layers_pending = True
+            else:
+                self.layers_changed.emit()
+        self._layer_items.setdefault(lname, set()).add(item)
+        item.setZValue(self.layer_z(lname))
+        item.setVisible(lname not in self._hidden_layers)
+
+    def item_layer_changed(self, item, old: Optional[str]):
+        """Зовётся из set_item_layer: переносит элемент в индексе нового слоя."""
+        self._layer_items.get(old, set()).discard(item)
+        self._index_item(item)
+
+    def layer_items(self, name: str) -> list:
+        return list(self._layer_items.get(name, ()))
+
+    def is_layer_visible(self, name: str) -> bool:
+        return name not in self._hidden_layers
+
+    def set_layer_visible(self, name: str, visible: bool) -> bool:
+        """Показывает/скрывает элементы одного слоя. False — состояние не изменилось."""
+        if self.is_layer_visible(name) == visible:
+            return False
+        if visible:
+            self._hidden_layers.discard(name)
+        else:
+            self._hidden_layers.add(name)
+        for it in self._layer_items.get(name, ()):
+            it.setVisible(visible)
+        return True
+
+    def move_layer_items(self, src: str, dst: str) -> list:
+        """Переносит всё содержимое слоя src на слой dst, возвращает перенесённые элементы."""
+        items = self.layer_items(src)
+        if src != dst:
+            for it in items:
+                set_item_layer(it, dst)
+        return items
+
+    def _restack(self, start: int = 0):
+        """Пересчитывает z элементов слоёв, чья позиция в списке могла сдвинуться."""
+        for name in self.layer_names[start:]:
+            z = self.layer_z(name)
+            for it in self._layer_items.get(name, ()):
+                it.setZValue(z)
+
+    def add_layer(self, name: str) -> bool:
+        if not name or name in self.layer_names:
+            return False
+        self.layer_names.append(name)
+        self.layers_changed.emit()
+        return True
+
+    def rename_layer(self, old: str, new: str) -> bool:
+        if old == "Сетка" or old not in self.layer_names or not new or new in self.layer_names:
+            return False
+        self.layer_names[self.layer_names.index(old)] = new
+        items = self._layer_items.pop(old, set())
+        for it in items:
+            it.setData(Qt.UserRole, new)
+        self._layer_items[new] = items
+        if old in self._hidden_layers:
+            self._hidden_layers.discard(old)
+            self._hidden_layers.add(new)
+        self.note_changed(items)
+        self.layers_changed.emit()
+        return True
+
+    def remove_layer(self, name: str, move_to: str) -> bool:
+        """Удаляет слой, его элементы переезжают на move_to."""
+        users = self.user_layer_names()
+        if name not in users or len(users) < 2 or move_to == name or move_to not in users:
+            return False
+        self.move_layer_items(name, move_to)
+        idx = self.layer_names.index(name)
+        del self.layer_names[idx]
+        self._layer_items.pop(name, None)
+        self._hidden_layers.discard(name)
+        self._restack(idx)
+        self.layers_changed.emit()
+        return True
+
+    def set_layers(self, names: list):
+        """Список слоёв из проекта. Слои, на которых уже есть элементы, не теряются."""
+        names = ["Сетка"] + [n for n in names if n != "Сетка"]
+        names += [n for n, items in self._layer_items.items() if items and n not in names]
+        if names == self.layer_names:
+            return
+        self.layer_names = names
+        self._restack()
+        self.layers_changed.emit()
+
+    def note_changed(self, items):
+        """Элементы изменены (сдвиг, поворот, масштаб, слой…). Зовётся на границах
+        действий пользователя, а не из itemChange: перехват itemChange в Python
+        в разы замедляет массовое создание и перемещение элементов."""
+        for obs in self.observers:
+            for it in items:
+                obs.item_changed(it)
+
+    @profiled("paint/grid")
+    def drawBackground(self, painter, rect):
+        # белая подложка ТОЛЬКО под область сцены (чтобы сетка была на белом);
+        # рисуем только то, что попало в перерисовываемый rect
+        area = rect.intersected(self.sceneRect())
+        if area.isEmpty():
+            return
+        painter.fillRect(area, Qt.white)
+        if self.grid_visible:
+            self._draw_grid(painter, area)
+
+    def _draw_grid(self, painter, area: QRectF):
+        """Линии сетки внутри area одним вызовом drawLines."""
+        step = GRID_SIZE
+        # при сильном отдалении линии сливаются в серую заливку — не тратим на них время
+        if step * painter.worldTransform().m11() < GRID_MIN_PIXEL_STEP:
+            return
+        left, right = area.left(), area.right()
+        top, bottom = area.top(), area.bottom()
+        lines = [QLineF(x, top, x, bottom)
+                 for x in range(math.ceil(left / step) * step, math.floor(right / step) * step + 1, step)]
+        lines += [QLineF(left, y, right, y)
+                  for y in range(math.ceil(top / step) * step, math.floor(bottom / step) * step + 1, step)]
+        if lines:
+            painter.setPen(self._grid_pen)
+            painter.drawLines(lines)
+
+
+# === ПРОЕКТ БЕЗ ОКНА ===
+# всё, что нужно, чтобы собрать сцену из JSON и отрендерить её без MainWindow
+# (используется и окном, и консольной командой render)
+
+def transform_to_list(t: QTransform) -> list:
+    return [t.m11(), t.m12(), t.m13(), t.m21(), t.m22(), t.m23(), t.m31(), t.m32(), t.m33()]
+
+def transform_from_list(lst) -> QTransform:
+    return QTransform(lst[0], lst[1], lst[2],
+                      lst[3], lst[4], lst[5],
+                      lst[6], lst[7], lst[8])
+
+def image_from_b64(data_b64: str) -> Optional[SharedImage]:
+    raw = base64.b64decode(data_b64.encode("ascii"))
+    return PIXMAP_CACHE.from_bytes(raw)
+
+_decode_executor = None
+
+def decode_executor() -> ThreadPoolExecutor:
+    """Общий пул потоков для декодирования картинок проекта (по числу ядер)."""
+    global _decode_executor
+    if _decode_executor is None:
+        _decode_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1,
+                                              thread_name_prefix="decode")
+    return _decode_executor
+
+@profiled("load/decode")
+def _decode_asset_entry(entry: dict, components_dir: str, known: frozenset) -> tuple:
+    """Рабочий поток: base64/чтение файла, sha1 и PNG -> QImage (без QPixmap).
+    Возвращает (sha1, байты, QImage или None, путь к файлу или None)."""
+    if "png_b64" in entry:
+        raw = base64.b64decode(entry["png_b64"].encode("ascii"))
+        path = None
+    elif "path" in entry:
+        path = os.path.abspath(os.path.join(components_dir, *entry["path"].split("/")))
+        with open(path, "rb") as f:
+            raw = f.read()
+    elif "blob" in entry:  # PNG внутри .optz: (mmap, смещение, размер)
+        buf, offset, size = entry["blob"]
+        raw = buf[offset:offset + size]
+        path = None
+    else:
+        raise ValueError("asset without png_b64/path")
+    key = png_digest(raw)
+    img = None if key in known else QImage.fromData(QByteArray(raw))
+    return key, raw, img, path
+
+class AssetDecoder:
+    """Декодирует картинки проекта по мере их поступления.
+
+    base64 и PNG — в пуле потоков, QPixmap.fromImage — в вызывающем (GUI) потоке
+    внутри collect()/finish(). Готовые картинки лежат в decoded по ключу из файла,
+    исходные записи assets — в entries.
+    """
+    def __init__(self, components_dir: str):
+        self.components_dir = components_dir
+        self.known = PIXMAP_CACHE.keys()
+        self.decoded = {}
+        self.entries = {}
+        self.missing = 0
+        self.changed = []      # файлы библиотеки, изменившиеся после сохранения
+        self.submitted = 0
+        self._pending = {}     # future -> (ключ, запись assets)
+        self._inline = {}      # png_b64 -> ключ (формат v1, картинка внутри элемента)
+
+    def submit(self, key: str, entry: dict):
+        fut = decode_executor().submit(_decode_asset_entry, entry, self.components_dir, self.known)
+        self._pending[fut] = (key, entry)
+        self.entries[key] = entry
+        self.submitted += 1
+
+    def lift_inline(self, it: dict) -> dict:
+        """Встроенный в элемент png_b64 превращается в ссылку на asset (одинаковые — в одну)."""
+        if it.get("type") != "png" or "asset" in it or "png_b64" not in it:
+            return it
+        b64 = it["png_b64"]
+        key = self._inline.get(b64)
+        if key is None:
+            key = self._inline[b64] = f"inline:{len(self._inline)}"
+            self.submit(key, {"png_b64": b64})
+        it = dict(it, asset=key)
+        del it["png_b64"]
+        return it
+
+    def collect(self, timeout: float = 0.05):
+        """Забирает готовые результаты (ждёт не дольше timeout)."""
+        if not self._pending:
+            return
+        done, _ = wait(self._pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for fut in done:
+            key, entry = self._pending.pop(fut)
+            try:
+                sha1, raw, img, path = fut.result()
+            except Exception:
+                self.missing += 1
+                continue
+            image = PIXMAP_CACHE.from_image(sha1, img, raw, path)
+            if image is None:
+                self.missing += 1
+                continue
+            if path is not None and sha1 != entry.get("sha1", sha1):
+                # файл в библиотеке поменялся — грузим то, что есть сейчас
+                self.changed.append(entry["path"])
+            self.decoded[key] = image
+
+    def finish(self, pump=None) -> bool:
+        """Дожидается всех отправленных картинок. pump() зовётся между ожиданиями;
+        если он вернул False — оставшиеся задачи отменяются и возвращается False."""
+        while self._pending:
+            self.collect()
+            if pump is not None and not pump():
+                self.cancel()
+                return False
+        return True
+
+    def cancel(self):
+        for fut in self._pending:
+            fut.cancel()
+        self._pending.clear()
+
+
+_JSON_WS = re.compile(r"[ \t\n\r]*")
+_JSON_DECODER = json.JSONDecoder()
+
+class ProjectJsonReader:
+    """Потоковый разбор проекта JSON.
+
+    events() отдаёт ("asset", (ключ, запись)) и ("item", словарь) по одному,
+    остальные ключи верхнего уровня — как (ключ, значение). Файл целиком
+    в памяти не держится: только текущий кусок и разбираемое значение.
+    """
+    CHUNK = 1 << 20
+
+    def __init__(self, path: str):
+        self._f = open(path, "r", encoding="utf-8")
+        self.size = os.fstat(self._f.fileno()).st_size
+        self.bytes_read = 0  # прочитано символов — для прогресса, ≈ байтам
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _fill(self, size: int = CHUNK) -> bool:
+        chunk = self._f.read(size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        self.bytes_read += len(chunk)
+        return True
+
+    def _peek(self) -> str:
+        """Следующий значащий символ ('' в конце файла)."""
+        while True:
+            self._pos = _JSON_WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, ch: str):
+        if self._peek() != ch:
+            raise ValueError(f"ожидался {ch!r} около символа {self.bytes_read}")
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = _JSON_DECODER.raw_decode(self._buf, self._pos)
+                # число у края буфера могло оборваться — тогда дочитываем
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # длинное значение (base64) дочитываем кусками растущего размера
+            self._fill(max(self.CHUNK, len(self._buf) - self._pos))
+
+    def _members(self, close: str, keyed: bool):
+        if self._peek() == close:
+            self._pos += 1
+            return
+        while True:
+            if keyed:
+                key = self._value()
+                self._expect(":")
+                yield key, self._value()
+            else:
+                yield self._value()
+            if self._peek() != ",":
+                break
+            self._pos += 1
+        self._expect(close)
+
+    def events(self):
+        self._expect("{")
+        for key in self._keys():
+            if key == "assets" and self._peek() == "{":
+                self._pos += 1
+                for pair in self._members("}", True):
+                    yield "asset", pair
+            elif key == "items" and self._peek() == "[":
+                self._pos += 1
+                for it in self._members("]", False):
+                    yield "item", it
+            else:
+                yield key, self._value()
+
+    def _keys(self):
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                raise ValueError("ключ объекта должен быть строкой")
+            self._expect(":")
+            yield key
+            if self._peek() != ",":
+                break
+            self._pos += 1
+        self._expect("}")
+
+
+class ProjectWriter(threading.Thread, abc.ABC):
+    """Фоновая запись проекта.
+
+    Картинки из assets пишутся сразу, элементы — по мере того как GUI-поток
+    кладёт их через put(). Пишем во временный файл и подменяем им исходный
+    только в конце, так что отмена или ошибка не портят прежний проект.
+    """
+    _END = object()
+
+    def __init__(self, path: str, header: dict, assets: dict):
+        super().__init__(daemon=True)
+        self.path = path
+        self.header = header
+        self.assets = assets   # ключ -> запись; bytes — PNG, который надо встроить
+        self.assets_written = 0
+        self.items_written = 0
+        self.error = None
+        self._queue = queue.Queue()
+        self._cancelled = threading.Event()
+
+    def put(self, item: dict):
+        self._queue.put(item)
+
+    def finish(self):
+        self._queue.put(self._END)
+
+    def cancel(self):
+        self._cancelled.set()
+        self._queue.put(self._END)
+
+    def _items(self):
+        """Элементы из очереди до finish()/cancel()."""
+        while not self._cancelled.is_set():
+            item = self._queue.get()
+            if item is self._END:
+                return
+            yield item
+            self.items_written += 1
+
+    @abc.abstractmethod
+    def _write(self, tmp: str):
+        """Пишет весь проект в tmp (формат — в наследнике)."""
+
+    @profiled("save/write")
+    def run(self):
+        tmp = self.path + ".tmp"
+        try:
+            self._write(tmp)
+            if not self._cancelled.is_set():
+                os.replace(tmp, self.path)
+                return
+        except Exception as e:
+            self.error = e
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+class ProjectJsonWriter(ProjectWriter):
+    """Текстовый проект: шапка, assets (base64 считается здесь, в потоке), элементы."""
+
+    def _write(self, tmp: str):
+        dumps = lambda v: json.dumps(v, ensure_ascii=False)
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("{\n")
+            for key, value in self.header.items():
+                f.write(f"  {dumps(key)}: {dumps(value)},\n")
+            f.write('  "assets": {')
+            sep = "\n"
+            for key, entry in self.assets.items():
+                if self._cancelled.is_set():
+                    break
+                if isinstance(entry, bytes):
+                    entry = {"png_b64": base64.b64encode(entry).decode("ascii")}
+                f.write(f"{sep}    {dumps(key)}: {dumps(entry)}")
+                sep = ",\n"
+                self.assets_written += 1
+            f.write('\n  },\n  "items": [')
+            sep = "\n"
+            for item in self._items():
+                f.write(f"{sep}    {dumps(item)}")
+                sep = ",\n"
+            f.write("\n  ]\n}\n")
+
+
+# ---- .optz: двоичная таблица элементов ----
+# Необязательные поля пишутся, только если отличаются от значения по умолчанию;
+# какие записаны — отмечают биты маски. Координаты — double, как в JSON.
+_IDENTITY_TRANSFORM = [1, 0, 0, 0, 1, 0, 0, 0, 1]
+_OPTZ_TYPES = ("component", "png", "laser")
+_OPTZ_FIELDS = {  # тип -> [(бит, ключ, формат, по умолчанию)] в порядке записи
+    "component": [(1, "rotation", "<d", 0.0), (2, "opacity", "<d", 1.0),
+                  (8, "transform", "<9d", _IDENTITY_TRANSFORM), (16, "label", "str", "Компонент")],
+    "png": [(1, "rotation", "<d", 0.0), (2, "opacity", "<d", 1.0), (4, "scale", "<d", 1.0),
+            (8, "transform", "<9d", _IDENTITY_TRANSFORM)],
+    "laser": [(32, "color", "<4B", [255, 0, 0, 255]), (64, "width", "<d", 2.5)],
+}
+_OPTZ_HEADER = struct.Struct("<4sHII")   # магия, версия, ширина, высота
+_OPTZ_ASSET = struct.Struct("<B20sI")    # 0 — PNG в архиве / 1 — файл библиотеки, sha1, строка пути
+_OPTZ_ITEM = struct.Struct("<BBI")       # тип, маска, строка слоя
+_OPTZ_NO_STRING = 0xFFFFFFFF
+
+def pack_project_table(scene: dict, assets: dict, items: list) -> bytes:
+    """Таблица элементов .optz: строки, картинки и элементы в struct-упаковке."""
+    strings, string_ids = [], {}
+    def sid(text) -> int:
+        if text is None:
+            return _OPTZ_NO_STRING
+        i = string_ids.get(text)
+        if i is None:
+            i = string_ids[text] = len(strings)
+            strings.append(text)
+        return i
+
+    asset_ids, asset_buf = {}, bytearray()
+    for key, entry in assets.items():
+        asset_ids[key] = len(asset_ids)
+        linked = isinstance(entry, dict) and "path" in entry
+        asset_buf += _OPTZ_ASSET.pack(1 if linked else 0, bytes.fromhex(key),
+                                      sid(entry["path"]) if linked else _OPTZ_NO_STRING)
+
+    item_buf, count = bytearray(), 0
+    for d in items:
+        kind = d.get("type")
+        if kind not in _OPTZ_FIELDS:
+            continue
+        if kind == "laser":
+            body = struct.pack("<4d", *d["p1"], *d["p2"])
+        else:
+            body = struct.pack("<2d", *d["pos"])
+            if kind == "png":
+                body = struct.pack("<I", asset_ids[d["asset"]]) + body
+        mask = 0
+        for bit, key, fmt, default in _OPTZ_FIELDS[kind]:
+            value = d.get(key, default)
+            if value == default:
+                continue
+            mask |= bit
+            if fmt == "str":
+                body += struct.pack("<I", sid(value))
+            elif fmt == "<d":
+                body += struct.pack(fmt, value)
+            else:
+                body += struct.pack(fmt, *value)
+        item_buf += _OPTZ_ITEM.pack(_OPTZ_TYPES.index(kind), mask, sid(d.get("layer"))) + body
+        count += 1
+    layer_ids = [sid(name) for name in scene.get("layers", ())]
+
+    out = bytearray(_OPTZ_HEADER.pack(OPTZ_TABLE_MAGIC, OPTZ_TABLE_VERSION,
+                                      int(scene["width"]), int(scene["height"])))
+    out += struct.pack("<I", len(strings))
+    for text in strings:
+        raw = text.encode("utf-8")
+        out += struct.pack("<H", len(raw)) + raw
+    out += struct.pack("<I", len(asset_ids)) + asset_buf
+    out += struct.pack("<I", count) + item_buf
+    out += struct.pack(f"<I{len(layer_ids)}I", len(layer_ids), *layer_ids)
+    return bytes(out)
+
+def unpack_project_table(data: bytes) -> tuple:
+    """Обратно к словарям, как в JSON: (scene, [(ключ, путь или None)], элементы)."""
+    magic, version, width, height = _OPTZ_HEADER.unpack_from(data, 0)
+    if magic != OPTZ_TABLE_MAGIC:
+        raise ValueError("это не таблица проекта .optz")
+    if version > OPTZ_TABLE_VERSION:
+        raise ValueError(f"таблица .optz версии {version} новее поддерживаемой")
+    pos = _OPTZ_HEADER.size
+
+    def take(fmt):
+        nonlocal pos
+        values = struct.unpack_from(fmt, data, pos)
+        pos += struct.calcsize(fmt)
+        return values
+
+    strings = []
+    for _ in range(take("<I")[0]):
+        n, = take("<H")
+        strings.append(data[pos:pos + n].decode("utf-8"))
+        pos += n
+    text = lambda i: None if i == _OPTZ_NO_STRING else strings[i]
+
+    assets = []
+    for _ in range(take("<I")[0]):
+        linked, sha1, path_id = take(_OPTZ_ASSET.format)
+        assets.append((sha1.hex(), text(path_id) if linked else None))
+
+    items = []
+    for _ in range(take("<I")[0]):
+        kind_id, mask, layer_id = take(_OPTZ_ITEM.format)
+        kind = _OPTZ_TYPES[kind_id]
+        d = {"type": kind, "layer": text(layer_id)}
+        if kind == "laser":
+            x1, y1, x2, y2 = take("<4d")
+            d["p1"], d["p2"] = [x1, y1], [x2, y2]
+        else:
+            if kind == "png":
+                d["asset"] = assets[take("<I")[0]][0]
+            d["pos"] = list(take("<2d"))
+        for bit, key, fmt, default in _OPTZ_FIELDS[kind]:
+            if not mask & bit:
+                d[key] = default
+            elif fmt == "str":
+                d[key] = text(take("<I")[0])
+            elif fmt == "<d":
+                d[key] = take(fmt)[0]
+            else:
+                d[key] = list(take(fmt))
+        items.append(d)
+    scene = {"width": width, "height": height}
+    if version >= 2:
+        n, = take("<I")
+        scene["layers"] = [text(i) for i in take(f"<{n}I")]
+    return scene, assets, items
+
+
+class ProjectOptzWriter(ProjectWriter):
+    """Контейнер .optz: PNG лежат в zip без сжатия (ZIP_STORED), поэтому читаются
+    через mmap прямо из файла; таблица элементов пишется последней и сжимается."""
+
+    def _write(self, tmp: str):
+        with zipfile.ZipFile(tmp, "w") as zf:
+            for key, entry in self.assets.items():
+                if self._cancelled.is_set():
+                    return
+                if isinstance(entry, bytes):
+                    zf.writestr(f"assets/{key}.png", entry, compress_type=zipfile.ZIP_STORED)
+                self.assets_written += 1
+            items = list(self._items())
+            if self._cancelled.is_set():
+                return
+            zf.writestr(OPTZ_TABLE_NAME, pack_project_table(self.header["scene"], self.assets, items),
+                        compress_type=zipfile.ZIP_DEFLATED)
+
+
+class ProjectOptzReader:
+    """Чтение .optz с тем же events(), что у ProjectJsonReader.
+
+    Таблица элементов разбирается целиком (она маленькая), а PNG остаются
+    в файле: декодер читает их срезом mmap и только для картинок,
+    на которые ссылается хотя бы один элемент.
+    """
+
+    def __init__(self, path: str):
+        self._f = open(path, "rb")
+        try:
+            self.size = os.fstat(self._f.fileno()).st_size
+            self.bytes_read = 0
+            self._zip = zipfile.ZipFile(self._f)
+            # mmap переживает close(): его держат ссылки из записей assets до конца декодирования
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._f.close()
+            raise
+
+    def close(self):
+        self._zip.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _blob(self, name: str) -> tuple:
+        info = self._zip.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:  # архив пересжали — читаем как есть
+            data = self._zip.read(name)
+            return data, 0, len(data)
+        # данные начинаются сразу за локальным заголовком записи
+        off = info.header_offset
+        if self._mm[off:off + 4] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"повреждена запись {name}")
+        name_len, extra_len = struct.unpack_from("<HH", self._mm, off + 26)
+        return self._mm, off + 30 + name_len + extra_len, info.file_size
+
+    def events(self):
+        scene, assets, items = unpack_project_table(self._zip.read(OPTZ_TABLE_NAME))
+        yield "scene", scene
+        used = {d["asset"] for d in items if "asset" in d}
+        for key, path in assets:
+            if key not in used:
+                continue
+            if path is not None:
+                yield "asset", (key, {"path": path, "sha1": key})
+            else:
+                yield "asset", (key, {"blob": self._blob(f"assets/{key}.png"), "sha1": key})
+        for i, d in enumerate(items, 1):
+            self.bytes_read = self.size * i // len(items)
+            yield "item", d
+
+
+def is_optz_path(path: str) -> bool:
+    return path.lower().endswith(PROJECT_OPTZ_EXT)
+
+def open_project_reader(path: str):
+    """Читатель проекта по расширению файла: .optz или JSON."""
+    return ProjectOptzReader(path) if is_optz_path(path) else ProjectJsonReader(path)
+
+def project_writer(path: str, header: dict, assets: dict) -> ProjectWriter:
+    """Фоновый писатель проекта по расширению файла: .optz или JSON."""
+    cls = ProjectOptzWriter if is_optz_path(path) else ProjectJsonWriter
+    return cls(path, header, assets)
+
+def save_project_scene(scene: QGraphicsScene, path: str, components_dir: Optional[str] = None):
+    """Сохраняет сцену в проект (без окна), синхронно. С components_dir картинки
+    из библиотеки сохраняются ссылками."""
+    assets, items = {}, []
+    for it in iter_project_items(scene):
+        d = serialize_item(it, assets, components_dir)
+        if d:
+            items.append(d)
+    rect = scene.sceneRect()
+    header = {"version": PROJECT_FORMAT_VERSION,
+              "scene": {"width": int(rect.width()), "height": int(rect.height())}}
+    if hasattr(scene, "user_layer_names"):
+        header["scene"]["layers"] = scene.user_layer_names()
+    writer = project_writer(path, header, assets)
+    for d in items:
+        writer.put(d)
+    writer.finish()
+    writer.run()  # в этом же потоке
+    if writer.error is not None:
+        raise writer.error
+
+
+@profiled("load/read")
+def read_project_events(path: str, out: queue.Queue, stop: threading.Event):
+    """Фоновый поток чтения: события читателя проекта складываются в очередь
+    вместе с прогрессом (прочитано, размер); в конце — "end" или "error"."""
+    def put(event) -> bool:
+        while not stop.is_set():
+            try:
+                out.put(event, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    try:
+        with open_project_reader(path) as reader:
+            for kind, value in reader.events():
+                if not put((kind, value, reader.bytes_read, reader.size)):
+                    return
+        put(("end", None, 1, 1))
+    except Exception as e:
+        put(("error", e, 1, 1))
+
+
+def iter_project_items(scene: QGraphicsScene):
+    """Объекты сцены, которые сохраняются в проект (без вспомогательных)."""
+    for it in scene.items():
+        if isinstance(it, (DraggableComponent, ScalablePixmapItem, LaserLine)):
+            yield it
+
+def components_relpath(path: Optional[str], components_dir: str) -> Optional[str]:
+    """Путь относительно components/ (через «/»), если файл лежит внутри папки компонентов."""
+    if not path:
+        return None
+    rel = os.path.relpath(os.path.abspath(path), components_dir)
+    if rel.startswith(os.pardir) or os.path.isabs(rel):
+        return None
+    return rel.replace(os.sep, "/")
+
+def register_asset(image: SharedImage, assets: dict, components_dir: Optional[str] = None) -> str:
+    """Кладёт картинку в таблицу assets (один раз на содержимое), возвращает ключ.
+    С components_dir картинки из библиотеки сохраняются ссылкой на файл."""
+    key = image.key
+    if key in assets:
+        return key
+    rel = components_relpath(image.path, components_dir) if components_dir else None
+    if rel is not None:
+        assets[key] = {"path": rel, "sha1": key}
+    else:
+        assets[key] = image.png_bytes()  # сырые байты: как их хранить, решает писатель проекта
+    return key
+
+def serialize_item(item, assets: Optional[dict] = None, components_dir: Optional[str] = None) -> Optional[dict]:
+    """Словарь для JSON. Если передана таблица assets — картинка кладётся туда,
+    а элемент хранит только её ключ; иначе PNG встраивается в сам элемент."""
+    lname = get_item_layer(item)
+    if isinstance(item, DraggableComponent):
+        return {
+            "type": "component",
+            "label": item.toolTip(),
+            "layer": lname,
+            "pos": [item.pos().x(), item.pos().y()],
+            "rotation": item.rotation(),
+            "opacity": item.opacity(),
+            "transform": transform_to_list(item.transform())
+        }
+    if isinstance(item, ScalablePixmapItem):
+        d = {"type": "png"}
+        if assets is None:
+            d["png_b64"] = base64.b64encode(item.image.png_bytes()).decode("ascii")
+        else:
+            d["asset"] = register_asset(item.image, assets, components_dir)
+        d.update({
+            "layer": lname,
+            "pos": [item.pos().x(), item.pos().y()],
+            "rotation": item.rotation(),
+            "opacity": item.opacity(),
+            "scale": item.scale(),
+            "transform": transform_to_list(item.transform())
+        })
+        return d
+    if isinstance(item, LaserLine):
+        ln = item.line()
+        p1 = item.mapToScene(ln.p1()); p2 = item.mapToScene(ln.p2())
+        pen = item.pen()
+        return {
+            "type": "laser",
+            "layer": lname,
+            "p1": [p1.x(), p1.y()],
+            "p2": [p2.x(), p2.y()],
+            "color": [pen.color().red(), pen.color().green(), pen.color().blue(), pen.color().alpha()],
+            "width": pen.widthF()
+        }
+    return None
+
+def build_item(it: dict, delta: QPointF = QPointF(0, 0), assets: Optional[dict] = None):
+    """Объект из словаря проекта, смещённый на delta, ещё не на сцене: все свойства
+    выставляются до вставки, чтобы индекс сцены и наблюдатели не видели промежуточных шагов."""
+    t = it.get("type"); lname = it.get("layer", "Слой 1")
+    if t == "component":
+        obj = DraggableComponent(it.get("label", "Компонент"))
+        obj.setPos(it["pos"][0] + delta.x(), it["pos"][1] + delta.y())
+        obj.setRotation(it.get("rotation", 0.0))
+        obj.setOpacity(it.get("opacity", 1.0))
+        obj.setTransform(transform_from_list(it.get("transform", [1,0,0,0,1,0,0,0,1])))
+        set_item_layer(obj, lname); return obj
+
+    if t == "png":
+        if "asset" in it:
+            image = (assets or {}).get(it["asset"])
+        else:
+            try:
+                image = image_from_b64(it.get("png_b64", ""))
+            except Exception:
+                return None
+        if image is None:
+            return None
+        obj = ScalablePixmapItem(image)
+        obj.setPos(it["pos"][0] + delta.x(), it["pos"][1] + delta.y())
+        obj.setRotation(it.get("rotation", 0.0))
+        obj.setOpacity(it.get("opacity", 1.0))
+        obj.setScale(it.get("scale", 1.0))
+        obj.setTransform(transform_from_list(it.get("transform", [1,0,0,0,1,0,0,0,1])))
+        set_item_layer(obj, lname); return obj
+
+    if t == "laser":
+        p1 = it.get("p1", [0, 0]); p2 = it.get("p2", [0, 0])
+        col = it.get("color", [255, 0, 0, 255])
+        pen = QPen(QColor(*col), float(it.get("width", 2.5))); pen.setCosmetic(True)
+        obj = LaserLine(p1[0] + delta.x(), p1[1] + delta.y(), p2[0] + delta.x(), p2[1] + delta.y())
+        obj.setPen(pen)
+        set_item_layer(obj, lname); return obj
+    return None
+
+def instantiate_items(scene: QGraphicsScene, dicts, delta: QPointF = QPointF(0, 0),
+                      assets: Optional[dict] = None) -> list:
+    """Создаёт пачку объектов из словарей проекта и добавляет их на сцену разом."""
+    objs = [obj for obj in (build_item(it, delta, assets) for it in dicts) if obj is not None]
+    if isinstance(scene, Scene):
+        scene.add_items(objs)
+    else:
+        for obj in objs:
+            scene.addItem(obj)
+    return objs
+
+# ---- БУФЕР ОБМЕНА ----
+# Внутри процесса копия — это словари элементов и живые SharedImage: ни PNG, ни base64.
+# Байты собираются, только если вставку просит другой процесс (другое окно редактора).
+
+def snapshot_items(items) -> dict:
+    """Снимок элементов: словари как в проекте, картинки — {ключ: SharedImage}."""
+    images, out = {}, []
+    for it in items:
+        if isinstance(it, ScalablePixmapItem):
+            # ключ уже в таблице — register_asset вернёт его, не доставая байты PNG
+            images[it.image.key] = it.image
+        d = serialize_item(it, images)
+        if d:
+            out.append(d)
+    return {"items": out, "images": images}
+
+def snapshot_to_json(snapshot: dict) -> bytes:
+    """Снимок для другого процесса: картинки — таблицей assets, как в проекте."""
+    assets = {key: {"png_b64": base64.b64encode(image.png_bytes()).decode("ascii")}
+              for key, image in snapshot["images"].items()}
+    doc = {"version": PROJECT_FORMAT_VERSION, "assets": assets, "items": snapshot["items"]}
+    return json.dumps(doc, ensure_ascii=False).encode("utf-8")
+
+def snapshot_from_json(data: bytes) -> Optional[dict]:
+    try:
+        doc = json.loads(bytes(data).decode("utf-8"))
+        images = {}
+        for key, entry in doc.get("assets", {}).items():
+            image = image_from_b64(entry.get("png_b64", ""))
+            if image is not None:
+                images[key] = image
+        return {"items": list(doc.get("items", [])), "images": images}
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class ItemsMimeData(QMimeData):
+    """Элементы в системном буфере обмена. Своё окно (любое в этом процессе) берёт
+    snapshot напрямую; JSON строится лениво, когда данные запрашивает другая программа."""
+    def __init__(self, snapshot: dict):
+        super().__init__()
+        self.snapshot = snapshot
+
+    def formats(self):
+        return [ITEMS_MIME_TYPE]
+
+    def hasFormat(self, mime_type):
+        return mime_type == ITEMS_MIME_TYPE
+
+    def retrieveData(self, mime_type, preferred_type):
+        if mime_type != ITEMS_MIME_TYPE:
+            return None
+        return QByteArray(snapshot_to_json(self.snapshot))
+
+# === АВТОСОХРАНЕНИЕ ===
+# Журнал — autosave.journal, по строке JSON на запись:
+#   scene (размер холста), asset (картинка, один раз), add (элемент целиком),
+#   move / transform / layer (только изменившиеся поля), delete, clear.
+# Время от времени состояние сворачивается в снимок autosave.json (обычный
+# проект + uid у элементов и journal_seq), а журнал начинается заново.
+# У каждого окна-процесса своя папка сессии <pid>-<случайное> с файлом блокировки:
+# восстановить предлагается только сессию, чью блокировку никто не держит.
+
+def autosave_dir() -> str:
+    base = QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation)
+    return os.path.join(base, "optics_app", "autosave")
+
+def new_autosave_session(base: str):
+    """Папка новой сессии и её захваченная блокировка."""
+    directory = os.path.join(base, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(directory, exist_ok=True)
+    return directory, lock_autosave_session(directory)
+
+def lock_autosave_session(directory: str) -> Optional[QLockFile]:
+    """Блокировка сессии или None, если её держит живой процесс.
+    Блокировка упавшего процесса считается устаревшей и перехватывается."""
+    lock = QLockFile(os.path.join(directory, AUTOSAVE_LOCK_NAME))
+    lock.setStaleLockTime(0)  # сессия может длиться часами: устаревшей делает только смерть процесса
+    return lock if lock.tryLock(0) else None
+
+def orphaned_autosave_sessions(base: str, own: str) -> list:
+    """[(папка, блокировка)] брошенных сессий, новые первыми. Блокировки остаются
+    захваченными — второе окно, запущенное одновременно, эти сессии не увидит."""
+    try:
+        names = os.listdir(base)
+    except OSError:
+        return []
+    found = []
+    for name in names:
+        path = os.path.join(base, name)
+        if not os.path.isdir(path) or path == own:
+            continue
+        lock = lock_autosave_session(path)
+        if lock is not None:
+            found.append((os.path.getmtime(path), path, lock))
+    found.sort(key=lambda f: f[0], reverse=True)
+    return [(path, lock) for _, path, lock in found]
+
+def remove_autosave_session(directory: str, lock: Optional[QLockFile]):
+    """Удаляет папку сессии вместе с её блокировкой."""
+    if lock is not None:
+        lock.unlock()
+    shutil.rmtree(directory, ignore_errors=True)
+
+def new_item_uid() -> str:
+    return uuid.uuid4().hex
+
+def new_journal_state() -> dict:
+    return {"seq": 0, "scene": None, "assets": {}, "items": {}}
+
+def apply_journal_record(state: dict, rec: dict):
+    """Применяет запись журнала к состоянию (словари, без Qt)."""
+    op = rec.get("op")
+    items = state["items"]
+    if op == "add":
+        items[rec["uid"]] = rec["item"]
+    elif op in ("move", "transform", "layer"):
+        it = items.get(rec["uid"])
+        if it is not None:
+            it.update(rec["set"])
+    elif op == "delete":
+        items.pop(rec["uid"], None)
+    elif op == "clear":
+        items.clear()  # картинки остаются: повторно их в журнал не пишут
+    elif op == "asset":
+        state["assets"][rec["key"]] = rec["entry"]
+    elif op == "scene":
+        state["scene"] = {"width": rec["width"], "height": rec["height"]}
+        if "layers" in rec:
+            state["scene"]["layers"] = rec["layers"]
+    state["seq"] = rec.get("seq", state["seq"])
+
+def read_autosave(directory: str) -> Optional[dict]:
+    """Снимок + хвост журнала -> состояние сессии; None, если автосохранения нет."""
+    snapshot = os.path.join(directory, "autosave.json")
+    journal = os.path.join(directory, "autosave.journal")
+    if not os.path.exists(snapshot) and not os.path.exists(journal):
+        return None
+    state = new_journal_state()
+    if os.path.exists(snapshot):
+        with ProjectJsonReader(snapshot) as reader:
+            for kind, value in reader.events():
+                if kind == "journal_seq":
+                    state["seq"] = value
+                elif kind == "scene":
+                    state["scene"] = value
+                elif kind == "asset":
+                    state["assets"][value[0]] = value[1]
+                elif kind == "item":
+                    state["items"][value.pop("uid")] = value
+    if os.path.exists(journal):
+        with open(journal, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break  # оборванная последняя строка — запись не успела дописаться
+                if rec.get("seq", 0) > state["seq"]:
+                    apply_journal_record(state, rec)
+    return state
+
+
+class AutosaveJournal(threading.Thread):
+    """Фоновый писатель журнала автосохранения.
+
+    GUI-поток только кладёт записи в очередь (record); здесь они нумеруются,
+    дописываются в журнал и применяются к собственной копии состояния,
+    из которой раз в AUTOSAVE_COMPACT_RECORDS записей пишется снимок.
+    """
+    _STOP = object()
+
+    def __init__(self, directory: str, state: Optional[dict] = None):
+        super().__init__(daemon=True, name="autosave")
+        self.directory = directory
+        self.journal_path = os.path.join(directory, "autosave.journal")
+        self.snapshot_path = os.path.join(directory, "autosave.json")
+        self.recovered = state is not None
+        self.state = state if state is not None else new_journal_state()
+        self.error = None
+        self._queue = queue.Queue()
+        self._discard = False
+
+    def record(self, rec: dict):
+        self._queue.put(rec)
+
+    def close(self, discard: bool = False):
+        """Дописывает очередь и останавливает поток; discard — удалить файлы (чистый выход)."""
+        self._discard = discard
+        self._queue.put(self._STOP)
+        self.join()
+
+    def _compact(self, f):
+        """Снимок состояния вместо журнала. Если упадём посередине — при чтении
+        записи журнала с seq не новее снимка пропускаются."""
+        state = self.state
+        used = {it.get("asset") for it in state["items"].values()}
+        header = {"version": PROJECT_FORMAT_VERSION, "journal_seq": state["seq"],
+                  "scene": state["scene"] or {"width": SCENE_WIDTH, "height": SCENE_HEIGHT}}
+        writer = ProjectJsonWriter(self.snapshot_path, header,
+                                   {k: v for k, v in state["assets"].items() if k in used})
+        for uid, it in state["items"].items():
+            writer.put(dict(it, uid=uid))
+        writer.finish()
+        writer.run()
+        if writer.error is not None:
+            raise writer.error
+        f.seek(0)
+        f.truncate()
+
+    def run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        written = 0
+        try:
+            with open(self.journal_path, "a" if self.recovered else "w", encoding="utf-8") as f:
+                if self.recovered:
+                    self._compact(f)  # восстановленная или открытая из файла сессия сразу становится снимком
+                elif os.path.exists(self.snapshot_path):
+                    os.remove(self.snapshot_path)
+                while True:
+                    rec = self._queue.get()
+                    batch = []
+                    while rec is not self._STOP:
+                        batch.append(rec)
+                        try:
+                            rec = self._queue.get_nowait()
+                        except queue.Empty:
+                            rec = None
+                            break
+                    for r in batch:
+                        self.state["seq"] += 1
+                        r["seq"] = self.state["seq"]
+                        if r["op"] == "asset" and isinstance(r["entry"], bytes):
+                            r["entry"] = {"png_b64": base64.b64encode(r["entry"]).decode("ascii")}
+                        apply_journal_record(self.state, r)
+                        f.write(json.dumps(r, ensure_ascii=False) + "\n")
+                    if batch:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        written += len(batch)
+                        if written >= AUTOSAVE_COMPACT_RECORDS:
+                            self._compact(f)
+                            written = 0
+                    if rec is self._STOP:
+                        break
+        except Exception as e:
+            self.error = e
+        if self._discard:
+            for path in (self.journal_path, self.snapshot_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+class AutosaveRecorder:
+    """GUI-сторона автосохранения — наблюдатель сцены (Scene.observers).
+
+    Запоминает, какие элементы изменились; flush() (по таймеру) сериализует
+    только их и отправляет в журнал отличия от прошлой записи.
+    """
+    def __init__(self, scene: QGraphicsScene, journal: AutosaveJournal, components_dir: str):
+        self.scene = scene
+        self.journal = journal
+        self.components_dir = components_dir
+        self._dirty = {}     # uid -> элемент, ждущий записи
+        self._written = {}   # uid -> последний записанный словарь
+        self._assets = set(journal.state["assets"])
+        self._scene_key = None  # (ширина, высота, слои) последней записи scene
+        sc = journal.state["scene"]
+        if sc:
+            self._scene_key = (sc["width"], sc["height"], tuple(sc.get("layers", ())))
+
+    def adopt(self, items_by_uid: dict, state: dict):
+        """Элементы, восстановленные из журнала: уже записаны, повторно не пишем."""
+        for uid in items_by_uid:
+            if uid in state["items"]:
+                self._written[uid] = dict(state["items"][uid])
+
+    def item_added(self, item):
+        if not isinstance(item, (DraggableComponent, ScalablePixmapItem, LaserLine)):
+            return
+        uid = item.data(ITEM_UID_ROLE)
+        if uid is None:
+            uid = new_item_uid()
+            item.setData(ITEM_UID_ROLE, uid)
+        self._dirty[uid] = item
+
+    def item_changed(self, item):
+        uid = item.data(ITEM_UID_ROLE)
+        if uid is not None:
+            self._dirty[uid] = item
+
+    def item_removed(self, item):
+        uid = item.data(ITEM_UID_ROLE)
+        if uid is None:
+            return
+        self._dirty.pop(uid, None)
+        if self._written.pop(uid, None) is not None:
+            self.journal.record({"op": "delete", "uid": uid})
+
+    def cleared(self):
+        self._dirty.clear()
+        self._written.clear()
+        self.journal.record({"op": "clear"})
+
+    def flush(self):
+        rect = self.scene.sceneRect()
+        size = (int(rect.width()), int(rect.height()))
+        layers = tuple(self.scene.user_layer_names())
+        if (*size, layers) != self._scene_key:
+            self._scene_key = (*size, layers)
+            self.journal.record({"op": "scene", "width": size[0], "height": size[1], "layers": list(layers)})
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        for uid, item in dirty.items():
+            assets = {}
+            try:
+                d = serialize_item(item, assets, self.components_dir)
+            except RuntimeError:  # элемент уже удалён со стороны Qt
+                continue
+            if d is None:
+                continue
+            for key, entry in assets.items():
+                if key not in self._assets:
+                    self._assets.add(key)
+                    self.journal.record({"op": "asset", "key": key, "entry": entry})
+            old = self._written.get(uid)
+            self._written[uid] = d
+            if old is None:
+                self.journal.record({"op": "add", "uid": uid, "item": d})
+                continue
+            changed = {k: v for k, v in d.items() if old.get(k) != v}
+            if not changed:
+                continue
+            if changed.keys() <= {"pos", "p1", "p2"}:
+                op = "move"
+            elif changed.keys() == {"layer"}:
+                op = "layer"
+            else:
+                op = "transform"
+            self.journal.record({"op": op, "uid": uid, "set": changed})
+
+
+# === ИСТОРИЯ (UNDO/REDO) ===
+# Шаг истории хранит не снимок сцены, а только то, что изменилось: для сдвигов и
+# трансформаций — старые и новые значения изменившихся полей, для удаления и
+# вставки — сами объекты. Картинка остаётся у объекта (SharedImage), в историю
+# она не копируется.
+
+def item_state(item) -> dict:
+    """Поля элемента, которые меняет пользователь (без картинки)."""
+    return {
+        "pos": (item.pos().x(), item.pos().y()),
+        "rotation": item.rotation(),
+        "opacity": item.opacity(),
+        "scale": item.scale(),
+        "transform": tuple(transform_to_list(item.transform())),
+        "layer": get_item_layer(item),
+    }
+
+def apply_item_state(item, state: dict):
+    if "transform" in state:
+        item.setTransform(transform_from_list(state["transform"]))
+    if "rotation" in state:
+        item.setRotation(state["rotation"])
+    if "scale" in state:
+        item.setScale(state["scale"])
+    if "opacity" in state:
+        item.setOpacity(state["opacity"])
+    if "pos" in state:
+        item.setPos(*state["pos"])
+    if "layer" in state:
+        set_item_layer(item, state["layer"])
+
+def _state_bytes(state: dict) -> int:
+    size = sys.getsizeof(state)
+    for v in state.values():
+        size += sys.getsizeof(v)
+        if isinstance(v, tuple):
+            size += sum(sys.getsizeof(x) for x in v)
+    return size
+
+
+class TransformCommand:
+    """Сдвиг/поворот/отражение/прозрачность/масштаб/слой: по элементу — только изменившиеся поля."""
+    def __init__(self, text: str, deltas: list, merge_id: Optional[str] = None):
+        self.text = text
+        self.deltas = deltas  # [(элемент, было, стало)]
+        self.merge_id = merge_id
+        self.cost = sum(_state_bytes(a) + _state_bytes(b) for _, a, b in deltas)
+
+    def merge(self, other: "TransformCommand") -> bool:
+        """Склеивает подряд идущие шаги одного вида (колесо мыши) над теми же элементами."""
+        if self.merge_id is None or other.merge_id != self.merge_id:
+            return False
+        mine = {id(it): (before, after) for it, before, after in self.deltas}
+        if set(mine) != {id(it) for it, _, _ in other.deltas}:
+            return False
+        deltas = []
+        for it, before, after in other.deltas:
+            old_before, old_after = mine[id(it)]
+            deltas.append((it, {**before, **old_before}, {**old_after, **after}))
+        self.deltas = deltas
+        self.cost = sum(_state_bytes(a) + _state_bytes(b) for _, a, b in deltas)
+        return True
+
+    def _apply(self, scene, which: int):
+        for d in self.deltas:
+            apply_item_state(d[0], d[which])
+        if hasattr(scene, "note_changed"):
+            scene.note_changed([d[0] for d in self.deltas if d[0].scene() is scene])
+
+    def undo(self, scene):
+        self._apply(scene, 1)
+
+    def redo(self, scene):
+        self._apply(scene, 2)
+
+
+class RemoveCommand:
+    """Удаление: объекты остаются живыми в истории и при отмене возвращаются на сцену."""
+    def __init__(self, text: str, items: list):
+        self.text = text
+        self.items = items
+        self.cost = UNDO_ITEM_BYTES * len(items)
+
+    def undo(self, scene):
+        if isinstance(scene, Scene):
+            scene.add_items(self.items)
+        else:
+            for it in self.items:
+                scene.addItem(it)
+
+    def redo(self, scene):
+        for it in self.items:
+            if it.scene() is scene:
+                scene.removeItem(it)
+
+
+class AddCommand(RemoveCommand):
+    """Вставка/дублирование/новый объект — обратное удалению."""
+    undo, redo = RemoveCommand.redo, RemoveCommand.undo
+
+
+class MacroCommand:
+    """Несколько шагов, которые отменяются одним Ctrl+Z."""
+    def __init__(self, text: str):
+        self.text = text
+        self.commands = []
+        self.cost = 0
+
+    def undo(self, scene):
+        for cmd in reversed(self.commands):
+            cmd.undo(scene)
+
+    def redo(self, scene):
+        for cmd in self.commands:
+            cmd.redo(scene)
+
+
+class UndoStack:
+    """История правок сцены с ограничением по памяти.
+
+    push() записывает уже выполненное действие. Для трансформаций удобнее
+    track() до изменения и commit() после: в шаг попадут только изменившиеся поля.
+    Когда оценка памяти превышает budget_bytes, вытесняются самые старые шаги.
+    """
+    def __init__(self, scene: QGraphicsScene, budget_bytes: int = UNDO_MEMORY_BUDGET):
+        self.scene = scene
+        self.budget_bytes = budget_bytes
+        self._undo = deque()
+        self._redo = []
+        self._bytes = 0
+        self._tracked = {}  # id(элемент) -> (элемент, состояние до действия)
+        self._macro = None
+        self.evictions = 0
+
+    def track(self, items):
+        for it in items:
+            if isinstance(it, (DraggableComponent, ScalablePixmapItem, LaserLine)):
+                self._tracked.setdefault(id(it), (it, item_state(it)))
+
+    def commit(self, text: str, merge_id: Optional[str] = None) -> bool:
+        """Записывает изменения элементов, отмеченных track(). False — ничего не изменилось."""
+        tracked, self._tracked = self._tracked, {}
+        deltas = []
+        for it, before in tracked.values():
+            after = item_state(it)
+            changed = [k for k, v in after.items() if before[k] != v]
+            if changed:
+                deltas.append((it, {k: before[k] for k in changed}, {k: after[k] for k in changed}))
+        if not deltas:
+            return False
+        self.push(TransformCommand(text, deltas, merge_id))
+        return True
 
+    def begin_macro(self, text: str):
+        self._macro = MacroCommand(text)
+
+    def end_macro(self):
+        macro, self._macro = self._macro, None
+        if macro is not None and macro.commands:
+            self.push(macro.commands[0] if len(macro.commands) == 1 else macro)
+
+    def push(self, cmd):
+        if self._macro is not None:
+            self._macro.commands.append(cmd)
+            self._macro.cost += cmd.cost
+            return
+        self._drop_redo()
+        top = self._undo[-1] if self._undo else None
+        if isinstance(top, TransformCommand) and isinstance(cmd, TransformCommand):
+            old_cost = top.cost
+            if top.merge(cmd):
+                self._bytes += top.cost - old_cost
+                self._trim()
+                return
+        self._undo.append(cmd)
+        self._bytes += cmd.cost
+        self._trim()
+
+    def _drop_redo(self):
+        for cmd in self._redo:
+            self._bytes -= cmd.cost
+        self._redo.clear()
+
+    def _trim(self):
+        while self._bytes > self.budget_bytes and self._undo:
+            self._bytes -= self._undo.popleft().cost
+            self.evictions += 1
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def undo(self) -> Optional[str]:
+        if not self._undo:
+            return None
+        cmd = self._undo.pop()
+        cmd.undo(self.scene)
+        self._redo.append(cmd)
+        return cmd.text
+
+    def redo(self) -> Optional[str]:
+        if not self._redo:
+            return None
+        cmd = self._redo.pop()
+        cmd.redo(self.scene)
+        self._undo.append(cmd)
+        return cmd.text
+
+    def clear(self):
+        """Сцена очищена (Qt удалил её объекты) — ссылки на них хранить нельзя."""
+        self._undo.clear()
+        self._redo.clear()
+        self._tracked.clear()
+        self._macro = None
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        return {"undo": len(self._undo), "redo": len(self._redo), "bytes": self._bytes,
+                "budget_bytes": self.budget_bytes, "evictions": self.evictions}
+
+
+# === ЛУЧИ ===
+# Оптические свойства компонентов: путь в components/ (или папка целиком) -> описание.
+# Геометрия задаётся отрезками в долях boundingRect картинки (0..1), до поворота,
+# отражения и масштаба элемента.
+#   source   — луч из точки "at" в направлении "dir"
+#   reflect  — зеркало
+#   split    — делитель: ratio — доля отражённого, остальное проходит
+#   refract  — тонкая линза: focal — фокус в длинах отрезка (< 0 — рассеивающая)
+#   transmit — проходит насквозь, power — пропускание
+#   block    — луч останавливается
+_OPTIC_H = ((0.1, 0.5), (0.9, 0.5))
+_OPTIC_V = ((0.5, 0.1), (0.5, 0.9))
+_OPTIC_DIAG = ((0.15, 0.15), (0.85, 0.85))
+_OPTIC_BOX = (((0, 0), (1, 0)), ((1, 0), (1, 1)), ((1, 1), (0, 1)), ((0, 1), (0, 0)))
+OPTICS_LIBRARY = {
+    "Ист. света": {"kind": "source", "at": (1.0, 0.5), "dir": (1.0, 0.0)},
+    "Отраж. элементы": {"kind": "reflect", "segments": (_OPTIC_H,)},
+    "Отраж. элементы/полупр. зеркало.png": {"kind": "split", "ratio": 0.5, "segments": (_OPTIC_H,)},
+    "Разд. объед. пучка": {"kind": "split", "ratio": 0.5, "segments": (_OPTIC_DIAG,)},
+    "Форм. пучка": {"kind": "refract", "focal": 2.0, "segments": (_OPTIC_V,)},
+    "Форм. пучка/расс. линза.png": {"kind": "refract", "focal": -2.0, "segments": (_OPTIC_V,)},
+    "Форм. пучка/Расширитель_сужатель.png": {"kind": "transmit", "power": 1.0, "segments": (_OPTIC_V,)},
+    "Фильтры": {"kind": "transmit", "power": 0.5, "segments": (_OPTIC_V,)},
+    "Пол. элементы": {"kind": "transmit", "power": 1.0, "segments": (_OPTIC_V,)},
+    "Пол. элементы/лин. поляризатор.png": {"kind": "transmit", "power": 0.5, "segments": (_OPTIC_V,)},
+    "Пол. элементы/поляр. куб.png": {"kind": "split", "ratio": 0.5, "segments": (_OPTIC_DIAG,)},
+    "Модуляторы": {"kind": "transmit", "power": 1.0, "segments": (_OPTIC_V,)},
+    "Детекторы": {"kind": "block", "segments": _OPTIC_BOX},
+}
+_BEAM_KINDS = ("reflect", "split", "refract", "transmit", "block")
+_BEAM_REFLECT, _BEAM_SPLIT, _BEAM_REFRACT, _BEAM_TRANSMIT, _BEAM_BLOCK = range(len(_BEAM_KINDS))
+
+def optics_spec(relpath: Optional[str]) -> Optional[dict]:
+    """Описание из OPTICS_LIBRARY для файла (путь относительно components/) или его папки.
+    Облегчённая копия из .optimized/ описывается так же, как её исходник."""
+    if not relpath:
+        return None
+    if relpath.startswith(ASSET_BUILD_DIR_NAME + "/"):
+        relpath = relpath[len(ASSET_BUILD_DIR_NAME) + 1:]
+    spec = OPTICS_LIBRARY.get(relpath)
+    if spec is None:
+        spec = OPTICS_LIBRARY.get(relpath.split("/", 1)[0])
+    return spec
+
+def optics_library_digests(components_dir: str) -> dict:
+    """sha1 -> путь в components/ для картинок из OPTICS_LIBRARY и их облегчённых копий:
+    так узнаются встроенные в проект картинки. Читает все эти файлы — для фонового потока."""
+    library = {}
+    for rel_name in OPTICS_LIBRARY:
+        full = os.path.join(components_dir, rel_name)
+        paths = [full] if rel_name.endswith(".png") else glob.glob(os.path.join(full, "*.png"))
+        # встроенной в проект может оказаться и облегчённая копия
+        paths += [os.path.join(asset_build_dir(components_dir), os.path.relpath(p, components_dir))
+                  for p in paths]
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    library[png_digest(f.read())] = components_relpath(path, components_dir)
+            except OSError:
+                pass
+    return library
+
+def _exit_distance(o, d, bounds: tuple):
+    """Расстояние вдоль лучей до выхода из прямоугольника (x0, y0, x1, y1)."""
+    x0, y0, x1, y1 = bounds
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tx = np.where(d[:, 0] > 0, (x1 - o[:, 0]) / d[:, 0],
+                      np.where(d[:, 0] < 0, (x0 - o[:, 0]) / d[:, 0], np.inf))
+        ty = np.where(d[:, 1] > 0, (y1 - o[:, 1]) / d[:, 1],
+                      np.where(d[:, 1] < 0, (y0 - o[:, 1]) / d[:, 1], np.inf))
+    return np.maximum(np.minimum(tx, ty), 0.0)
+
+def trace_beams(origins, dirs, sources, segs, kinds, params, bounds: tuple,
+                max_bounces: int = BEAM_MAX_BOUNCES) -> tuple:
+    """Трассирует все лучи разом, по поколению за проход (numpy, без Qt).
+
+    origins, dirs — (M, 2), dirs единичные; sources — (M,) номер источника луча;
+    segs — (N, 4) отрезки элементов x1, y1, x2, y2; kinds — (N,) коды _BEAM_*;
+    params — (N,) ratio / фокус в единицах сцены / пропускание.
+    Лучи без препятствия обрываются на границе bounds.
+    Возвращает (K, 4) отрезки пути, (K,) мощность, (K,) источник, (K,) задетый отрезок или -1.
+    """
+    o = np.asarray(origins, dtype=float).reshape(-1, 2)
+    d = np.asarray(dirs, dtype=float).reshape(-1, 2)
+    src = np.asarray(sources, dtype=int).reshape(-1)
+    segs = np.asarray(segs, dtype=float).reshape(-1, 4)
+    kinds = np.asarray(kinds, dtype=int).reshape(-1)
+    params = np.asarray(params, dtype=float).reshape(-1)
+    power = np.ones(len(o))
+    last = np.full(len(o), -1)  # отрезок, от которого луч только что ушёл
+    a, e = segs[:, :2], segs[:, 2:] - segs[:, :2]
+    length = np.hypot(e[:, 0], e[:, 1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tan = e / length[:, None]
+    nrm = np.stack([-tan[:, 1], tan[:, 0]], axis=1)
+    out_segs, out_power, out_src, out_hit = [], [], [], []
+
+    for _ in range(max_bounces):
+        m = len(o)
+        if not m:
+            break
+        rows = np.arange(m)
+        if len(segs):
+            # o + t·d = a + u·e для всех пар (луч, отрезок)
+            denom = d[:, None, 0] * e[None, :, 1] - d[:, None, 1] * e[None, :, 0]
+            ax = a[None, :, 0] - o[:, None, 0]
+            ay = a[None, :, 1] - o[:, None, 1]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = (ax * e[None, :, 1] - ay * e[None, :, 0]) / denom
+                u = (ax * d[:, None, 1] - ay * d[:, None, 0]) / denom
+            ok = (np.abs(denom) > 1e-12) & (t > 1e-6) & (u >= 0) & (u <= 1)
+            left = last >= 0
+            ok[rows[left], last[left]] = False
+            t = np.where(ok, t, np.inf)
+            j = t.argmin(axis=1)
+            tmin = t[rows, j]
+        else:
+            j = np.zeros(m, dtype=int)
+            tmin = np.full(m, np.inf)
+        hit = np.isfinite(tmin)
+        tend = np.where(hit, tmin, _exit_distance(o, d, bounds))
+        end = o + d * tend[:, None]
+        out_segs.append(np.hstack([o, end]))
+        out_power.append(power)
+        out_src.append(src)
+        out_hit.append(np.where(hit, j, -1))
+
+        # новое поколение лучей из точек попадания
+        p, dh, jh, ph, sh = end[hit], d[hit], j[hit], power[hit], src[hit]
+        kh, nh, th = kinds[jh], nrm[jh], tan[jh]
+        dn = (dh * nh).sum(axis=1)
+        reflected = dh - 2 * dn[:, None] * nh
+        parts = []  # (маска, направления, мощность)
+        mk = kh == _BEAM_REFLECT
+        parts.append((mk, reflected[mk], ph[mk]))
+        mk = kh == _BEAM_SPLIT
+        ratio = params[jh[mk]]
+        parts.append((mk, reflected[mk], ph[mk] * ratio))
+        parts.append((mk, dh[mk], ph[mk] * (1 - ratio)))
+        mk = kh == _BEAM_TRANSMIT
+        parts.append((mk, dh[mk], ph[mk] * params[jh[mk]]))
+        mk = kh == _BEAM_REFRACT
+        if mk.any():
+            # тонкая линза: наклон к оси меняется на -h/f, h — высота точки от центра линзы
+            jr = jh[mk]
+            center = a[jr] + e[jr] / 2
+            h = ((p[mk] - center) * th[mk]).sum(axis=1)
+            dnr = dn[mk]
+            slope = (dh[mk] * th[mk]).sum(axis=1) / np.maximum(np.abs(dnr), 1e-9)
+            slope = slope - h / params[jr]
+            nd = np.sign(dnr)[:, None] * nh[mk] + slope[:, None] * th[mk]
+            nd /= np.hypot(nd[:, 0], nd[:, 1])[:, None]
+            parts.append((mk, nd, ph[mk]))
+        o = np.concatenate([p[mk] for mk, _, _ in parts])
+        d = np.concatenate([nd for _, nd, _ in parts])
+        power = np.concatenate([pw for _, _, pw in parts])
+        src = np.concatenate([sh[mk] for mk, _, _ in parts])
+        last = np.concatenate([jh[mk] for mk, _, _ in parts])
+        strong = power >= BEAM_MIN_POWER
+        o, d, power, src, last = o[strong], d[strong], power[strong], src[strong], last[strong]
+
+    if not out_segs:
+        return np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return (np.concatenate(out_segs), np.concatenate(out_power),
+            np.concatenate(out_src), np.concatenate(out_hit))
+
+def segments_touch_rects(segs, rects) -> "np.ndarray":
+    """(K,) — пересекает ли отрезок x1, y1, x2, y2 хотя бы один прямоугольник x0, y0, x1, y1."""
+    segs = np.asarray(segs, dtype=float).reshape(-1, 4)
+    rects = np.asarray(rects, dtype=float).reshape(-1, 4)
+    p0 = segs[:, None, :2]
+    dd = segs[:, None, 2:] - p0
+    lo, hi = rects[None, :, :2], rects[None, :, 2:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t1 = (lo - p0) / dd
+        t2 = (hi - p0) / dd
+    inside = (p0 >= lo) & (p0 <= hi)
+    flat = dd == 0  # отрезок параллелен оси: либо весь в полосе, либо мимо
+    tmin = np.where(flat, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2))
+    tmax = np.where(flat, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2))
+    enter = np.maximum(tmin.max(axis=-1), 0.0)
+    leave = np.minimum(tmax.min(axis=-1), 1.0)
+    return (enter <= leave).any(axis=1)
+
+
+# геометрия элемента в сцене: вид, параметр, отрезки (x1, y1, x2, y2), для источника —
+# точка и направление; rect — sceneBoundingRect (x0, y0, x1, y1)
+_Optic = namedtuple("_Optic", "kind param segments origin direction rect")
+
+
+class PortIndex:
+    """Порты компонентов в пространственном хеше с ячейкой GRID_SIZE — наблюдатель сцены.
+
+    Поиск ближайшего порта смотрит только ячейки в пределах радиуса, а не всю сцену.
+    Здесь же хранятся концы лучей (LaserLine), прилипшие к портам: при сдвиге или
+    повороте компонента они переезжают вслед. Новый луч прилипает к портам,
+    с которыми совпадают его концы (нарисованный со снэпом, загруженный, вставленный).
+    """
+    def __init__(self, scene: QGraphicsScene):
+        self.scene = scene
+        self._cells = {}    # (i, j) -> {(элемент, порт): QPointF}
+        self._ports = {}    # элемент -> {порт: QPointF}
+        self._links = {}    # элемент -> set лучей, прилипших к его портам
+        self._pending = set()  # добавленные лучи: прилипают после того, как добавится вся пачка
+        self._timer = QTimer(scene)  # живёт, пока жива сцена, за которой следит индекс
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self.attach_pending)
+
+    @staticmethod
+    def _cell(p: QPointF) -> tuple:
+        return math.floor(p.x() / GRID_SIZE), math.floor(p.y() / GRID_SIZE)
+
+    def _unindex(self, item):
+        for name, p in self._ports.pop(item, {}).items():
+            cell = self._cells.get(self._cell(p))
+            if cell is not None:
+                cell.pop((item, name), None)
+                if not cell:
+                    del self._cells[self._cell(p)]
+
+    def _reindex(self, item):
+        self._unindex(item)
+        if item.scene() is not self.scene:
+            return
+        br = item.rect() if isinstance(item, DraggableComponent) else item.boundingRect()
+        ports = {name: item.mapToScene(QPointF(br.x() + u * br.width(), br.y() + v * br.height()))
+                 for name, (u, v) in ITEM_PORTS.items()}
+        self._ports[item] = ports
+        for name, p in ports.items():
+            self._cells.setdefault(self._cell(p), {})[(item, name)] = p
+
+    def port_pos(self, item, name: str) -> Optional[QPointF]:
+        return self._ports.get(item, {}).get(name)
+
+    def nearest(self, p: QPointF, radius: float) -> Optional[tuple]:
+        """(элемент, порт, точка) ближайшего порта не дальше radius или None."""
+        ci, cj = self._cell(p)
+        reach = max(1, math.ceil(radius / GRID_SIZE))
+        best, best_d = None, radius
+        for i in range(ci - reach, ci + reach + 1):
+            for j in range(cj - reach, cj + reach + 1):
+                for (item, name), q in self._cells.get((i, j), {}).items():
+                    d = math.hypot(q.x() - p.x(), q.y() - p.y())
+                    if d <= best_d:
+                        best, best_d = (item, name, q), d
+        return best
+
+    def attach(self, line: LaserLine, end: int, item, name: str):
+        self.detach(line, end)
+        line.ports[end] = (item, name)
+        self._links.setdefault(item, set()).add(line)
+
+    def detach(self, line: LaserLine, end: int):
+        port, other = line.ports[end], line.ports[1 - end]
+        line.ports[end] = None
+        if port is not None and (other is None or other[0] is not port[0]):
+            self._links.get(port[0], set()).discard(line)
+
+    def attach_pending(self):
+        pending, self._pending = self._pending, set()
+        for line in pending:
+            if line.scene() is not self.scene:
+                continue
+            for end, p in enumerate(line.endpoints()):
+                port = line.ports[end]
+                if port is not None:  # луч вернули на сцену (отмена удаления)
+                    self._links.setdefault(port[0], set()).add(line)
+                    continue
+                hit = self.nearest(p, 0.5)
+                if hit is not None:
+                    self.attach(line, end, hit[0], hit[1])
+
+    def _follow(self, item) -> list:
+        """Переносит прилипшие к item концы лучей в новые точки портов."""
+        moved = []
+        for line in self._links.get(item, ()):
+            if line.scene() is not self.scene:
+                continue
+            for end in (0, 1):
+                port = line.ports[end]
+                if port is not None and port[0] is item:
+                    p = self.port_pos(item, port[1])
+                    if p is not None:
+                        line.set_endpoint(end, p)
+            moved.append(line)
+        return moved
+
+    # --- наблюдатель сцены ---
+
+    def item_added(self, item):
+        if isinstance(item, (DraggableComponent, ScalablePixmapItem)):
+            self._reindex(item)
+        elif isinstance(item, LaserLine):
+            self._pending.add(item)
+            self._timer.start()
+
+    def item_changed(self, item):
+        if isinstance(item, (DraggableComponent, ScalablePixmapItem)):
+            self._reindex(item)
+            moved = self._follow(item)
+            if moved:
+                self.scene.note_changed(moved)  # новые концы лучей — в автосохранение
+        elif isinstance(item, LaserLine):
+            # луч сдвинули сам по себе — концы, ушедшие с порта, отлипают
+            for end, p in enumerate(item.endpoints()):
+                port = item.ports[end]
+                q = self.port_pos(*port) if port is not None else None
+                if port is not None and (q is None or math.hypot(q.x() - p.x(), q.y() - p.y()) > 0.5):
+                    self.detach(item, end)
+
+    def items_moved(self, items):
+        """Перетаскивание ещё идёт: концы лучей едут за элементами (без записи в журнал)."""
+        for it in items:
+            if isinstance(it, (DraggableComponent, ScalablePixmapItem)):
+                self._reindex(it)
+                self._follow(it)
+
+    def item_removed(self, item):
+        if isinstance(item, (DraggableComponent, ScalablePixmapItem)):
+            self._unindex(item)  # прилипшие лучи помнят его: вернётся при отмене удаления
+        elif isinstance(item, LaserLine):
+            self._pending.discard(item)
+            for port in item.ports:
+                if port is not None:
+                    self._links.get(port[0], set()).discard(item)
+
+    def cleared(self):
+        self._cells.clear()
+        self._ports.clear()
+        self._links.clear()
+        self._pending.clear()
+
+
+class BeamPath(QGraphicsPathItem):
+    """Лучи одного источника. Не элемент проекта: не сохраняется и не выделяется."""
+    def __init__(self):
+        super().__init__()
+        pen = QPen(QColor(255, 0, 0, 210), 2.5)
+        pen.setCosmetic(True)
+        self.setPen(pen)
+        self.setZValue(BEAM_Z)
+        self.setAcceptedMouseButtons(Qt.NoButton)
+
+    def set_segments(self, segs):
+        path = QPainterPath()
+        for x1, y1, x2, y2 in segs.tolist():
+            path.moveTo(x1, y1)
+            path.lineTo(x2, y2)
+        self.setPath(path)
+
+
+class BeamTracer:
+    """Лучи от источников света — наблюдатель сцены (Scene.observers).
+
+    Держит геометрию оптических элементов и путь каждого источника. Изменения
+    копятся и раз в BEAM_UPDATE_MS обрабатываются пачкой: перетрассируются только
+    источники, которые сами сдвинулись, или чей путь задевает прежнее или новое место
+    изменённого элемента. Все такие источники трассируются одним вызовом trace_beams.
+    """
+    def __init__(self, scene: QGraphicsScene, components_dir: str):
+        self.scene = scene
+        self.components_dir = components_dir
+        self._optics = {}       # элемент -> _Optic
+        self._beams = {}        # источник -> (BeamPath, отрезки пути)
+        self._changed = set()
+        self._spec_by_key = {}  # sha1 картинки -> описание или None
+        self._library = None    # Future: sha1 -> путь в components/ (для встроенных картинок)
+        self._awaiting = set()  # элементы со встроенной картинкой, ждущие эту таблицу
+        self.traced = 0         # сколько раз источники перетрассировались (для отладки)
+        self._timer = QTimer(scene)  # живёт, пока жива сцена, за которой следит трассировщик
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(BEAM_UPDATE_MS)
+        self._timer.timeout.connect(self.update)
+
+    # --- наблюдатель сцены ---
+
+    def item_added(self, item):
+        self.items_moved((item,))
+
+    def item_changed(self, item):
+        self.items_moved((item,))
+
+    def item_removed(self, item):
+        self.items_moved((item,))
+
+    def cleared(self):
+        # пути удалит сама сцена
+        self._optics.clear()
+        self._beams.clear()
+        self._changed.clear()
+        self._awaiting.clear()
+
+    def items_moved(self, items):
+        """Элементы сдвинулись или изменились; пересчёт — по таймеру, пачкой."""
+        for it in items:
+            if isinstance(it, ScalablePixmapItem):
+                self._changed.add(it)
+        if self._changed and not self._timer.isActive():
+            self._timer.start()
+
+    def close(self):
+        self._timer.stop()
+        self._timer.deleteLater()  # таймер — дочерний объект сцены, а трассировщик больше не нужен
+        for path, _ in self._beams.values():
+            if path.scene() is self.scene:
+                self.scene.removeItem(path)
+        self.cleared()
+
+    # --- геометрия ---
+
+    def _library_digests(self) -> Optional[dict]:
+        """Таблица sha1 библиотеки; None, пока она строится в фоне (запускается при первом вызове)."""
+        if self._library is None:
+            self._library = decode_executor().submit(optics_library_digests, self.components_dir)
+        if not self._library.done():
+            return None
+        return self._library.result()
+
+    def _spec(self, image: SharedImage) -> Optional[dict]:
+        """Описание оптики картинки. None без записи в кэш — встроенная картинка,
+        а таблица sha1 библиотеки ещё не готова."""
+        if image.key not in self._spec_by_key:
+            rel = components_relpath(image.path, self.components_dir)
+            if rel is None:
+                library = self._library_digests()
+                if library is None:
+                    return None
+                rel = library.get(image.key)
+            self._spec_by_key[image.key] = optics_spec(rel)
+        return self._spec_by_key[image.key]
+
+    def _geometry(self, item) -> Optional[_Optic]:
+        spec = self._spec(item.image)
+        if spec is None:
+            if item.image.key not in self._spec_by_key:
+                self._awaiting.add(item)  # пересчитаем, когда таблица библиотеки будет готова
+            return None
+        br = item.boundingRect()
+        def scene_point(u, v):
+            p = item.mapToScene(QPointF(br.x() + u * br.width(), br.y() + v * br.height()))
+            return p.x(), p.y()
+        r = item.sceneBoundingRect()
+        rect = (r.left(), r.top(), r.right(), r.bottom())
+        if spec["kind"] == "source":
+            (u, v), (du, dv) = spec["at"], spec["dir"]
+            x, y = scene_point(u, v)
+            x2, y2 = scene_point(u + du, v + dv)
+            n = math.hypot(x2 - x, y2 - y) or 1.0
+            return _Optic("source", 0.0, (), (x, y), ((x2 - x) / n, (y2 - y) / n), rect)
+        segs = tuple(scene_point(*p1) + scene_point(*p2) for p1, p2 in spec["segments"])
+        param = {"split": spec.get("ratio", 0.5), "transmit": spec.get("power", 1.0)}.get(spec["kind"], 0.0)
+        if spec["kind"] == "refract":
+            x1, y1, x2, y2 = segs[0]
+            param = spec.get("focal", 2.0) * math.hypot(x2 - x1, y2 - y1)
+        return _Optic(spec["kind"], param, segs, None, None, rect)
+
+    # --- пересчёт ---
+
+    def update(self):
+        if self._awaiting and self._library.done():
+            self._changed |= self._awaiting
+            self._awaiting = set()
+        changed, self._changed = self._changed, set()
+        rects, dirty = [], set()
+        for item in changed:
+            old = self._optics.pop(item, None)
+            geo = self._geometry(item) if item.scene() is self.scene else None
+            if geo is not None:
+                self._optics[item] = geo
+            if geo == old:
+                continue  # элемент не сдвинулся (например, выделение рамкой)
+            if geo is not None and geo.kind == "source":
+                dirty.add(item)
+            elif item in self._beams:
+                path, _ = self._beams.pop(item)
+                if path.scene() is self.scene:
+                    self.scene.removeItem(path)
+            for g in (old, geo):
+                if g is not None and g.kind != "source":
+                    rects.append(g.rect)
+        if rects:
+            for src, (_, segs) in self._beams.items():
+                if src not in dirty and len(segs) and segments_touch_rects(segs, rects).any():
+                    dirty.add(src)
+        if dirty:
+            self._trace(dirty)
+        if self._awaiting:
+            self._timer.start()  # опрашиваем фоновую таблицу раз в BEAM_UPDATE_MS, не блокируя GUI
+
+    def retrace_all(self):
+        self._changed.update(it for it in self.scene.items() if isinstance(it, ScalablePixmapItem))
+        self.update()
+
+    @profiled("beams/trace")
+    def _trace(self, sources):
+        sources = list(sources)
+        segs, kinds, params = [], [], []
+        for geo in self._optics.values():
+            if geo.kind == "source":
+                continue
+            for seg in geo.segments:
+                segs.append(seg)
+                kinds.append(_BEAM_KINDS.index(geo.kind))
+                params.append(geo.param)
+        origins = [self._optics[s].origin for s in sources]
+        dirs = [self._optics[s].direction for s in sources]
+        r = self.scene.sceneRect()
+        out, _, src, _ = trace_beams(origins, dirs, range(len(sources)), segs, kinds, params,
+                                     (r.left(), r.top(), r.right(), r.bottom()))
+        for i, item in enumerate(sources):
+            if item in self._beams:
+                path = self._beams[item][0]
+            else:
+                path = BeamPath()
+                self.scene.addItem(path)
+            mine = out[src == i]
+            path.set_segments(mine)
+            self._beams[item] = (path, mine)
+        self.traced += len(sources)
+
+
+def canvas_rect(w: float, h: float) -> QRectF:
+    """Прямоугольник холста w×h: окно меняет размер вокруг исходного центра сцены."""
+    return QRectF(SCENE_WIDTH / 2 - w / 2, SCENE_HEIGHT / 2 - h / 2, w, h)
+
+def load_project_scene(path: str, components_dir: str) -> Scene:
+    """Читает проект (JSON или .optz) в новую сцену (без окна). Все слои видимы."""
+    scene = Scene()
+    scene.setSceneRect(canvas_rect(SCENE_WIDTH, SCENE_HEIGHT))
+    decoder, items = AssetDecoder(components_dir), []
+    with open_project_reader(path) as reader:
+        for kind, value in reader.events():
+            if kind == "scene":
+                scene.setSceneRect(canvas_rect(int(value.get("width", SCENE_WIDTH)),
+                                               int(value.get("height", SCENE_HEIGHT))))
+                scene.set_layers(value.get("layers", LAYER_NAMES))
+            elif kind == "asset":
+                decoder.submit(*value)
+            elif kind == "item":
+                items.append(decoder.lift_inline(value))
+    decoder.finish()
+    instantiate_items(scene, items, QPointF(0, 0), decoder.decoded)
+    return scene
+
+def render_output_paths(paths: list, out_dir: str, fmt: str) -> Optional[list]:
+    """Куда рендерить каждый проект: out_dir/<имя>.<fmt>. Если имена совпадают
+    (a/scheme.json и b/scheme.json), результат повторяет путь проекта относительно
+    общей папки входов: out_dir/a/scheme.<fmt>. None — если развести имена нельзя
+    (scheme.json и scheme.optz в одной папке)."""
+    stems = [os.path.splitext(os.path.basename(p))[0] for p in paths]
+    if len(set(stems)) < len(stems):
+        dirs = [os.path.dirname(os.path.abspath(p)) for p in paths]
+        common = os.path.commonpath(dirs)
+        stems = [os.path.join(os.path.relpath(d, common), s) for d, s in zip(dirs, stems)]
+        if len({os.path.normpath(s) for s in stems}) < len(stems):
+            return None
+    return [os.path.normpath(os.path.join(out_dir, s + "." + fmt)) for s in stems]
+
+def render_project_file(path: str, out: str, components_dir: str,
+                        scale: float = 1.0, grid: bool = True) -> str:
+    """Рендерит один проект в файл out (формат — по расширению: png, svg или pdf), возвращает out."""
+    scene = load_project_scene(path, components_dir)
+    scene.grid_visible = grid
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    try:
+        render_scene_file(scene, scene.sceneRect(), out, scale)
+    finally:
+        scene.clear()
+    return out
+
+_headless_app = None
+
+def _headless_init():
+    """Инициализация процесса-рендерера: offscreen-платформа и свой QApplication."""
+    global _headless_app
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    _headless_app = QApplication.instance() or QApplication([])
+    atexit.register(PIXMAP_CACHE.clear)
+
+def _headless_render(job: tuple):
+    path = job[0]
+    try:
+        return path, render_project_file(*job), None
+    except Exception as e:  # один битый файл не должен ронять весь прогон
+        return path, None, f"{type(e).__name__}: {e}"
+
+def render_cli(argv: list) -> int:
+    """python main.py render in/*.json -o out/ [--scale 2] [--no-grid] [--format svg] [-j N]
+    Одноимённые проекты из разных папок раскладываются по подпапкам out/."""
+    parser = argparse.ArgumentParser(prog="main.py render",
+                                     description="Пакетный рендер проектов JSON в PNG, SVG или PDF без окна.")
+    parser.add_argument("inputs", nargs="+", help="файлы проектов (шаблоны вида *.json тоже можно)")
+    parser.add_argument("-o", "--out-dir", default=".", help="куда класть результаты (по умолчанию текущая папка)")
+    parser.add_argument("--scale", type=float, default=1.0, help="масштаб рендера (2 = вдвое больше пикселей)")
+    parser.add_argument("--no-grid", action="store_true", help="не рисовать сетку")
+    parser.add_argument("--format", choices=("png", "svg", "pdf"), default="png",
+                        help="формат результата (svg/pdf — векторы, --scale на них не влияет)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="число процессов (по умолчанию — по числу ядер)")
+    parser.add_argument("--components-dir",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), COMPONENTS_DIR_NAME),
+                        help="папка компонентов для проектов со ссылками на файлы")
+    args = parser.parse_args(argv)
+    if args.scale <= 0:
+        parser.error("--scale должен быть больше нуля")
+
+    # шаблоны раскрываем сами: на Windows оболочка этого не делает
+    paths, seen = [], set()
+    for pattern in args.inputs:
+        found = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for p in found:  # файл, попавший под два шаблона, рендерится один раз
+            if os.path.abspath(p) not in seen:
+                seen.add(os.path.abspath(p))
+                paths.append(p)
+    if not paths:
+        print("render: нет файлов для рендера", file=sys.stderr)
+        return 2
+    # процессы пишут параллельно: два входа не должны попасть в один выходной файл
+    outs = render_output_paths(paths, args.out_dir, args.format)
+    if outs is None:
+        print("render: у входов совпадают имя и папка (например, scheme.json и scheme.optz) — "
+              "результаты перезаписали бы друг друга; рендерите их по отдельности", file=sys.stderr)
+        return 2
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    jobs = [(p, out, args.components_dir, args.scale, not args.no_grid) for p, out in zip(paths, outs)]
+    workers = max(1, min(args.jobs, len(jobs)))
+    if workers == 1:
+        _headless_init()
+        results = map(_headless_render, jobs)
+        pool = None
+    else:
+        # spawn: каждый процесс поднимает свой QApplication с нуля, без копии чужого состояния Qt
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_headless_init)
+        results = pool.map(_headless_render, jobs)
+    failed = 0
+    try:
+        for path, out, err in results:
+            if err is None:
+                print(f"{path} -> {out}")
+            else:
+                failed += 1
+                print(f"{path}: ошибка: {err}", file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return 1 if failed else 0
+
+
+# ---- ОПТИМИЗАЦИЯ БИБЛИОТЕКИ ----
+
+def file_stamp(path: str) -> Optional[tuple]:
+    """(размер, mtime_ns) файла или None, если его нет."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+def asset_build_dir(components_dir: str) -> str:
+    return os.path.join(components_dir, ASSET_BUILD_DIR_NAME)
+
+def load_asset_manifest(components_dir: str) -> dict:
+    """manifest.json облегчённых копий; пустой, если сборки ещё не было или файл битый."""
+    try:
+        with open(os.path.join(asset_build_dir(components_dir), ASSET_MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+def optimized_component(path: str, components_dir: str, manifest: dict) -> Optional[str]:
+    """Путь облегчённой копии PNG из библиотеки, если она собрана по текущей версии файла."""
+    rel = components_relpath(path, components_dir)
+    entry = manifest.get("assets", {}).get(rel) if rel else None
+    if entry is None:
+        return None
+    stamp = file_stamp(path)
+    if stamp is None or list(stamp) != entry.get("stamp"):
+        return None  # исходник изменился после сборки
+    out = os.path.join(asset_build_dir(components_dir), *rel.split("/"))
+    return out if os.path.isfile(out) else None
+
+def opaque_bounds(image: QImage, min_alpha: int) -> Optional[tuple]:
+    """(left, top, right, bottom) пикселей с альфой не меньше min_alpha (right/bottom —
+    не включительно); None, если таких нет."""
+    alpha = image.convertToFormat(QImage.Format_Alpha8)
+    w, h, bpl = alpha.width(), alpha.height(), alpha.bytesPerLine()
+    # «пустые» пиксели -> 0, остальные -> 1: края строки находит strip
+    data = bytes(alpha.constBits()).translate(bytes(0 if a < min_alpha else 1 for a in range(256)))
+    left, top, right, bottom = w, None, 0, 0
+    for y in range(h):
+        row = data[y * bpl:y * bpl + w]
+        end = len(row.rstrip(b"\0"))
+        if end == 0:
+            continue
+        if top is None:
+            top = y
+        bottom = y + 1
+        left = min(left, w - len(row.lstrip(b"\0")))
+        right = max(right, end)
+    return None if top is None else (left, top, right, bottom)
+
+def optimize_asset(job: tuple) -> tuple:
+    """Облегчённая копия одного PNG (выполняется в процессе пула, нужен только QImage).
+    job — (путь в библиотеке, исходник, куда писать, max_px, min_alpha).
+    Возвращает (путь в библиотеке, запись манифеста или None, ошибка или None)."""
+    rel, src, dst, max_px, min_alpha = job
+    try:
+        with open(src, "rb") as f:
+            raw = f.read()
+        img = QImage.fromData(QByteArray(raw))
+        if img.isNull():
+            raise ValueError("файл не читается как картинка")
+        w0, h0 = img.width(), img.height()
+        dx = dy = 0
+        if img.hasAlphaChannel():
+            # поля срезаются поровну с противоположных сторон: центр картинки остаётся на месте,
+            # и компонент, поставленный по центру, не сдвигается
+            box = opaque_bounds(img, min_alpha)
+            if box is not None:
+                dx, dy = min(box[0], w0 - box[2]), min(box[1], h0 - box[3])
+                img = img.copy(dx, dy, w0 - 2 * dx, h0 - 2 * dy)
+            # в premultiplied-формате сглаживание не тянет цвет прозрачных пикселей в края
+            img = img.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        cw, ch = img.width(), img.height()
+        if max(cw, ch) > max_px:
+            img = img.scaled(max_px, max_px, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        # обратно в ARGB32: у прозрачных пикселей цвет обнулён, и PNG сжимается лучше
+        img = img.convertToFormat(QImage.Format_ARGB32 if img.hasAlphaChannel() else QImage.Format_RGB32)
+        # где копия лежит внутри исходника: элемент на холсте сохраняет исходные границы
+        # (см. SharedImage.frame), а блок едет вместе с PNG — и в файл проекта, и в буфер обмена
+        img.setText(ASSET_FRAME_TEXT, f"{dx} {dy} {cw} {ch} {w0} {h0}")
+        out = image_to_png_bytes(img)
+        if (img.width(), img.height()) == (w0, h0) and len(out) >= len(raw):
+            out = raw  # обрезать и уменьшать нечего, а перекодирование не выиграло
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = dst + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(out)
+        os.replace(tmp, dst)
+        return rel, {
+            "sha1": png_digest(raw),
+            "source_size": [w0, h0], "source_bytes": len(raw),
+            "size": [img.width(), img.height()], "bytes": len(out),
+        }, None
+    except Exception as e:  # один битый файл не должен ронять всю сборку
+        return rel, None, f"{type(e).__name__}: {e}"
+
+def build_asset_library(components_dir: str, max_px: int = ASSET_MAX_PX, jobs: Optional[int] = None,
+                        force: bool = False, progress=None) -> dict:
+    """Собирает облегчённые копии всех PNG библиотеки в components/.optimized/.
+
+    Файл пересобирается, только если изменилось его содержимое (sha1) или параметры
+    сборки; при совпадающих размере и mtime он даже не читается. Копии делаются пулом
+    процессов. progress(готово, всего) может вернуть False — тогда сборка прерывается.
+    Возвращает сводку: built, cached, failed [(путь, ошибка)], canceled, source_bytes, bytes.
+    """
+    out_dir = asset_build_dir(components_dir)
+    params = {"version": ASSET_BUILD_VERSION, "max_px": max_px, "min_alpha": ASSET_TRIM_ALPHA}
+    old = load_asset_manifest(components_dir)
+    old_assets = old.get("assets", {}) if not force and all(old.get(k) == v for k, v in params.items()) else {}
+    assets, todo, stamps = {}, [], {}
+    summary = {"built": 0, "cached": 0, "failed": [], "canceled": False}
+
+    for dirpath, dirnames, filenames in os.walk(components_dir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if not name.lower().endswith(".png"):
+                continue
+            src = os.path.join(dirpath, name)
+            rel = components_relpath(src, components_dir)
+            dst = os.path.join(out_dir, *rel.split("/"))
+            stamp = file_stamp(src)
+            if stamp is None:
+                continue
+            stamps[rel] = list(stamp)
+            entry = old_assets.get(rel)
+            if entry is not None and os.path.isfile(dst):
+                if entry.get("stamp") != stamps[rel]:
+                    # mtime сменился (копирование, checkout) — решает содержимое
+                    try:
+                        with open(src, "rb") as f:
+                            same = png_digest(f.read()) == entry.get("sha1")
+                    except OSError:
+                        same = False
+                    entry = dict(entry, stamp=stamps[rel]) if same else None
+                if entry is not None:
+                    assets[rel] = entry
+                    summary["cached"] += 1
+                    continue
+            todo.append((rel, src, dst, max_px, ASSET_TRIM_ALPHA))
+
+    def finish(rel, entry, err):
+        if err is None:
+            assets[rel] = dict(entry, stamp=stamps[rel])
+            summary["built"] += 1
+        else:
+            summary["failed"].append((rel, err))
+
+    workers = max(1, min(jobs or os.cpu_count() or 1, len(todo)))
+    if workers == 1:
+        for i, job in enumerate(todo):
+            finish(*optimize_asset(job))
+            if progress is not None and progress(i + 1, len(todo)) is False:
+                summary["canceled"] = True
+                break
+    else:
+        # spawn, как в render_cli; QApplication воркерам не нужен — только QImage
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            pending, done = {pool.submit(optimize_asset, job) for job in todo}, 0
+            while pending:
+                # с таймаутом: progress успевает обработать события окна, пока процессы работают
+                finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    finish(*fut.result())
+                    done += 1
+                if progress is not None and progress(done, len(todo)) is False:
+                    summary["canceled"] = True
+                    break
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    if not summary["canceled"]:
+        # копии файлов, которых больше нет в библиотеке
+        for dirpath, _, filenames in os.walk(out_dir, topdown=False):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                rel = os.path.relpath(path, out_dir).replace(os.sep, "/")
+                if rel != ASSET_MANIFEST_NAME and rel not in assets:
+                    os.remove(path)
+            if dirpath != out_dir and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = os.path.join(out_dir, ASSET_MANIFEST_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(dict(params, assets=assets), f, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(out_dir, ASSET_MANIFEST_NAME))
+    summary["source_bytes"] = sum(e["source_bytes"] for e in assets.values())
+    summary["bytes"] = sum(e["bytes"] for e in assets.values())
+    return summary
+
+def optimize_cli(argv: list) -> int:
+    """python main.py optimize [--components-dir DIR] [--max-size 512] [-j N] [--force]"""
+    parser = argparse.ArgumentParser(prog="main.py optimize",
+                                     description="Облегчённые копии PNG библиотеки компонентов "
+                                                 "(обрезка полей, уменьшение) в components/.optimized/.")
+    parser.add_argument("--components-dir",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), COMPONENTS_DIR_NAME),
+                        help="папка компонентов")
+    parser.add_argument("--max-size", type=int, default=ASSET_MAX_PX, help="большая сторона копии, px")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="число процессов (по умолчанию — по числу ядер)")
+    parser.add_argument("--force", action="store_true", help="пересобрать всё, не глядя в manifest.json")
+    args = parser.parse_args(argv)
+    if args.max_size < 1:
+        parser.error("--max-size должен быть больше нуля")
+    if not os.path.isdir(args.components_dir):
+        print(f"optimize: нет папки {args.components_dir}", file=sys.stderr)
+        return 2
+
+    t = time.perf_counter()
+    summary = build_asset_library(args.components_dir, args.max_size, args.jobs, args.force)
+    for rel, err in summary["failed"]:
+        print(f"{rel}: ошибка: {err}", file=sys.stderr)
+    print(f"собрано {summary['built']}, из кэша {summary['cached']}, ошибок {len(summary['failed'])} "
+          f"за {time.perf_counter() - t:.1f} с; PNG: {summary['source_bytes'] / 1024:.0f} КБ -> "
+          f"{summary['bytes'] / 1024:.0f} КБ")
+    return 1 if summary["failed"] else 0
 
 
 class MainWindow(QMainWindow):
@@ -479,6 +4034,8 @@ class MainWindow(QMainWindow):
         self.view = GraphicsView(self.scene, self)
         # Оверлей помощи поверх области рисования
         self.help_overlay = HelpOverlay(self.view.viewport())
+        # Сводка замеров (Справка → Профилирование или OPTICS_PROFILE=1)
+        self.profiler_overlay = ProfilerOverlay(self.view.viewport())
 
         self.view.setDragMode(QGraphicsView.RubberBandDrag)
 
@@ -487,17 +4044,56 @@ class MainWindow(QMainWindow):
         self.search_edit = QLineEdit()
         self.search_edit.setPlaceholderText("Поиск компонентов…")
         self.search_edit.setClearButtonEnabled(True)
-        self.search_edit.textChanged.connect(self.apply_component_filter)
+        self.search_edit.returnPressed.connect(self.add_best_component_match)
+        # фильтр пересчитывается не на каждую букву, а после паузы в наборе
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self._search_timer.timeout.connect(lambda: self.apply_component_filter(self.search_edit.text()))
+        self.search_edit.textChanged.connect(self._search_timer.start)
+        self._component_index = ComponentSearchIndex()
+        self._shown_leaves = set()   # пути PNG, видимые сейчас в дереве
+        self._shown_folders = set()  # пути папок, видимые сейчас в дереве
+        self._best_component_match = None
 
         # Дерево компонентов (категории = папки)
         self.component_tree = QTreeWidget()
         self.component_tree.setHeaderHidden(True)
         self.component_tree.itemDoubleClicked.connect(self.add_component_to_scene)
-        self.component_tree.setIconSize(QSize(40, 40))
-
-        # Кнопка обновления списка
+        self.component_tree.setIconSize(QSize(THUMB_SIZE, THUMB_SIZE))
+
+        # Иконки дерева готовятся в фоне; результаты приходят сигналом в GUI-поток
+        self._thumb_pool = QThreadPool(self)
+        self._thumb_signals = ThumbnailSignals(self)
+        self._thumb_signals.ready.connect(self._on_thumbnail_ready)
+        self._thumb_generation = 0
+        self._leaf_items = {}  # путь PNG -> QTreeWidgetItem
+        self._thumb_cache_dir = thumbnail_cache_dir()
+        self._placeholder_icon = placeholder_icon()
+
+        # Кнопка обновления списка (досинхронизирует только изменившееся)
         self.refresh_components_btn = QPushButton("Обновить список")
-        self.refresh_components_btn.clicked.connect(self.populate_components_tree)
+        self.refresh_components_btn.clicked.connect(self.refresh_components_tree)
+        # Облегчённые копии PNG (components/.optimized): на холст ставятся они
+        self.optimize_components_btn = QPushButton("Оптимизировать библиотеку")
+        self.optimize_components_btn.clicked.connect(self.optimize_component_library)
+        self._asset_manifest = {}
+        self._asset_manifest_stamp = None
+
+        # Слежение за папкой компонентов: обновляются только затронутые узлы
+        self._folder_items = {}  # путь папки -> QTreeWidgetItem
+        self._leaf_stamps = {}   # путь PNG -> (размер, mtime_ns)
+        self._leaf_dirs = {}     # путь PNG -> папка, в которой он лежит
+        self._components_watcher = QFileSystemWatcher(self)
+        self._components_watcher.directoryChanged.connect(self._on_components_dir_changed)
+        self._pending_component_dirs = set()
+        self._components_sync_timer = QTimer(self)
+        self._components_sync_timer.setSingleShot(True)
+        self._components_sync_timer.setInterval(WATCH_DEBOUNCE_MS)
+        self._components_sync_timer.timeout.connect(self._flush_component_dirs)
+        self.watch_components_cb = QCheckBox("Следить за папкой")
+        self.watch_components_cb.setChecked(True)
+        self.watch_components_cb.toggled.connect(self.set_components_watch_enabled)
 
         # Путь к папке с компонентами (покажем текстом)
         self.components_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), COMPONENTS_DIR_NAME)
@@ -508,17 +4104,19 @@ class MainWindow(QMainWindow):
         self.load_png_button = QPushButton("Добавить PNG (файл)")
         self.load_png_button.clicked.connect(self.load_png)
 
+        # Слои: списки строятся из scene.layer_names и перестраиваются при его изменении
         self.layer_combo = QComboBox()
-        self.layer_combo.addItems([n for n in LAYER_NAMES if n != "Сетка"])
-        self.layer_combo.setCurrentText("Слой 1")
-
         self.layers_list = QListWidget()
-        for name in LAYER_NAMES:
-            it = QListWidgetItem(name)
-            it.setFlags(it.flags() | Qt.ItemIsUserCheckable)
-            it.setCheckState(Qt.Checked)
-            self.layers_list.addItem(it)
+        self.rebuild_layer_widgets()
+        self.layer_combo.setCurrentText("Слой 1")
         self.layers_list.itemChanged.connect(self.apply_layer_visibility)
+        # двойной клик — выделить всё на слое; правый клик — меню слоя
+        self.layers_list.itemDoubleClicked.connect(lambda it: self.select_layer(it.text()))
+        self.layers_list.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.layers_list.customContextMenuRequested.connect(self._layers_context_menu)
+        self.scene.layers_changed.connect(self.rebuild_layer_widgets)
+        self.add_layer_btn = QPushButton("Добавить слой")
+        self.add_layer_btn.clicked.connect(self.add_layer)
 
         # Контролы размера холста
         self.canvas_w_spin = QSpinBox(); self.canvas_w_spin.setRange(200, 20000); self.canvas_w_spin.setSingleStep(100); self.canvas_w_spin.setValue(self.scene_width)
@@ -528,11 +4126,12 @@ class MainWindow(QMainWindow):
 
         # Экспорт
         self.export_without_grid_cb = QCheckBox("Без сетки при экспорте"); self.export_without_grid_cb.setChecked(True)
-        self.export_btn = QPushButton("Экспорт PNG"); self.export_btn.clicked.connect(self.export_canvas_png)
+        self.export_btn = QPushButton("Экспорт PNG/SVG/PDF"); self.export_btn.clicked.connect(self.export_canvas_png)
 
-        # Сохранить/Открыть проект (JSON)
+        # Сохранить/Открыть проект (JSON или .optz)
         self.save_btn = QPushButton("Сохранить проект…"); self.save_btn.clicked.connect(self.save_project_json)
         self.load_btn = QPushButton("Открыть проект…"); self.load_btn.clicked.connect(self.load_project_json)
+        self.save_linked_cb = QCheckBox("Ссылаться на components/ вместо встраивания PNG")
 
         left_panel = QVBoxLayout()
         # внутреннее хранилище найденных png
@@ -541,7 +4140,11 @@ class MainWindow(QMainWindow):
 
         left_panel.addWidget(QLabel("Компоненты (из папки):"))
         left_panel.addWidget(self.components_path_label)
-        left_panel.addWidget(self.refresh_components_btn)
+        refresh_row = QHBoxLayout()
+        refresh_row.addWidget(self.refresh_components_btn)
+        refresh_row.addWidget(self.watch_components_cb)
+        left_panel.addLayout(refresh_row)
+        left_panel.addWidget(self.optimize_components_btn)
         left_panel.addWidget(self.search_edit)
         left_panel.addWidget(self.component_tree)  # вместо списка
         left_panel.addSpacing(8)
@@ -552,6 +4155,7 @@ class MainWindow(QMainWindow):
         left_panel.addSpacing(10)
         left_panel.addWidget(QLabel("Видимость слоёв:"))
         left_panel.addWidget(self.layers_list)
+        left_panel.addWidget(self.add_layer_btn)
         left_panel.addSpacing(12)
         left_panel.addWidget(QLabel("Размер холста (px):"))
         size_row = QHBoxLayout()
@@ -564,6 +4168,7 @@ class MainWindow(QMainWindow):
         left_panel.addWidget(self.export_without_grid_cb)
         left_panel.addWidget(self.export_btn)
         left_panel.addSpacing(10)
+        left_panel.addWidget(self.save_linked_cb)
         left_panel.addWidget(self.save_btn)
         left_panel.addWidget(self.load_btn)
         left_panel.addStretch()
@@ -573,7 +4178,7 @@ class MainWindow(QMainWindow):
         layout.addWidget(left, 1)
         layout.addWidget(self.view, 4)
 
-        container = QWidget()
+        container = BackgroundWidget()
         container.setLayout(layout)
         # имена для QSS
         left.setObjectName("LeftPanel")
@@ -581,12 +4186,43 @@ class MainWindow(QMainWindow):
 
         self.view.setBackgroundBrush(Qt.NoBrush)
         self.setCentralWidget(container)
+        self.root_container = container
+        self.settings = QSettings("optics_app", "optics_app")
+        self._background_pixmap = None  # background.png, декодированный один раз
         self.apply_background_theme()
+        # История правок: размер в МБ можно поменять в настройках (undo/budget_mb)
+        budget_mb = self.settings.value("undo/budget_mb", UNDO_MEMORY_BUDGET // 2**20, type=int)
+        self.history = UndoStack(self.scene, max(1, budget_mb) * 2**20)
+        self.scene.history = self.history
         # Заполним список компонентов и нарисуем сетку
+        # Меню «Вид»
+        view_menu = self.menuBar().addMenu("Вид")
+        self.act_background = view_menu.addAction("Фоновое изображение")
+        self.act_background.setCheckable(True)
+        self.act_background.setChecked(self.background_enabled())
+        self.act_background.toggled.connect(self.set_background_enabled)
         # Меню «Справка»
         help_menu = self.menuBar().addMenu("Справка")
         act_help = help_menu.addAction("Горячие клавиши (F1)")
         act_help.triggered.connect(self.show_shortcuts)
+        self.ports = PortIndex(self.scene)
+        self.scene.observers.append(self.ports)
+        self.beam_tracer = None
+        self.act_beams = view_menu.addAction("Лучи от источников")
+        self.act_beams.setCheckable(True)
+        self.act_beams.setEnabled(np is not None)
+        if np is None:
+            self.act_beams.setToolTip("Нужен numpy: pip install numpy")
+        act_cache = help_menu.addAction("Кэш картинок…")
+        act_cache.triggered.connect(self.show_pixmap_cache_stats)
+        help_menu.addSeparator()
+        self.act_profile = help_menu.addAction("Профилирование")
+        self.act_profile.setCheckable(True)
+        self.act_profile.setChecked(PROFILER.enabled)
+        self.act_profile.toggled.connect(self.set_profiling)
+        self.profiler_overlay.setVisible(PROFILER.enabled)
+        help_menu.addAction("Сохранить трассу…").triggered.connect(self.export_profile_trace)
+        help_menu.addAction("Сбросить замеры").triggered.connect(PROFILER.reset)
 
         # Подсказка в статус-баре при старте
         self.statusBar().showMessage("F1 — горячие клавиши; Ctrl+S — сохранить; Ctrl+E — экспорт", 6000)
@@ -596,17 +4232,138 @@ class MainWindow(QMainWindow):
         QShortcut(QKeySequence("Ctrl+C"), self, activated=self.copy_selection)
         QShortcut(QKeySequence("Ctrl+V"), self, activated=self.paste_clipboard)
         QShortcut(QKeySequence("Ctrl+D"), self, activated=self.duplicate_selection)
+        QShortcut(QKeySequence("Ctrl+Z"), self, activated=self.undo)
+        QShortcut(QKeySequence("Ctrl+Shift+Z"), self, activated=self.redo)
+        QShortcut(QKeySequence("Ctrl+Y"), self, activated=self.redo)
         QShortcut(QKeySequence("F1"), self, activated=self.show_shortcuts)
         QShortcut(QKeySequence("Ctrl+S"), self, activated=self.save_project_json)
         QShortcut(QKeySequence("Ctrl+O"), self, activated=self.load_project_json)
         QShortcut(QKeySequence("Ctrl+E"), self, activated=self.export_canvas_png)
         self.populate_components_tree()
+        self.act_beams.setChecked(np is not None and self.settings.value("beams/enabled", True, type=bool))
+        self.act_beams.toggled.connect(self.set_beams_enabled)
+        self.set_beams_enabled(self.act_beams.isChecked())
+
+        # Автосохранение: своя папка сессии; если чья-то сессия не закрылась штатно
+        # (её блокировку никто не держит) — предложим восстановить самую свежую
+        self._autosave_dir, self._autosave_lock = new_autosave_session(autosave_dir())
+        self._autosave_journal = None
+        self._autosave_recorder = None
+        self._autosave_timer = QTimer(self)
+        self._autosave_timer.setInterval(AUTOSAVE_INTERVAL_MS)
+        self._autosave_timer.timeout.connect(self.flush_autosave)
+        recovered = None
+        for path, lock in orphaned_autosave_sessions(autosave_dir(), self._autosave_dir):
+            if recovered is not None:
+                lock.unlock()  # остальные брошенные сессии предложим при следующем запуске
+                continue
+            try:
+                state = read_autosave(path)
+            except Exception:
+                state = None  # испорченное автосохранение не должно мешать запуску
+            if state is not None and state["items"]:
+                recovered = (path, lock, state)
+            else:
+                remove_autosave_session(path, lock)
+        if recovered is not None:
+            QTimer.singleShot(0, lambda: self.offer_autosave_recovery(*recovered))
+        else:
+            self.start_autosave()
     
     def iter_scene_items(self):
         """Перебирает все объекты сцены, которые являются элементами (а не вспомогательными объектами)."""
-        for it in self.scene.items():
-            if isinstance(it, (DraggableComponent, ScalablePixmapItem, LaserLine)):
-                yield it
+        return iter_project_items(self.scene)
+
+    # --- АВТОСОХРАНЕНИЕ ---
+
+    def start_autosave(self, state: Optional[dict] = None, items_by_uid: Optional[dict] = None):
+        """Запускает журнал. state — начальное состояние (восстановленная сессия или
+        открытый проект), items_by_uid — его элементы на сцене: журнал пишет state
+        снимком в фоне, и повторно как add они не сериализуются."""
+        self._autosave_journal = AutosaveJournal(self._autosave_dir, state)
+        self._autosave_journal.start()
+        self._autosave_recorder = AutosaveRecorder(self.scene, self._autosave_journal, self.components_dir)
+        if items_by_uid:
+            self._autosave_recorder.adopt(items_by_uid, state)
+        self.scene.observers.append(self._autosave_recorder)
+        self._autosave_timer.start()
+
+    def stop_autosave(self):
+        """Останавливает журнал этой сессии и удаляет его файлы (папка сессии остаётся)."""
+        self._autosave_timer.stop()
+        if self._autosave_recorder in self.scene.observers:
+            self.scene.observers.remove(self._autosave_recorder)
+        self._autosave_recorder = None
+        if self._autosave_journal is not None:
+            self._autosave_journal.close(discard=True)
+            self._autosave_journal = None
+
+    # --- ЛУЧИ ---
+
+    def set_beams_enabled(self, enabled: bool):
+        """Лучи от источников света пересчитываются сами при изменении сцены."""
+        if enabled and np is None:
+            return
+        if self.sender() is self.act_beams:
+            self.settings.setValue("beams/enabled", bool(enabled))
+        if enabled and self.beam_tracer is None:
+            self.beam_tracer = BeamTracer(self.scene, self.components_dir)
+            self.scene.observers.append(self.beam_tracer)
+            self.beam_tracer.retrace_all()
+        elif not enabled and self.beam_tracer is not None:
+            self.scene.observers.remove(self.beam_tracer)
+            self.beam_tracer.close()
+            self.beam_tracer = None
+
+    def flush_autosave(self):
+        if self._autosave_recorder is not None:
+            self._autosave_recorder.flush()
+
+    def offer_autosave_recovery(self, path: str, lock: QLockFile, state: dict):
+        """Брошенная сессия из path: её либо переносят в свою, либо удаляют."""
+        answer = QMessageBox.question(
+            self, "Восстановление",
+            f"Прошлая сессия завершилась без сохранения ({len(state['items'])} объектов).\n"
+            "Восстановить её?"
+        )
+        if answer != QMessageBox.Yes:
+            remove_autosave_session(path, lock)
+            self.start_autosave()
+            return
+        restored = self.restore_autosave(state)
+        self.start_autosave(state, restored)  # состояние сразу пишется снимком в папку этой сессии
+        remove_autosave_session(path, lock)
+        self.statusBar().showMessage(f"Восстановлено объектов: {len(restored)}", 6000)
+
+    def restore_autosave(self, state: dict) -> dict:
+        """Создаёт элементы из состояния журнала (наблюдатель сцены ещё не подключён)."""
+        self.scene.clear()
+        sc = state["scene"] or {}
+        self.set_canvas_size(int(sc.get("width", self.scene_width)), int(sc.get("height", self.scene_height)))
+        self.scene.set_layers(sc.get("layers", LAYER_NAMES))
+        decoder = AssetDecoder(self.components_dir)
+        used = {it.get("asset") for it in state["items"].values()}
+        for key, entry in state["assets"].items():
+            if key in used:
+                decoder.submit(key, entry)
+        decoder.finish()
+        restored = {}
+        for uid, it in state["items"].items():
+            obj = build_item(it, QPointF(0, 0), decoder.decoded)
+            if obj is not None:
+                obj.setData(ITEM_UID_ROLE, uid)
+                restored[uid] = obj
+        self.scene.add_items(list(restored.values()))
+        self._report_decode(decoder)
+        return restored
+
+    def closeEvent(self, event):
+        # штатный выход: журнал больше не нужен — удаляется только папка этой сессии
+        self.set_beams_enabled(False)
+        if self._autosave_journal is not None:
+            self.stop_autosave()
+            remove_autosave_session(self._autosave_dir, self._autosave_lock)
+        super().closeEvent(event)
 
     def _view_center_scene(self) -> QPointF:
         # центр видимой области в координатах сцены
@@ -621,155 +4378,71 @@ class MainWindow(QMainWindow):
     
     # --- КОПИРОВАНИЕ/ВСТАВКА ---
 
-    def serialize_item(self, item) -> Optional[dict]:
-        lname = get_item_layer(item)
-        if isinstance(item, DraggableComponent):
-            return {
-                "type": "component",
-                "label": item.toolTip(),
-                "layer": lname,
-                "pos": [item.pos().x(), item.pos().y()],
-                "rotation": item.rotation(),
-                "opacity": item.opacity(),
-                "transform": self._transform_to_list(item.transform())
-            }
-        if isinstance(item, ScalablePixmapItem):
-            return {
-                "type": "png",
-                "png_b64": self._pixmap_to_b64(item.pixmap()),
-                "layer": lname,
-                "pos": [item.pos().x(), item.pos().y()],
-                "rotation": item.rotation(),
-                "opacity": item.opacity(),
-                "scale": item.scale(),
-                "transform": self._transform_to_list(item.transform())
-            }
-        if isinstance(item, LaserLine):
-            ln = item.line()
-            p1 = item.mapToScene(ln.p1()); p2 = item.mapToScene(ln.p2())
-            pen = item.pen()
-            return {
-                "type": "laser",
-                "layer": lname,
-                "p1": [p1.x(), p1.y()],
-                "p2": [p2.x(), p2.y()],
-                "color": [pen.color().red(), pen.color().green(), pen.color().blue(), pen.color().alpha()],
-                "width": pen.widthF()
-            }
-        return None
+    def serialize_item(self, item, assets: Optional[dict] = None, linked: bool = False) -> Optional[dict]:
+        return serialize_item(item, assets, self.components_dir if linked else None)
 
-    def instantiate_item(self, it: dict, delta: QPointF = QPointF(0, 0)) -> Optional[QGraphicsLineItem]:
-        t = it.get("type"); lname = it.get("layer", "Слой 1")
-        if t == "component":
-            obj = DraggableComponent(it.get("label", "Компонент"))
-            self.scene.addItem(obj)
-            obj.setPos(it["pos"][0] + delta.x(), it["pos"][1] + delta.y())
-            obj.setRotation(it.get("rotation", 0.0))
-            obj.setOpacity(it.get("opacity", 1.0))
-            obj.setTransform(self._transform_from_list(it.get("transform", [1,0,0,0,1,0,0,0,1])))
-            set_item_layer(obj, lname); return obj
+    def instantiate_items(self, dicts, delta: QPointF = QPointF(0, 0),
+                          assets: Optional[dict] = None) -> list:
+        return instantiate_items(self.scene, dicts, delta, assets)
 
-        if t == "png":
-            try:
-                pix = self._pixmap_from_b64(it.get("png_b64", ""))
-            except Exception:
-                return None
-            obj = ScalablePixmapItem(pix); self.scene.addItem(obj)
-            obj.setPos(it["pos"][0] + delta.x(), it["pos"][1] + delta.y())
-            obj.setRotation(it.get("rotation", 0.0))
-            obj.setOpacity(it.get("opacity", 1.0))
-            obj.setScale(it.get("scale", 1.0))
-            obj.setTransform(self._transform_from_list(it.get("transform", [1,0,0,0,1,0,0,0,1])))
-            set_item_layer(obj, lname); return obj
-
-        if t == "laser":
-            p1 = it.get("p1", [0, 0]); p2 = it.get("p2", [0, 0])
-            col = it.get("color", [255, 0, 0, 255])
-            pen = QPen(QColor(*col), float(it.get("width", 2.5))); pen.setCosmetic(True)
-            obj = LaserLine(p1[0] + delta.x(), p1[1] + delta.y(), p2[0] + delta.x(), p2[1] + delta.y())
-            obj.setPen(pen); self.scene.addItem(obj)
-            set_item_layer(obj, lname); return obj
-        return None
-
-    def copy_selection(self) -> None:
-        """Копирует выделенные объекты в внутренний буфер (Ctrl+C)."""
+    def _selection_snapshot(self) -> Optional[dict]:
         sel = [it for it in self.scene.selectedItems()
                if isinstance(it, (DraggableComponent, ScalablePixmapItem, LaserLine))]
-        if not sel:
-            return
-        items = []
-        for it in sel:
-            d = self.serialize_item(it)
-            if d:
-                items.append(d)
-        # можно добавить базовую точку, но сейчас не требуется
-        self._clipboard = {"items": items}
-
-    def _instantiate_from_dict(self, it: dict, delta: QPointF):
-        """Создаёт объект из словаря (как при загрузке), смещая на delta."""
-        t = it.get("type"); lname = it.get("layer", "Слой 1")
-        if t == "component":
-            obj = DraggableComponent(it.get("label", "Компонент"))
-            self.scene.addItem(obj)
-            obj.setPos(it["pos"][0] + delta.x(), it["pos"][1] + delta.y())
-            obj.setRotation(it.get("rotation", 0.0))
-            obj.setOpacity(it.get("opacity", 1.0))
-            obj.setTransform(self._transform_from_list(it.get("transform", [1,0,0,0,1,0,0,0,1])))
-            set_item_layer(obj, lname)
-            return obj
-
-        elif t == "png":
-            try:
-                pix = self._pixmap_from_b64(it.get("png_b64", ""))
-            except Exception:
-                return None
-            obj = ScalablePixmapItem(pix)
-            self.scene.addItem(obj)
-            obj.setPos(it["pos"][0] + delta.x(), it["pos"][1] + delta.y())
-            obj.setRotation(it.get("rotation", 0.0))
-            obj.setOpacity(it.get("opacity", 1.0))
-            obj.setScale(it.get("scale", 1.0))
-            obj.setTransform(self._transform_from_list(it.get("transform", [1,0,0,0,1,0,0,0,1])))
-            set_item_layer(obj, lname)
-            return obj
-
-        elif t == "laser":
-            p1 = it.get("p1", [0, 0]); p2 = it.get("p2", [0, 0])
-            col = it.get("color", [255, 0, 0, 255])
-            pen = QPen(QColor(*col), float(it.get("width", 2.5))); pen.setCosmetic(True)
-            obj = LaserLine(p1[0] + delta.x(), p1[1] + delta.y(),
-                            p2[0] + delta.x(), p2[1] + delta.y())
-            obj.setPen(pen)
-            self.scene.addItem(obj)
-            set_item_layer(obj, lname)
-            return obj
+        return snapshot_items(sel) if sel else None
 
-        return None
-
-    def _paste_with_delta(self, delta: QPointF):
-        if not self._clipboard:
+    @profiled("copy")
+    def copy_selection(self) -> None:
+        """Копирует выделенные объекты (Ctrl+C): в свой буфер — ссылками на картинки,
+        в системный — ItemsMimeData, который кодирует PNG только по запросу другой программы."""
+        snapshot = self._selection_snapshot()
+        if snapshot is None:
+            return
+        self._clipboard = snapshot
+        QApplication.clipboard().setMimeData(ItemsMimeData(snapshot))
+
+    def _clipboard_snapshot(self) -> Optional[dict]:
+        """Что вставлять: элементы из системного буфера (свои — как есть, чужие — из JSON),
+        иначе — последнее скопированное в этом окне."""
+        mime = QApplication.clipboard().mimeData()
+        if isinstance(mime, ItemsMimeData):
+            return mime.snapshot
+        if mime is not None and mime.hasFormat(ITEMS_MIME_TYPE):
+            return snapshot_from_json(mime.data(ITEMS_MIME_TYPE).data())
+        return self._clipboard
+
+    @profiled("paste")
+    def _paste_with_delta(self, snapshot: Optional[dict], delta: QPointF, text: str = "Вставка"):
+        if not snapshot:
             return
         self.scene.clearSelection()
-        for it in self._clipboard["items"]:
-            obj = self._instantiate_from_dict(it, delta)
-            if obj:
-                obj.setSelected(True)
-        self.apply_layer_visibility()
+        added = self.instantiate_items(snapshot["items"], delta, snapshot["images"])
+        for obj in added:
+            obj.setSelected(True)
+        if added:
+            self.history.push(AddCommand(text, added))
+
+    # --- ИСТОРИЯ ---
+
+    def undo(self) -> None:
+        """Отменяет последний шаг (Ctrl+Z)."""
+        text = self.history.undo()
+        if text is not None:
+            self.statusBar().showMessage(f"Отменено: {text}", 3000)
+
+    def redo(self) -> None:
+        """Повторяет отменённый шаг (Ctrl+Shift+Z / Ctrl+Y)."""
+        text = self.history.redo()
+        if text is not None:
+            self.statusBar().showMessage(f"Повторено: {text}", 3000)
 
     def paste_clipboard(self) -> None:
         """Вставляет из буфера рядом со старым местом (Ctrl+V)."""
-        if not self._clipboard:
-            return
         # Сдвигаем на 1 шаг сетки, чтобы было видно дубликат
-        self._paste_with_delta(QPointF(GRID_SIZE, GRID_SIZE))
+        self._paste_with_delta(self._clipboard_snapshot(), QPointF(GRID_SIZE, GRID_SIZE))
 
     def duplicate_selection(self) -> None:
-        """Быстрый дубликат рядом от исходного выделения (Ctrl+D)."""
-        sel = self.scene.selectedItems()
-        if not sel:
-            return
-        self.copy_selection()
-        self._paste_with_delta(QPointF(GRID_SIZE, GRID_SIZE))
+        """Быстрый дубликат рядом от исходного выделения (Ctrl+D); буфер обмена не трогает."""
+        self._paste_with_delta(self._selection_snapshot(), QPointF(GRID_SIZE, GRID_SIZE), "Дублирование")
 
 
     def _place_item_at_view_center(self, item):
@@ -783,36 +4456,84 @@ class MainWindow(QMainWindow):
         item.moveBy(delta.x(), delta.y())
 
 
+    @profiled("tree/populate")
     def populate_components_tree(self):
-        """Рекурсивно сканирует COMPONENTS_DIR и строит дерево папок и PNG."""
+        """Рекурсивно сканирует COMPONENTS_DIR и строит дерево папок и PNG.
+        Дерево строится сразу с заглушками, иконки подгружаются в фоне."""
         self.component_tree.clear()
+        self._thumb_generation += 1  # результаты от прошлого обхода больше не нужны
+        self._thumb_pool.clear()     # ещё не начатые задачи старого поколения
+        self._leaf_items = {}
+        self._leaf_stamps = {}
+        self._leaf_dirs = {}
+        self._folder_items = {}
+        self._component_index.clear()
+        self._shown_leaves = set()
+        self._shown_folders = set()
+        self._best_component_match = None
+        watched = self._components_watcher.directories()
+        if watched:
+            self._components_watcher.removePaths(watched)
         os.makedirs(self.components_dir, exist_ok=True)
 
-        # Рекурсивный проход: dict {folder_path: QTreeWidgetItem}
-        root_map = {}
-        root_item = QTreeWidgetItem([os.path.basename(self.components_dir) or "components"])
-        root_item.setData(0, Qt.UserRole, {"type": "folder", "path": self.components_dir})
-        root_item.setIcon(0, QIcon.fromTheme("folder"))
+        root_item = self._make_folder_item(self.components_dir)
+        root_item.setText(0, os.path.basename(self.components_dir) or "components")
         self.component_tree.addTopLevelItem(root_item)
-        root_map[self.components_dir] = root_item
+        new_pngs = self._build_component_subtree(self.components_dir, root_item)
 
-        for dirpath, dirnames, filenames in os.walk(self.components_dir):
-            # создаём узлы для подпапок
-            parent_item = root_map.get(dirpath, None)
+        self.component_tree.expandItem(root_item)  # корень раскрыт
+        self.apply_component_filter(self.search_edit.text())  # применим текущий фильтр
+        self._request_thumbnails(new_pngs)
+
+    def _make_folder_item(self, path: str) -> QTreeWidgetItem:
+        item = QTreeWidgetItem([os.path.basename(path)])
+        item.setData(0, Qt.UserRole, {"type": "folder", "path": path})
+        item.setIcon(0, QIcon.fromTheme("folder"))
+        self._folder_items[path] = item
+        self._shown_folders.add(path)
+        if self.watch_components_cb.isChecked():
+            self._components_watcher.addPath(path)
+        return item
+
+    def _make_leaf_item(self, path: str) -> QTreeWidgetItem:
+        name = os.path.splitext(os.path.basename(path))[0]
+        leaf = QTreeWidgetItem([name])
+        leaf.setData(0, Qt.UserRole, {"type": "png_component", "path": path, "name": name})
+        leaf.setIcon(0, self._placeholder_icon)
+        self._register_leaf(path, leaf, file_stamp(path))
+        return leaf
+
+    def _register_leaf(self, path: str, leaf: QTreeWidgetItem, stamp):
+        self._leaf_items[path] = leaf
+        self._leaf_stamps[path] = stamp
+        self._leaf_dirs[path] = os.path.dirname(path)
+        self._component_index.add(path, leaf.text(0))
+        if not leaf.isHidden():
+            self._shown_leaves.add(path)
+
+    def _unregister_leaf(self, path: str):
+        self._leaf_items.pop(path, None)
+        self._leaf_stamps.pop(path, None)
+        self._leaf_dirs.pop(path, None)
+        self._component_index.remove(path)
+        self._shown_leaves.discard(path)
+        if self._best_component_match == path:
+            self._best_component_match = None
+
+    def _build_component_subtree(self, top: str, top_item: QTreeWidgetItem) -> list:
+        """Рекурсивно наполняет узел папки top. Возвращает пути новых PNG (для иконок)."""
+        root_map = {top: top_item}
+        new_pngs = []
+        for dirpath, dirnames, filenames in os.walk(top):
+            parent_item = root_map.get(dirpath)
             if parent_item is None:
-                # на случай, если обход начался не с корня
-                parent_item = QTreeWidgetItem([os.path.basename(dirpath)])
-                parent_item.setData(0, Qt.UserRole, {"type": "folder", "path": dirpath})
-                parent_item.setIcon(0, QIcon.fromTheme("folder"))
-                self.component_tree.addTopLevelItem(parent_item)
-                root_map[dirpath] = parent_item
+                continue
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]  # .optimized и прочие служебные
 
             # подпапки
             for d in sorted(dirnames):
                 full = os.path.join(dirpath, d)
-                item = QTreeWidgetItem([d])
-                item.setData(0, Qt.UserRole, {"type": "folder", "path": full})
-                item.setIcon(0, QIcon.fromTheme("folder"))
+                item = self._make_folder_item(full)
                 parent_item.addChild(item)
                 root_map[full] = item
 
@@ -820,51 +4541,202 @@ class MainWindow(QMainWindow):
             pngs = sorted([f for f in filenames if f.lower().endswith(".png")])
             for f in pngs:
                 full = os.path.join(dirpath, f)
-                name = os.path.splitext(f)[0]
-                leaf = QTreeWidgetItem([name])
-                leaf.setData(0, Qt.UserRole, {"type": "png_component", "path": full, "name": name})
-                pm = QPixmap(full)
-                if not pm.isNull():
-                    leaf.setIcon(0, QIcon(pm.scaled(40, 40, Qt.KeepAspectRatio, Qt.SmoothTransformation)))
-                parent_item.addChild(leaf)
-
-        self.component_tree.expandItem(root_item)  # корень раскрыт
-        self.apply_component_filter(self.search_edit.text())  # применим текущий фильтр
-    def apply_component_filter(self, text: str):
-        """Показывает/скрывает элементы дерева по подстроке (без учета регистра)."""
-        query = (text or "").strip().lower()
-
-        def match(item: QTreeWidgetItem) -> bool:
-            meta = item.data(0, Qt.UserRole) or {}
-            name = item.text(0).lower()
-            is_folder = meta.get("type") == "folder"
-            if not query:
-                return True  # показать всё
-            if not is_folder:
-                return query in name
-            # папка видима, если видим хоть один дочерний
+                parent_item.addChild(self._make_leaf_item(full))
+                new_pngs.append(full)
+        return new_pngs
+
+    def _forget_tree_item(self, item: QTreeWidgetItem):
+        """Убирает узел (и всё под ним) из служебных словарей и из-под наблюдения."""
+        meta = item.data(0, Qt.UserRole) or {}
+        path = meta.get("path")
+        if meta.get("type") == "folder":
             for i in range(item.childCount()):
-                if match(item.child(i)):
-                    return True
-            return False
+                self._forget_tree_item(item.child(i))
+            self._folder_items.pop(path, None)
+            self._shown_folders.discard(path)
+            if path in self._components_watcher.directories():
+                self._components_watcher.removePath(path)
+        else:
+            self._unregister_leaf(path)
+
+    @staticmethod
+    def _insert_sorted(parent: QTreeWidgetItem, item: QTreeWidgetItem):
+        """Вставка с сохранением порядка обхода: сначала папки, затем PNG, внутри — по имени."""
+        def sort_key(it):
+            meta = it.data(0, Qt.UserRole) or {}
+            return (meta.get("type") != "folder", os.path.basename(meta.get("path", "")))
+        key = sort_key(item)
+        idx = parent.childCount()
+        for i in range(parent.childCount()):
+            if sort_key(parent.child(i)) > key:
+                idx = i
+                break
+        parent.insertChild(idx, item)
+
+    def sync_component_dir(self, dirpath: str) -> list:
+        """Приводит узел одной папки в соответствие с диском: добавляет, удаляет и
+        переименовывает только затронутые элементы. Возвращает PNG, которым нужна иконка."""
+        node = self._folder_items.get(dirpath)
+        if node is None:
+            return []
+        if not os.path.isdir(dirpath):
+            parent = node.parent()
+            if parent is not None:  # корень не удаляем
+                self._forget_tree_item(node)
+                parent.removeChild(node)
+            return []
 
-        def apply(item: QTreeWidgetItem):
-            visible = match(item)
-            item.setHidden(not visible)  # <<<< ключевая замена
-            # если папка видима и есть запрос — раскроем её
-            meta = item.data(0, Qt.UserRole) or {}
-            if meta.get("type") == "folder":
-                if visible and query:
-                    item.setExpanded(True)
-                # рекурсивно на детей
-                for i in range(item.childCount()):
-                    apply(item.child(i))
+        try:
+            entries = list(os.scandir(dirpath))
+        except OSError:
+            return []
+        disk_dirs = {e.path for e in entries if e.is_dir() and not e.name.startswith(".")}
+        disk_pngs = {e.path for e in entries if e.is_file() and e.name.lower().endswith(".png")}
+
+        have_dirs, have_pngs = {}, {}
+        for i in range(node.childCount()):
+            child = node.child(i)
+            meta = child.data(0, Qt.UserRole) or {}
+            (have_dirs if meta.get("type") == "folder" else have_pngs)[meta.get("path")] = child
+
+        need_thumbs = []
+
+        # папки
+        for path in set(have_dirs) - disk_dirs:
+            self._forget_tree_item(have_dirs[path])
+            node.removeChild(have_dirs[path])
+        for path in sorted(disk_dirs - set(have_dirs)):
+            item = self._make_folder_item(path)
+            self._insert_sorted(node, item)
+            need_thumbs += self._build_component_subtree(path, item)
+
+        # PNG: исчезнувший и появившийся файл с тем же размером и mtime — переименование
+        gone = {p: self._leaf_stamps.get(p) for p in set(have_pngs) - disk_pngs}
+        for path in sorted(disk_pngs - set(have_pngs)):
+            stamp = file_stamp(path)
+            old = next((p for p, st in gone.items() if st is not None and st == stamp), None)
+            if old is not None:
+                leaf = have_pngs[old]
+                del gone[old]
+                self._unregister_leaf(old)
+                name = os.path.splitext(os.path.basename(path))[0]
+                leaf.setText(0, name)
+                leaf.setData(0, Qt.UserRole, {"type": "png_component", "path": path, "name": name})
+                self._register_leaf(path, leaf, stamp)
+                node.removeChild(leaf)
+                self._insert_sorted(node, leaf)
+            else:
+                self._insert_sorted(node, self._make_leaf_item(path))
+                need_thumbs.append(path)
+        for path in gone:
+            self._forget_tree_item(have_pngs[path])
+            node.removeChild(have_pngs[path])
+
+        # изменённые на месте файлы — только новая иконка
+        for path in disk_pngs & set(have_pngs):
+            stamp = file_stamp(path)
+            if stamp != self._leaf_stamps.get(path):
+                self._leaf_stamps[path] = stamp
+                need_thumbs.append(path)
+        return need_thumbs
+
+    def refresh_components_tree(self):
+        """«Обновить список»: досинхронизировать все известные папки без перестройки дерева."""
+        if not self._folder_items:
+            self.populate_components_tree()
+            return
+        self._sync_component_dirs(list(self._folder_items))
 
-        # ускорим массовое обновление
+    def _sync_component_dirs(self, dirs):
+        need_thumbs = []
         self.component_tree.setUpdatesEnabled(False)
-        for i in range(self.component_tree.topLevelItemCount()):
-            apply(self.component_tree.topLevelItem(i))
+        # родители раньше детей: удалённая папка не будет обходиться повторно
+        for d in sorted(dirs, key=len):
+            need_thumbs += self.sync_component_dir(d)
         self.component_tree.setUpdatesEnabled(True)
+        if self.search_edit.text().strip():
+            self.apply_component_filter(self.search_edit.text())
+        self._request_thumbnails(need_thumbs)
+
+    def _on_components_dir_changed(self, path: str):
+        self._pending_component_dirs.add(path)
+        self._components_sync_timer.start()
+
+    def _flush_component_dirs(self):
+        dirs, self._pending_component_dirs = self._pending_component_dirs, set()
+        self._sync_component_dirs(dirs)
+
+    def set_components_watch_enabled(self, enabled: bool):
+        watched = self._components_watcher.directories()
+        if watched:
+            self._components_watcher.removePaths(watched)
+        if enabled and self._folder_items:
+            self._components_watcher.addPaths(list(self._folder_items))
+            self.refresh_components_tree()  # догоняем то, что поменялось без слежения
+
+    def _request_thumbnails(self, paths: list):
+        for i in range(0, len(paths), THUMBS_PER_JOB):
+            job = ThumbnailJob(self._thumb_generation, paths[i:i + THUMBS_PER_JOB],
+                               self._thumb_cache_dir, self._thumb_signals)
+            self._thumb_pool.start(job)
+
+    def _on_thumbnail_ready(self, generation: int, path: str, img: QImage):
+        if generation != self._thumb_generation:
+            return
+        leaf = self._leaf_items.get(path)
+        if leaf is not None:
+            leaf.setIcon(0, QIcon(QPixmap.fromImage(img)))
+    @profiled("tree/filter")
+    def apply_component_filter(self, text: str):
+        """Фильтр дерева по индексу имён (без учета регистра, с транслитерацией и опечатками).
+        Меняется видимость только тех узлов, у которых она действительно изменилась."""
+        query = (text or "").strip()
+        if query:
+            ranked = self._component_index.search(query)
+            leaves = {key for _, key in ranked}
+            folders = set()
+            for d in {self._leaf_dirs[key] for key in leaves}:
+                while d in self._folder_items and d not in folders:
+                    folders.add(d)
+                    d = os.path.dirname(d)
+        else:
+            ranked = []
+            leaves = set(self._leaf_items)
+            folders = set(self._folder_items)
+
+        tree = self.component_tree
+        tree.setUpdatesEnabled(False)
+        for key in self._shown_leaves - leaves:
+            self._leaf_items[key].setHidden(True)
+        for key in leaves - self._shown_leaves:
+            self._leaf_items[key].setHidden(False)
+        for key in self._shown_folders - folders:
+            self._folder_items[key].setHidden(True)
+        for key in folders - self._shown_folders:
+            self._folder_items[key].setHidden(False)
+        if query:
+            # если папка видима и есть запрос — раскроем её
+            for key in folders:
+                item = self._folder_items[key]
+                if not item.isExpanded():
+                    item.setExpanded(True)
+        tree.setUpdatesEnabled(True)
+        self._shown_leaves, self._shown_folders = leaves, folders
+
+        # лучший результат — текущий элемент (Enter в поиске добавит его на сцену)
+        best_key = ranked[0][1] if ranked else None
+        if best_key is not None and best_key != self._best_component_match:
+            best = self._leaf_items[best_key]
+            tree.setCurrentItem(best)
+            tree.scrollToItem(best)
+        self._best_component_match = best_key
+
+    def add_best_component_match(self):
+        if self._search_timer.isActive():
+            self._search_timer.stop()
+            self.apply_component_filter(self.search_edit.text())
+        if self._best_component_match is not None:
+            self.add_component_to_scene(self._leaf_items[self._best_component_match])
 
 
     def show_shortcuts(self):
@@ -883,6 +4755,7 @@ class MainWindow(QMainWindow):
          "Ctrl + / Ctrl - — масштаб PNG (если PNG выделен)<br>"
          "Ctrl+C / Ctrl+V — копировать / вставить<br>"
          "Ctrl+D — дублировать рядом<br>"
+         "Ctrl+Z — отменить; Ctrl+Shift+Z / Ctrl+Y — повторить<br>"
          "Delete — удаление<br>"
          "PageUp / PageDown — слой выше / ниже<br>"
          "Перетащить за левую границу — удалить<br>"
@@ -890,21 +4763,51 @@ class MainWindow(QMainWindow):
          "<b>Файл</b><br>"
          "Ctrl+S — сохранить проект (JSON)<br>"
             "Ctrl+O — открыть проект (JSON)<br>"
-            "Ctrl+E — экспорт PNG<br>"
+            "Ctrl+E — экспорт PNG/SVG/PDF<br>"
         )
-    def apply_background_theme(self):
-        """Ставит background.png как фон окна, левую панель делает полупрозрачной."""
-        app_dir = os.path.dirname(os.path.abspath(__file__))
-        bg_path = os.path.join(app_dir, "background.png")
-        if not os.path.exists(bg_path):
+    def set_profiling(self, enabled: bool):
+        """Включает замеры горячих путей и оверлей со сводкой."""
+        PROFILER.enabled = bool(enabled)
+        self.profiler_overlay.setVisible(PROFILER.enabled)
+
+    def export_profile_trace(self):
+        """Сохраняет накопленные интервалы как трассу для chrome://tracing / Perfetto."""
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить трассу", "optics_trace.json", "Trace JSON (*.json)")
+        if not path:
+            return
+        try:
+            n = PROFILER.export_chrome_trace(path)
+        except OSError as e:
+            QMessageBox.warning(self, "Трасса", f"Не удалось записать файл:\n{e}")
             return
+        self.statusBar().showMessage(f"Трасса: {n} интервалов → {path}", 6000)
+
+    def show_pixmap_cache_stats(self):
+        st = PIXMAP_CACHE.stats()
+        QMessageBox.information(self, "Кэш картинок",
+            f"Картинок в кэше: {st['entries']}<br>"
+            f"Память: {st['bytes'] / 2**20:.1f} из {st['budget_bytes'] / 2**20:.0f} МБ<br>"
+            f"Попаданий: {st['hits']}; промахов: {st['misses']}; вытеснено: {st['evictions']}"
+        )
 
-        bg_url = bg_path.replace("\\", "/")
+    def background_enabled(self) -> bool:
+        return self.settings.value("background/enabled", True, type=bool)
 
-        root_qss = f'''
-        QWidget#RootContainer {{
-            border-image: url("{bg_url}") 0 0 0 0 stretch stretch;
-        }}'''
+    def set_background_enabled(self, enabled: bool):
+        """Фоновая картинка отключается ради скорости перерисовки; выбор запоминается."""
+        self.settings.setValue("background/enabled", bool(enabled))
+        self.apply_background_theme()
+
+    def apply_background_theme(self):
+        """Ставит background.png как фон окна, левую панель делает полупрозрачной.
+        Файл декодируется один раз и делится между окном и областью рисования."""
+        pixmap = None
+        if self.background_enabled():
+            if self._background_pixmap is None:
+                app_dir = os.path.dirname(os.path.abspath(__file__))
+                pm = QPixmap(os.path.join(app_dir, "background.png"))
+                self._background_pixmap = pm if not pm.isNull() else None
+            pixmap = self._background_pixmap
 
         left_qss = """
         QWidget#LeftPanel {
@@ -913,11 +4816,12 @@ class MainWindow(QMainWindow):
         }
         """
 
-        # фон для области рисования — через сам GraphicsView
-        self.view.set_background(bg_path)
+        # фон окна и области рисования — одна и та же картинка
+        self.root_container.set_background(pixmap)
+        self.view.set_background(pixmap)
 
         # применяем общий стиль
-        self.setStyleSheet(root_qss + left_qss)
+        self.setStyleSheet(left_qss)
         self.view.setBackgroundBrush(Qt.NoBrush)
 
     def active_layer_name(self) -> str:
@@ -927,18 +4831,89 @@ class MainWindow(QMainWindow):
         set_item_layer(item, self.active_layer_name())
 
     def apply_layer_visibility(self):
-        visible = {}
+        """Флажки видимости -> сцена. Обходятся только элементы слоёв, чей флажок изменился;
+        новые элементы сцена сама показывает или прячет по их слою."""
         for i in range(self.layers_list.count()):
             it = self.layers_list.item(i)
-            visible[it.text()] = (it.checkState() == Qt.Checked)
-        for item in self.scene.items():
-            lname = get_item_layer(item)
-            if lname is None:
-                continue
-            item.setVisible(visible.get(lname, True))
+            self.scene.set_layer_visible(it.text(), it.checkState() == Qt.Checked)
+
+    def rebuild_layer_widgets(self):
+        """Выпадающий список активного слоя и флажки видимости по scene.layer_names."""
+        current = self.layer_combo.currentText()
+        self.layer_combo.blockSignals(True)
+        self.layer_combo.clear()
+        self.layer_combo.addItems(self.scene.user_layer_names())
+        if current in self.scene.layer_names:
+            self.layer_combo.setCurrentText(current)
+        self.layer_combo.blockSignals(False)
+
+        self.layers_list.blockSignals(True)
+        self.layers_list.clear()
+        for name in self.scene.layer_names:
+            it = QListWidgetItem(name)
+            it.setFlags(it.flags() | Qt.ItemIsUserCheckable)
+            it.setCheckState(Qt.Checked if self.scene.is_layer_visible(name) else Qt.Unchecked)
+            self.layers_list.addItem(it)
+        self.layers_list.blockSignals(False)
+
+    def select_layer(self, name: str):
+        """Выделяет все элементы слоя (по индексу сцены, без обхода остальных)."""
+        self.scene.clearSelection()
+        for it in self.scene.layer_items(name):
+            it.setSelected(True)
+
+    def move_layer_contents(self, src: str, dst: str):
+        """Переносит всё содержимое слоя на другой слой (одним шагом истории)."""
+        self.history.track(self.scene.layer_items(src))
+        self.scene.move_layer_items(src, dst)
+        self.history.commit("Перенос слоя")
+
+    def add_layer(self):
+        name, ok = QInputDialog.getText(self, "Новый слой", "Имя слоя:",
+                                        text=f"Слой {len(self.scene.user_layer_names())}")
+        name = name.strip()
+        if ok and not self.scene.add_layer(name):
+            QMessageBox.warning(self, "Новый слой", f"Слой «{name}» уже есть или имя пустое.")
+
+    def rename_layer(self, old: str):
+        name, ok = QInputDialog.getText(self, "Переименовать слой", "Имя слоя:", text=old)
+        name = name.strip()
+        if ok and name != old and not self.scene.rename_layer(old, name):
+            QMessageBox.warning(self, "Переименовать слой", f"Слой «{name}» уже есть или имя пустое.")
+
+    def remove_layer(self, name: str):
+        users = self.scene.user_layer_names()
+        move_to = users[users.index(name) - 1] if users.index(name) > 0 else users[1]
+        if self.scene.layer_items(name):
+            answer = QMessageBox.question(
+                self, "Удалить слой",
+                f"Объекты слоя «{name}» будут перенесены на «{move_to}». Продолжить?")
+            if answer != QMessageBox.Yes:
+                return
+        self.move_layer_contents(name, move_to)
+        self.scene.remove_layer(name, move_to)
+
+    def _layers_context_menu(self, pos):
+        it = self.layers_list.itemAt(pos)
+        if it is None or it.text() == "Сетка":
+            return
+        name = it.text()
+        users = self.scene.user_layer_names()
+        menu = QMenu(self)
+        menu.addAction("Выделить всё на слое", lambda: self.select_layer(name))
+        move_menu = menu.addMenu("Перенести содержимое на")
+        for other in users:
+            if other != name:
+                move_menu.addAction(other, lambda dst=other: self.move_layer_contents(name, dst))
+        menu.addSeparator()
+        menu.addAction("Переименовать…", lambda: self.rename_layer(name))
+        act_remove = menu.addAction("Удалить слой", lambda: self.remove_layer(name))
+        act_remove.setEnabled(len(users) > 1)
+        menu.exec(self.layers_list.viewport().mapToGlobal(pos))
 
     def bump_selected_layer(self, delta: int):
-        user_layers = [n for n in LAYER_NAMES if n != "Сетка"]
+        user_layers = self.scene.user_layer_names()
+        self.history.track(self.scene.selectedItems())
         for item in self.scene.selectedItems():
             lname = get_item_layer(item)
             if lname not in user_layers:
@@ -947,7 +4922,7 @@ class MainWindow(QMainWindow):
             new_idx = max(0, min(len(user_layers) - 1, idx + delta))
             new_name = user_layers[new_idx]
             set_item_layer(item, new_name)
-        self.apply_layer_visibility()
+        self.history.commit("Смена слоя")
 
     # --- ХОЛСТ ---
     def apply_canvas_size_from_ui(self):
@@ -982,32 +4957,58 @@ class MainWindow(QMainWindow):
         self.redraw_grid()
 
 
-    # --- ЭКСПОРТ PNG ---
+    # --- ЭКСПОРТ PNG/SVG/PDF ---
     def export_canvas_png(self):
-        path, _ = QFileDialog.getSaveFileName(self, "Сохранить PNG", "optical_scheme.png", "PNG Files (*.png)")
+        path, flt = QFileDialog.getSaveFileName(self, "Экспорт холста", "optical_scheme.png",
+                                                ";;".join(EXPORT_FORMATS))
         if not path:
             return
-
+        # явно набранное расширение важнее выбранного фильтра
+        if os.path.splitext(path)[1].lower() not in EXPORT_FORMATS.values():
+            path += EXPORT_FORMATS.get(flt, ".png")
+        self.export_canvas(path)
+
+    @profiled("export")
+    def export_canvas(self, path: str):
+        """Экспорт холста в path; формат по расширению: PNG (полосами, с прогрессом
+        и отменой), SVG или PDF (векторы, каждая картинка в файле один раз)."""
         hidden_grid = False
         if self.export_without_grid_cb.isChecked() and self.grid_visible:
             hidden_grid = True
             self.set_grid_visible(False)
         rect = self.scene.sceneRect()  # используем реальный прямоугольник сцены
-        img = QImage(int(rect.width()), int(rect.height()), QImage.Format_ARGB32)
-        img.fill(Qt.white)
 
-        p = QPainter(img)
-        p.setRenderHint(QPainter.Antialiasing, True)
-        # target — (0,0,w,h) картинки, source — реальный прямоугольник сцены
-        self.scene.render(p, target=QRectF(0, 0, rect.width(), rect.height()), source=rect)
-        p.end()
-        img.save(path, "PNG")
+        # PNG рендерится полосами прямо в файл: память не растёт с размером холста.
+        # SVG и PDF пишутся одним проходом QPainter — прогрессу и отмене там не за что зацепиться
+        dlg, progress = None, None
+        if os.path.splitext(path)[1].lower() not in (".svg", ".pdf"):
+            dlg = QProgressDialog("Экспорт…", "Отмена", 0, max(1, int(rect.height())), self)
+            dlg.setWindowTitle("Экспорт")
+            dlg.setWindowModality(Qt.WindowModal)
+            dlg.setMinimumDuration(300)
+
+            def progress(done, total):
+                dlg.setMaximum(total)
+                dlg.setValue(done)
+                QApplication.processEvents()
+                return not dlg.wasCanceled()
 
-        if hidden_grid:
-            self.set_grid_visible(True)
+        try:
+            ok = render_scene_file(self.scene, rect, path, 1.0, progress)
+        except OSError as e:
+            ok = False
+            QMessageBox.warning(self, "Экспорт", f"Не удалось записать файл:\n{e}")
+        finally:
+            if dlg is not None:
+                dlg.close()
+            if hidden_grid:
+                self.set_grid_visible(True)
+        if ok:
+            self.statusBar().showMessage(f"Экспортировано: {path}", 6000)
 
     def set_grid_visible(self, visible: bool):
         self.grid_visible = visible
+        self.scene.grid_visible = visible
         self.view.viewport().update()
 
     # --- ДОБАВЛЕНИЕ ---
@@ -1027,102 +5028,270 @@ class MainWindow(QMainWindow):
 
         if meta.get("type") == "png_component":
             path = meta.get("path", "")
-            pm = QPixmap(path)
-            if pm.isNull():
+            variant = optimized_component(path, self.components_dir, self.asset_manifest())
+            obj = ScalablePixmapItem.from_file(variant or path)
+            if obj is None:
                 return
-            obj = ScalablePixmapItem(pm)
             obj.setToolTip(meta.get("name", os.path.basename(path)))
             self.scene.addItem(obj)
             self.assign_to_active_layer(obj)
             self._place_item_at_view_center(obj)
+            self.history.push(AddCommand("Новый объект", [obj]))
         # по папке ничего не делаем (можно позже сделать добавление всей папки на слой)
 
+    def asset_manifest(self) -> dict:
+        """manifest.json облегчённых копий; перечитывается, если его переписали (и из CLI)."""
+        stamp = file_stamp(os.path.join(asset_build_dir(self.components_dir), ASSET_MANIFEST_NAME))
+        if stamp != self._asset_manifest_stamp:
+            self._asset_manifest = load_asset_manifest(self.components_dir) if stamp else {}
+            self._asset_manifest_stamp = stamp
+        return self._asset_manifest
+
+    def optimize_component_library(self):
+        """Собирает облегчённые копии PNG библиотеки (пулом процессов, с прогрессом)."""
+        dlg = self._job_dialog("Оптимизация библиотеки…", "Библиотека компонентов")
+
+        def progress(done, total):
+            dlg.setMaximum(max(1, total))
+            dlg.setValue(done)
+            QApplication.processEvents()
+            return not dlg.wasCanceled()
+
+        try:
+            summary = build_asset_library(self.components_dir, progress=progress)
+        except OSError as e:
+            QMessageBox.warning(self, "Оптимизация", f"Не удалось записать копии:\n{e}")
+            return
+        finally:
+            dlg.close()
+        if summary["failed"]:
+            rel, err = summary["failed"][0]
+            QMessageBox.warning(self, "Оптимизация",
+                                f"Не удалось обработать файлов: {len(summary['failed'])}\n{rel}: {err}")
+        self.statusBar().showMessage(
+            f"Библиотека: собрано {summary['built']}, без изменений {summary['cached']}; "
+            f"PNG {summary['source_bytes'] / 1048576:.1f} МБ -> {summary['bytes'] / 1048576:.1f} МБ", 8000)
+
     def load_png(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Выбери PNG", "", "PNG Files (*.png)")
         if file_path:
-            pixmap = QPixmap(file_path)
-            if pixmap.isNull():
+            item = ScalablePixmapItem.from_file(file_path)
+            if item is None:
                 return
-            item = ScalablePixmapItem(pixmap)
             item.setToolTip(os.path.splitext(os.path.basename(file_path))[0])
             self.scene.addItem(item)
             self.assign_to_active_layer(item)
             self._place_item_at_view_center(item)
+            self.history.push(AddCommand("Новый объект", [item]))
 
     # === СЕРИАЛИЗАЦИЯ/ДЕСЕРИАЛИЗАЦИЯ ПРОЕКТА ===
-    def _pixmap_to_b64(self, pixmap: QPixmap) -> str:
-        img = pixmap.toImage()
-        ba = QByteArray()
-        buf = QBuffer(ba)
-        buf.open(QIODevice.WriteOnly)
-        img.save(buf, "PNG")
-        buf.close()
-        return base64.b64encode(bytes(ba)).decode("ascii")
-
-    def _pixmap_from_b64(self, data_b64: str) -> QPixmap:
-        raw = base64.b64decode(data_b64.encode("ascii"))
-        ba = QByteArray(raw)
-        img = QImage.fromData(ba, "PNG")
-        return QPixmap.fromImage(img)
-
-    def _transform_to_list(self, t: QTransform):
-        return [t.m11(), t.m12(), t.m13(), t.m21(), t.m22(), t.m23(), t.m31(), t.m32(), t.m33()]
-
-    def _transform_from_list(self, lst):
-        return QTransform(lst[0], lst[1], lst[2],
-                          lst[3], lst[4], lst[5],
-                          lst[6], lst[7], lst[8])
+    def _report_decode(self, decoder: AssetDecoder):
+        if decoder.changed:
+            self.statusBar().showMessage(f"Изменён файл компонента: {decoder.changed[-1]}", 6000)
+        if decoder.missing:
+            self.statusBar().showMessage(f"Не удалось загрузить картинок: {decoder.missing}", 6000)
+
+    def _job_dialog(self, text: str, title: str) -> QProgressDialog:
+        dlg = QProgressDialog(text, "Отмена", 0, 1000, self)
+        dlg.setWindowTitle(title)
+        dlg.setWindowModality(Qt.WindowModal)
+        dlg.setMinimumDuration(300)
+        return dlg
 
     def save_project_json(self) -> None:
-        """Сохраняет все объекты сцены в JSON (Ctrl+S)."""
-        path, _ = QFileDialog.getSaveFileName(
-            self, "Сохранить проект", "project.json", "JSON Files (*.json)"
+        """Сохраняет все объекты сцены в JSON или .optz (Ctrl+S)."""
+        path, flt = QFileDialog.getSaveFileName(
+            self, "Сохранить проект", "project.json", PROJECT_SAVE_FILTERS
         )
         if not path:
             return
-
-        items = []
-        for it in self.iter_scene_items():
-            d = self.serialize_item(it)
-            if d:
-                items.append(d)
-
-        data = {
-            "scene": {"width": self.scene_width, "height": self.scene_height},
-            "items": items,
+        if flt == PROJECT_OPTZ_FILTER and not is_optz_path(path):
+            path = os.path.splitext(path)[0] + PROJECT_OPTZ_EXT
+        self.save_project(path)
+
+    @profiled("save")
+    def save_project(self, path: str) -> None:
+        """Пишет сцену в path (формат — по расширению: JSON или .optz).
+        Элементы сериализуются пачками между итерациями цикла событий,
+        а в файл их пишет фоновый поток."""
+        linked = self.save_linked_cb.isChecked()
+        items = list(self.iter_scene_items())
+        # таблица assets нужна до элементов: собираем её первым проходом (без кодирования)
+        assets = {}
+        for it in items:
+            if isinstance(it, ScalablePixmapItem):
+                register_asset(it.image, assets, self.components_dir if linked else None)
+
+        header = {
+            "version": PROJECT_FORMAT_VERSION,
+            "scene": {"width": self.scene_width, "height": self.scene_height,
+                      "layers": self.scene.user_layer_names()},
         }
-
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        writer = project_writer(path, header, assets)
+        writer.start()
+        dlg = self._job_dialog("Сохранение проекта…", "Сохранение")
+        total = max(1, len(assets) + len(items))
+
+        def pump() -> bool:
+            dlg.setValue(1000 * (writer.assets_written + writer.items_written) // total)
+            QApplication.processEvents()
+            return not dlg.wasCanceled()
+
+        cancelled = False
+        for start in range(0, len(items), SAVE_BATCH_ITEMS):
+            with PROFILER.span("save/serialize"):
+                for it in items[start:start + SAVE_BATCH_ITEMS]:
+                    d = self.serialize_item(it, assets, linked)
+                    if d:
+                        writer.put(d)
+            if not pump():
+                cancelled = True
+                break
+        if cancelled:
+            writer.cancel()
+        else:
+            writer.finish()
+        while writer.is_alive():
+            writer.join(0.05)
+            if not cancelled and not pump():
+                cancelled = True
+                writer.cancel()
+        dlg.close()
+
+        if writer.error is not None:
+            QMessageBox.warning(self, "Сохранение", f"Не удалось записать файл:\n{writer.error}")
+        elif cancelled:
+            self.statusBar().showMessage("Сохранение отменено", 6000)
+        else:
+            self.statusBar().showMessage(f"Сохранено: {path}", 6000)
 
     def load_project_json(self) -> None:
-        """Открывает проект из JSON (Ctrl+O)."""
+        """Открывает проект из JSON или .optz (Ctrl+O)."""
         path, _ = QFileDialog.getOpenFileName(
-            self, "Открыть проект", "", "JSON Files (*.json)"
+            self, "Открыть проект", "", PROJECT_OPEN_FILTERS
         )
-        if not path:
+        if path:
+            self.open_project(path)
+
+    @profiled("load")
+    def open_project(self, path: str) -> None:
+        """Заменяет сцену проектом из path (JSON или .optz).
+        Файл разбирается потоково в фоне, картинки декодируются в пуле потоков,
+        элементы создаются пачками между итерациями цикла событий — пока вне сцены.
+        Текущая сцена заменяется только после того, как файл прочитан целиком:
+        ошибка или отмена оставляют её (и журнал автосохранения) нетронутой."""
+        events, stop = queue.Queue(maxsize=LOAD_QUEUE_EVENTS), threading.Event()
+        reader = threading.Thread(target=read_project_events, args=(path, events, stop), daemon=True)
+        reader.start()
+
+        decoder = AssetDecoder(self.components_dir)
+        dlg = self._job_dialog("Открытие проекта…", "Открытие")
+        fraction = [0, 1]
+
+        def pump() -> bool:
+            dlg.setValue(1000 * fraction[0] // max(1, fraction[1]))
+            QApplication.processEvents()
+            return not dlg.wasCanceled()
+
+        batch, built, loaded, header = [], {}, {}, None  # built/loaded: uid -> элемент / его словарь
+        error, cancelled = None, False
+
+        def flush() -> bool:
+            # v2: каждая картинка декодируется один раз и делится между элементами
+            if not decoder.finish(pump):
+                return False
+            with PROFILER.span("load/instantiate"):
+                for it in batch:
+                    obj = build_item(it, QPointF(0, 0), decoder.decoded)
+                    if obj is not None:
+                        uid = new_item_uid()
+                        obj.setData(ITEM_UID_ROLE, uid)
+                        built[uid], loaded[uid] = obj, it
+            batch.clear()
+            return pump()
+
+        while True:
+            try:
+                kind, value, fraction[0], fraction[1] = events.get(timeout=0.05)
+            except queue.Empty:
+                decoder.collect(0)
+                if not pump():
+                    cancelled = True
+                    break
+                continue
+            if kind == "scene":
+                header = value
+            elif kind == "asset":
+                decoder.submit(*value)
+            elif kind == "item":
+                batch.append(decoder.lift_inline(value))
+                if len(batch) >= LOAD_BATCH_ITEMS and not flush():
+                    cancelled = True
+                    break
+            elif kind == "error":
+                error = value
+                break
+            elif kind == "end":
+                cancelled = not flush()
+                break
+
+        stop.set()
+        reader.join()
+        decoder.cancel()
+        dlg.close()
+
+        if error is not None or cancelled:
+            # собранные элементы так и не попали на сцену — текущий проект остаётся как был
+            if error is not None:
+                QMessageBox.warning(self, "Открытие проекта", f"Не удалось прочитать файл:\n{error}")
+            else:
+                self.statusBar().showMessage("Загрузка отменена", 6000)
             return
 
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # очистим сцену и перерисуем сетку под новые размеры
-        self.scene.clear()
-
-        sc = data.get("scene", {})
-        w = int(sc.get("width", self.scene_width))
-        h = int(sc.get("height", self.scene_height))
-        self.set_canvas_size(w, h)
-
-        for it in data.get("items", []):
-            self.instantiate_item(it, QPointF(0, 0))
-
-        # вернуть видимость слоёв по текущим флажкам
-        self.apply_layer_visibility()
+        # файл прочитан целиком — сцена подменяется одним шагом: BSP-индекс строится
+        # один раз, после всех элементов, а холст перерисовывается только в конце.
+        # Журнал автосохранения на это время отключён: прочитанный проект станет его
+        # снимком, а не потоком записей add
+        autosave = self._autosave_journal is not None
+        self.stop_autosave()
+        with self.scene.suspended_index(), self.view.suspended_updates():
+            self.scene.clear()
+            if header is not None:
+                self.set_canvas_size(int(header.get("width", self.scene_width)),
+                                     int(header.get("height", self.scene_height)))
+                self.scene.set_layers(header.get("layers", LAYER_NAMES))
+            with PROFILER.span("load/instantiate"):
+                self.scene.add_items(list(built.values()))
+        if autosave:
+            self.start_autosave(self.loaded_journal_state(loaded, decoder), built)
+        self._report_decode(decoder)
+
+    def loaded_journal_state(self, loaded: dict, decoder: AssetDecoder) -> dict:
+        """Состояние журнала из уже разобранных словарей проекта: ключи картинок
+        приводятся к тем, что дал бы serialize_item, записи assets берутся из файла."""
+        state = new_journal_state()
+        rect = self.scene.sceneRect()
+        state["scene"] = {"width": int(rect.width()), "height": int(rect.height()),
+                          "layers": self.scene.user_layer_names()}
+        assets, items = state["assets"], state["items"]
+        for uid, it in loaded.items():
+            if "asset" in it:
+                image = decoder.decoded[it["asset"]]
+                if image.key not in assets:
+                    assets[image.key] = decoder.entries[it["asset"]]
+                it = dict(it, asset=image.key)
+            items[uid] = it
+        return state
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["render"]:
+        sys.exit(render_cli(sys.argv[2:]))
+    if sys.argv[1:2] == ["optimize"]:
+        sys.exit(optimize_cli(sys.argv[2:]))
     app = QApplication(sys.argv)
+    # картинки из общего кэша должны освободиться раньше, чем сам QApplication
+    app.aboutToQuit.connect(PIXMAP_CACHE.clear)
     window = MainWindow()
     window.show()
     sys.exit(app.exec())